@@ -4,6 +4,7 @@ import random
 import string
 from src.REEL.pre_process import pre_process
 from src.REEL.post_process import process_results
+from src.REEL.ppr_cache import check_ppr_binary, update_ppr_cache
 from src.abbreviation_detector.run import run_Ab3P
 from src.abbreviation_detector.prepare_dataset import prepare_dataset
 
@@ -24,6 +25,34 @@ if __name__ == "__main__":
         choices = ['bc5cdr_dis', 'bc5cdr_chem', 'ncbi_disease', 
         'biored_dis', 'biored_chem'])
     parser.add_argument("--gold_standard", type=bool, default=False)
+    parser.add_argument("--retrieval", type=str, default='exhaustive',
+        choices=['exhaustive', 'ngram', 'symspell', 'batch', 'tfidf'], 
+        help='exhaustive: score the mentions against every KB string, '
+        'ngram: score only the KB strings shortlisted by a character n-gram '
+        'index, symspell: score only the KB strings within edit distance 2 '
+        'found with a symmetric deletion dictionary, batch: score all the '
+        'uncached mentions against every KB string at once using several '
+        'threads, tfidf: score all the uncached mentions against the KB '
+        'strings shortlisted by a sparse TF-IDF character n-gram matrix')
+    parser.add_argument("--workers", type=int, default=1,
+        help='Number of threads for --retrieval batch and of processes '
+        'writing the candidates files (-1 to use all cores)')
+    parser.add_argument("--sub_lexicon", action='store_true',
+        help='With --retrieval exhaustive or batch, only search the KB '
+        'strings that may reach the min match score against some mention '
+        'of the input (the retrieved candidates are the same)')
+    parser.add_argument("--window", type=str, default='none',
+        choices=['none', 'passage', 'sentence'],
+        help='Only add coherence edges to the disambiguation graphs between '
+        'mentions in nearby passages or sentences of the (BioC) documents')
+    parser.add_argument("--window_size", type=int, default=1,
+        help='Max number of passages or sentences between linked mentions')
+    parser.add_argument("--bypass_margin", type=float, default=None,
+        help='Besides the mentions with a single candidate concept, resolve '
+        'the mentions with an exact match whose score exceeds the score of '
+        'any other candidate by this margin without PPR (e.g. 0.1)')
+    parser.add_argument("--ppr_seed", type=int, default=5,
+        help='Seed of the random walks of the PPR step')
 
     args = parser.parse_args()
 
@@ -38,6 +67,14 @@ if __name__ == "__main__":
 
     entity_type = entity_type_dict[args.kb] 
 
+    # The window, the seed and the PPR results cache require the PPR step
+    # compiled from the current source
+    if not check_ppr_binary():
+        raise FileNotFoundError(
+            'src/REEL/ppr_for_ned_all.class is missing or outdated: compile '
+            'the PPR step with "javac src/REEL/ppr_for_ned_all.java" (see '
+            'README.md)')
+
     # ----------------------------------------------------------------
     # Get abbreviations with AB3P in each document of the dataset
     # ----------------------------------------------------------------
@@ -62,9 +99,12 @@ if __name__ == "__main__":
     #         graph is built, it runs the PPR algorithm over the graph            
     #         and ranks each candidate.                                           
     #-------------------------------------------------------------------------#
-    comm = 'java -classpath :src/REEL/ ppr_for_ned_all {}'.\
-        format(args.run_id) 
+    comm = 'java -classpath :src/REEL/ ppr_for_ned_all {} {} {}'.\
+        format(args.run_id, args.window_size, args.ppr_seed) 
     os.system(comm)
+
+    # Store the results of the graphs that were not in the PPR results cache
+    update_ppr_cache(args.run_id, 'data/REEL/cache/ppr.sqlite')
     
     #-------------------------------------------------------------------------#
     #                               POST-PROCESSING                                
@@ -11,17 +11,10 @@
 ./convert_input.sh
 
 #-----------------------------------------------------------------------------
-#                      Generate the KB dicts for REEL
+#   Generate the KB dicts for REEL, augment them with the annotations from the 
+#   training and development sets and extract the relations from the corpora
+#
+#   Only the files whose inputs (KB files, corpora, code and parameters) 
+#   changed since the last build are generated again, see src/REEL/build.py
 #-----------------------------------------------------------------------------
-python src/REEL/generate_dicts.py -kb medic -mode reel --include_omim False
-python src/REEL/generate_dicts.py -kb medic -mode reel --include_omim True
-python src/REEL/generate_dicts.py -kb ctd_chem -mode reel --include_omim False
-
-#-----------------------------------------------------------------------------
-# Augment the KB dicts with annotations from the training and development sets
-#-----------------------------------------------------------------------------
-python src/REEL/dataset_entities.py -kb medic -dataset bc5cdr_dis
-python src/REEL/dataset_entities.py -kb ctd_chem -dataset bc5cdr_chem
-python src/REEL/dataset_entities.py -kb medic -dataset ncbi_disease --include_omim True
-python src/REEL/dataset_entities.py -kb medic -dataset biored_dis
-python src/REEL/dataset_entities.py -kb ctd_chem -dataset biored_chem
\ No newline at end of file
+python src/REEL/build.py --jobs -1
@@ -1,6 +1,7 @@
 import orjson as json
 import numpy as np
 from rapidfuzz import process, fuzz
+from src.REEL.kb_artifact import load_compiled_kb
 
 
 class WordConcept:
@@ -380,6 +381,12 @@ def get_kb_data(partition):
     :rtype: KnowledgeBase object
     """
 
+    # The compiled KB artifact is memory-mapped instead of parsing the JSON
+    compiled_kb = load_compiled_kb('data/kbs/dicts/{}/'.format(partition))
+
+    if compiled_kb is not None and partition != 'chebi':
+        return compiled_kb.get_id_to_name()
+
     source_filename = 'data/kbs/dicts/{}/id_to_name.json'.format(partition)
 
     if partition == 'chebi':
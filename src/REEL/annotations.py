@@ -1,6 +1,8 @@
+import bisect
 import logging
 import json
 import os
+import re
 import xml.etree.ElementTree as ET
 import sys
 from tqdm import tqdm
@@ -9,6 +11,27 @@ from src.REEL.utils import check_if_annotation_is_valid
 sys.path.append("./")
 
 
+# A sentence ends with '.', '!' or '?' followed by whitespace and by the
+# first character of the next sentence
+sentence_boundary = re.compile(r'[.!?]\s+(?=[A-Z0-9(\[])')
+
+
+def get_sentence_starts(text):
+    """Split given passage text into sentences.
+
+    :param text: the text of a passage
+    :type text: str
+    :return: sentence_starts, the offsets of the first character of each
+        sentence relative to the start of the passage
+    :rtype: list
+
+    >>> get_sentence_starts('Hepatitis B. Liver damage.')
+    [0, 13]
+    """
+
+    return [0] + [match.end() for match in sentence_boundary.finditer(text)]
+
+
 def check_if_composite(entity_text):
     """Check if given entity text is a composed entity (e.g. 'Cerebellar and 
     oculomotor dysfunction'). loosely based on the approach by 
@@ -190,7 +213,9 @@ def parse_bioc_xml(
     :type gold_standard: bool
     :param run_id: identification of current run
     :type run_id: str
-    :returns annotations: dictionary with the annotations of all input documents
+    :returns annotations: dictionary with the annotations of all input 
+        documents, with format {doc_id: [(kb_id, text, composite_role, 
+        passage_index, sentence_index)]}
     :rtype: dict
     """
   
@@ -210,6 +235,8 @@ def parse_bioc_xml(
         if document.tag == "document":
             doc_id = ''
             annotations_temp = []
+            passage_index = -1
+            sentence_index = 0
                
             for subelement in document:
                 
@@ -222,15 +249,34 @@ def parse_bioc_xml(
                     
                 elif subelement.tag == "passage":
                     # A document includes 1 or more passages
+                    passage_index += 1
+                    passage_offset = 0
+                    sentence_starts = [0]
+                    
+                    # The sentences are numbered across the whole document
+                    sentence_base = sentence_index
+                    sentence_index += 1
+
                     # Iterate over each annotation in current passage 
                     for subelement2 in subelement:                                
+
+                        if subelement2.tag == "offset":
+                            passage_offset = int(subelement2.text)
+                        
+                        elif subelement2.tag == "text" and \
+                                subelement2.text is not None:
+                            sentence_starts = get_sentence_starts(
+                                subelement2.text)
+                            sentence_index = sentence_base + \
+                                len(sentence_starts)
                                                             
-                        if subelement2.tag == "annotation":
+                        elif subelement2.tag == "annotation":
                             entity_text = ''
                             kb_id = ''
                             annotation_type = ''
                             is_composite_or_individual = '' 
                             sub_entities = []
+                            annotation_sentence = sentence_base
                             
                             # Retrieve the information about the annotation
                             for subelement3 in subelement2: 
@@ -254,6 +300,15 @@ def parse_bioc_xml(
 
                                 elif subelement3.tag == "identifier":
                                     kb_id = subelement3.text
+
+                                elif subelement3.tag == "location":
+                                    # Sentence of the passage that contains
+                                    # the start of the mention
+                                    annotation_sentence = sentence_base + \
+                                        bisect.bisect_right(
+                                            sentence_starts, 
+                                            int(subelement3.attrib["offset"])
+                                            - passage_offset) - 1
                                     
                                 elif subelement3.tag == "text":
                                     entity_text = subelement3.text
@@ -287,7 +342,8 @@ def parse_bioc_xml(
                                     # gold standard
                                     annotation = (
                                         kb_id, entity_text, 
-                                        is_composite_or_individual)
+                                        is_composite_or_individual,
+                                        passage_index, annotation_sentence)
 
                                     if doc_id in annotations.keys():
                                         annotations[doc_id].append(annotation)
@@ -301,7 +357,8 @@ def parse_bioc_xml(
                                     for sub_entity_text in sub_entities:
                                         sub_annotation = (
                                             kb_id, sub_entity_text, 
-                                            "individual")
+                                            "individual", passage_index,
+                                            annotation_sentence)
 
                                         composite_mentions[doc_id][entity_text].\
                                             append(sub_entity_text)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""This module rebuilds the KB dicts, the augmented synonym dicts, the
+lexicons and the relation files generated by prepare.sh only when their
+inputs change. The fingerprint of each target combines the command that
+generates it, the content hashes of its input files (source files and code)
+and the fingerprints of the targets it depends on, and it is stored in
+'data/kbs/build_state.json' after the target is built. The targets whose
+dependencies are up to date run concurrently."""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+sys.path.append('./')
+
+STATE_FILEPATH = 'data/kbs/build_state.json'
+
+kb_files = {
+    'medic': ['data/kbs/original_files/CTD_diseases.obo'],
+    'ctd_chem': ['data/kbs/original_files/CTD_chemicals.tsv'],
+    'mesh_dis': ['data/kbs/original_files/desc2014.xml',
+        'data/kbs/original_files/supp2014.xml'],
+    'mesh_chem': ['data/kbs/original_files/desc2014.xml',
+        'data/kbs/original_files/supp2014.xml']}
+
+corpus_files = {
+    'bc5cdr_dis': [
+        'data/corpora/CDR_Data/CDR.Corpus.v010516/CDR_TrainingSet.PubTator.txt',
+        'data/corpora/CDR_Data/CDR.Corpus.v010516/CDR_DevelopmentSet.PubTator.txt'],
+    'ncbi_disease': ['data/corpora/NCBI_Disease/NCBItrainset_corpus.txt',
+        'data/corpora/NCBI_Disease/NCBIdevelopset_corpus.txt'],
+    'biored_dis': ['data/corpora/BioRED/Train.PubTator',
+        'data/corpora/BioRED/Dev.PubTator']}
+corpus_files['bc5cdr_chem'] = corpus_files['bc5cdr_dis']
+corpus_files['biored_chem'] = corpus_files['biored_dis']
+
+# Code that generates each type of target
+dicts_code = ['src/REEL/generate_dicts.py', 'src/REEL/kb.py',
+    'src/REEL/kb_artifact.py', 'src/REEL/kb_graph.py', 'src/REEL/overlay.py',
+    'src/REEL/reachability.py', 'src/REEL/trie.py']
+entities_code = ['src/REEL/dataset_entities.py', 'src/REEL/kb_artifact.py',
+    'src/REEL/overlay.py']
+lexicon_code = ['src/REEL/lexicon.py', 'src/REEL/trie.py',
+    'src/REEL/kb_artifact.py', 'src/REEL/ngram_index.py',
+    'src/REEL/overlay.py']
+relations_code = ['src/REEL/relations.py', 'src/REEL/overlay.py',
+    'src/REEL/kb_artifact.py']
+
+
+class Target:
+    """Represent an artifact generated by a command."""
+
+    def __init__(self, name, command, inputs, outputs, dependencies=None):
+        """
+        :param name: e.g. 'dicts_medic'
+        :type name: str
+        :param command: arguments of the command generating the target
+        :type command: list
+        :param inputs: paths of the files read by the command
+        :type inputs: list
+        :param outputs: paths of the files written by the command, the
+            target is rebuilt if any of them is missing
+        :type outputs: list
+        :param dependencies: names of the targets generating other files
+            read by the command, defaults to None
+        :type dependencies: list
+        """
+
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.dependencies = dependencies or []
+
+
+def get_targets():
+    """Get the targets of prepare.sh, in build order.
+
+    :return: targets with format {target_name: target}
+    :rtype: dict
+    """
+
+    targets = {}
+
+    for kb, include_omim, workers in [
+            ('medic', 'False', '1'), ('medic', 'True', '1'),
+            ('ctd_chem', 'False', '-1')]:
+        out_dir = 'data/kbs/dicts/{}{}/'.format(
+            kb, '_OMIM' if include_omim == 'True' else '')
+        name = 'dicts_' + out_dir.split('/')[-2]
+        outputs = [out_dir + 'compiled/ids.npy', out_dir + 'reachability.npz']
+        dependencies = []
+
+        if include_omim == 'True':
+            # The KB with the OMIM concepts is an overlay over the compiled KB
+            outputs[0] = out_dir + 'graph.overlay.json'
+            dependencies.append('dicts_' + kb)
+
+        targets[name] = Target(
+            name,
+            [sys.executable, 'src/REEL/generate_dicts.py', '-kb', kb, '-mode',
+            'reel', '--include_omim', include_omim, '--workers', workers],
+            kb_files[kb] + dicts_code, outputs, dependencies=dependencies)
+
+    for kb, dataset, include_omim in [
+            ('medic', 'bc5cdr_dis', 'False'),
+            ('ctd_chem', 'bc5cdr_chem', 'False'),
+            ('medic', 'ncbi_disease', 'True'),
+            ('medic', 'biored_dis', 'False'),
+            ('ctd_chem', 'biored_chem', 'False')]:
+        dicts_name = 'dicts_' + kb
+        # The entities are added to the dicts of the KB, and the output is
+        # stored with the dicts including OMIM concepts if required
+        dependencies = [dicts_name]
+
+        if include_omim == 'True':
+            dicts_name += '_OMIM'
+            dependencies.append(dicts_name)
+
+        name = 'entities_' + dataset
+        targets[name] = Target(
+            name,
+            [sys.executable, 'src/REEL/dataset_entities.py', '-kb', kb,
+            '-dataset', dataset, '--include_omim', include_omim],
+            corpus_files[dataset] + entities_code,
+            ['data/kbs/dicts/{}/synonym_to_id_{}.overlay.json'.format(
+            dicts_name[len('dicts_'):], dataset)],
+            dependencies=dependencies)
+
+        # The lexicon includes the synonyms added by the dataset, so it is
+        # built for each dataset after its entities
+        lexicon_name = 'lexicon_' + dataset
+        targets[lexicon_name] = Target(
+            lexicon_name,
+            [sys.executable, 'src/REEL/lexicon.py', '-kb',
+            dicts_name[len('dicts_'):], '-dataset', dataset],
+            lexicon_code,
+            ['data/kbs/dicts/{}/lexicon_{}/form_buffer.npy'.format(
+            dicts_name[len('dicts_'):], dataset)],
+            dependencies=[name])
+
+    for kb, dataset in [
+            ('medic', 'bc5cdr_dis'), ('ctd_chem', 'bc5cdr_chem'),
+            ('medic', 'biored_dis'), ('ctd_chem', 'biored_chem')]:
+        # Datasets with link_mode 'kb_corpus'
+        name = 'relations_' + dataset
+        targets[name] = Target(
+            name, [sys.executable, 'src/REEL/relations.py', kb, dataset],
+            corpus_files[dataset] + relations_code,
+            ['data/relations/{}.json'.format(dataset),
+            'data/relations/{}.npz'.format(dataset)],
+            dependencies=['dicts_' + kb])
+
+    return targets
+
+
+def get_file_fingerprint(filepath, file_stats):
+    """Calculate the SHA-1 hash of the content of given file. The hash stored
+    in file_stats is reused if the size and modification time of the file
+    did not change, so unchanged files are not read.
+
+    :param filepath: path of the file
+    :type filepath: str
+    :param file_stats: size, modification time and hash of the files
+        hashed before, with format {filepath: [size, mtime_ns, hash]},
+        updated with given file
+    :type file_stats: dict
+    :return: file_hash, or None if the file does not exist
+    :rtype: str
+    """
+
+    if not os.path.exists(filepath):
+        return None
+
+    stat = os.stat(filepath)
+    stored = file_stats.get(filepath)
+
+    if stored is not None and stored[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return stored[2]
+
+    file_hash = hashlib.sha1()
+
+    with open(filepath, 'rb') as in_file:
+
+        for block in iter(lambda: in_file.read(1 << 20), b''):
+            file_hash.update(block)
+
+        in_file.close()
+
+    file_stats[filepath] = [
+        stat.st_size, stat.st_mtime_ns, file_hash.hexdigest()]
+
+    return file_stats[filepath][2]
+
+
+def get_fingerprints(targets, file_stats):
+    """Calculate the fingerprint of every target from its command, the hashes
+    of its inputs and the fingerprints of its dependencies.
+
+    :return: fingerprints with format {target_name: fingerprint}
+    :rtype: dict
+    """
+
+    fingerprints = {}
+
+    for name, target in targets.items():
+        parts = [' '.join(target.command)]
+        parts.extend('{}={}'.format(
+            filepath, get_file_fingerprint(filepath, file_stats))
+            for filepath in target.inputs)
+        parts.extend('{}={}'.format(dependency, fingerprints[dependency])
+            for dependency in target.dependencies)
+        fingerprints[name] = hashlib.sha1(
+            '\n'.join(parts).encode('utf-8')).hexdigest()
+
+    return fingerprints
+
+
+def save_state(state):
+    """Output the fingerprints of the built targets and the hashes of the
+    input files into the state file."""
+
+    with open(STATE_FILEPATH, 'w') as state_file:
+        state_file.write(json.dumps(state, indent=4))
+        state_file.close()
+
+
+def run_target(target):
+    """Run the command of given target and return its exit status."""
+
+    print('Building {}...'.format(target.name))
+
+    return target.name, subprocess.run(target.command).returncode
+
+
+def build(targets, jobs=1, force=False):
+    """Rebuild the targets whose fingerprint differs from the stored one or
+    with missing outputs. The targets are built in rounds: each round runs
+    concurrently the stale targets whose dependencies are up to date, and
+    the targets depending on a failed target are skipped.
+
+    :param targets: see get_targets
+    :type targets: dict
+    :param jobs: max number of commands running at the same time, defaults
+        to 1
+    :type jobs: int
+    :param force: rebuild every target, defaults to False
+    :type force: bool
+    :return: failed, the names of the targets that failed or were skipped
+    :rtype: list
+    """
+
+    state = {'files': {}, 'targets': {}}
+
+    if os.path.exists(STATE_FILEPATH):
+
+        with open(STATE_FILEPATH, 'r') as state_file:
+            state = json.load(state_file)
+            state_file.close()
+
+    fingerprints = get_fingerprints(targets, state['files'])
+    stale = [name for name, target in targets.items()
+        if force or state['targets'].get(name) != fingerprints[name] or
+        not all(os.path.exists(output) for output in target.outputs)]
+    print('{} of {} targets to build'.format(len(stale), len(targets)))
+
+    failed = []
+
+    with ThreadPool(processes=jobs) as pool:
+
+        while len(stale) > 0:
+            ready = [name for name in stale if not any(dependency in stale
+                for dependency in targets[name].dependencies)]
+            blocked = [name for name in stale if any(dependency in failed
+                for dependency in targets[name].dependencies)]
+
+            for name in blocked:
+                print('Skipping {}: a dependency failed'.format(name))
+                failed.append(name)
+                stale.remove(name)
+
+            ready = [name for name in ready if name not in blocked]
+
+            if len(ready) == 0:
+                continue
+
+            for name, status in pool.imap_unordered(
+                    run_target, [targets[name] for name in ready]):
+                stale.remove(name)
+
+                if status != 0:
+                    print('Failed to build {}'.format(name))
+                    failed.append(name)
+                    continue
+
+                # Record each target as soon as it is built, so an
+                # interrupted build resumes from the remaining targets
+                state['targets'][name] = fingerprints[name]
+                save_state(state)
+
+    # Keep the hashes of the input files checked in this build
+    save_state(state)
+
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1,
+        help='Number of targets built at the same time (-1 to use all '
+        'cores)')
+    parser.add_argument('--force', action='store_true',
+        help='Rebuild every target, even if its inputs did not change')
+    args = parser.parse_args()
+
+    jobs = args.jobs
+
+    if jobs == -1:
+        jobs = os.cpu_count()
+
+    if not os.path.exists('data/relations/'):
+        os.mkdir('data/relations/')
+
+    failed = build(get_targets(), jobs=jobs, force=args.force)
+
+    if len(failed) > 0:
+        print('Failed targets: {}'.format(', '.join(failed)))
+        sys.exit(1)
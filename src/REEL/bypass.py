@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""This module decides which entity mentions are already resolved after the
+candidates lists are built, so that they are linked without PPR: mentions
+whose candidates are all the same KB concept and, optionally, mentions with
+an exact match whose score is well above the score of any other concept.
+The documents where every mention is resolved skip the candidates files and
+the PPR step, while in the remaining documents the resolved mentions keep a
+single candidate and act as anchors for the ambiguous ones."""
+
+
+def get_entity_fields(entity_str):
+    """Get the fields (e.g. 'text', 'url') of an ENTITY line of a candidates
+    file.
+
+    :param entity_str: the line, see utils.entity_string
+    :type entity_str: str
+    :return: fields with format {field_name: value}
+    :rtype: dict
+    """
+
+    fields = {}
+
+    for part in entity_str.strip('\n').split('\t')[1:]:
+
+        if ':' in part:
+            field_name, value = part.split(':', 1)
+            fields[field_name] = value
+
+    return fields
+
+
+def get_resolved_candidate(candidates_list, margin=None):
+    """Check if given entity is resolved before the PPR step.
+
+    :param candidates_list: the candidates of the entity
+    :type candidates_list: list
+    :param margin: min difference between the score of an exact match
+        (score 1.0) and the score of the best candidate for a different KB
+        concept for the exact match to be resolved, defaults to None (only
+        entities with a single candidate concept are resolved)
+    :type margin: float
+    :return: candidate, the resolved candidate or None if the entity is
+        ambiguous
+    :rtype: dict
+    """
+
+    if candidates_list == []:
+        return None
+
+    # Best score of each candidate concept
+    best_candidates = {}
+
+    for candidate in candidates_list:
+        url = candidate['url']
+
+        if url not in best_candidates or \
+                candidate['score'] > best_candidates[url]['score']:
+            best_candidates[url] = candidate
+
+    ranked = sorted(
+        best_candidates.values(), key=lambda candidate: -candidate['score'])
+
+    if len(ranked) == 1:
+        # The PPR step always selects the only candidate concept
+        return candidates_list[0]
+
+    if margin is not None and ranked[0]['score'] >= 1.0 and \
+            ranked[0]['score'] - ranked[1]['score'] >= margin:
+        return ranked[0]
+
+    return None
+
+
+def split_resolved(entities_candidates, margin=None):
+    """Fix the resolved entities of every document (see
+    get_resolved_candidate) and separate the documents where every entity
+    is resolved.
+
+    :param entities_candidates: candidates for all entity mentions in all
+        documents, with format {doc_id: [(entity_str, candidates_list)]}
+    :type entities_candidates: dict
+    :param margin: see get_resolved_candidate, defaults to None
+    :type margin: float
+    :return: ambiguous_docs with the same format of entities_candidates,
+        where the resolved entities have a single candidate, resolved_docs
+        with format {doc_id: [(entity_str, candidate)]} and stats with the
+        number of resolved documents and entities
+    :rtype: tuple (dict, dict, dict)
+    """
+
+    ambiguous_docs = {}
+    resolved_docs = {}
+    stats = {'documents': 0, 'entities': 0, 'total_documents': 0,
+        'total_entities': 0}
+
+    for doc_id, doc_entities in entities_candidates.items():
+        doc_resolved = []
+        doc_entities_up = []
+
+        for annotation in doc_entities:
+            candidate = get_resolved_candidate(annotation[1], margin=margin)
+
+            if candidate is not None:
+                doc_resolved.append((annotation[0], candidate))
+                # Resolved entities remain in the disambiguation graph as
+                # anchors with a single candidate
+                annotation = (annotation[0], [candidate]) + annotation[2:]
+
+            doc_entities_up.append(annotation)
+
+        stats['entities'] += len(doc_resolved)
+        stats['total_entities'] += len(doc_entities)
+        stats['total_documents'] += 1
+
+        if len(doc_resolved) == len(doc_entities):
+            resolved_docs[doc_id] = doc_resolved
+            stats['documents'] += 1
+
+        else:
+            ambiguous_docs[doc_id] = doc_entities_up
+
+    return ambiguous_docs, resolved_docs, stats
+
+
+def write_resolved_file(resolved_docs, filepath):
+    """Output the entities of the resolved documents in the format of the
+    'candidate_scores' file of the PPR step, so both files are read by
+    post_process.process_results.
+
+    :param resolved_docs: the resolved documents, with format
+        {doc_id: [(entity_str, candidate)]}
+    :type resolved_docs: dict
+    :param filepath: path of the output file, e.g.
+        'data/REEL/<run_id>/results/resolved_scores'
+    :type filepath: str
+    """
+
+    with open(filepath, 'w') as out_file:
+
+        for doc_id, doc_resolved in resolved_docs.items():
+            out_file.write('======= {} ========= \n'.format(doc_id))
+
+            for entity_str, candidate in doc_resolved:
+                fields = get_entity_fields(entity_str)
+
+                # As in the PPR step, entities without a gold KB id are not
+                # written
+                if fields['url'] != 'NIL':
+                    out_file.write('1\tENT={}\t{}\tANS={}\n'.format(
+                        fields['text'], fields['url'], candidate['url']))
+
+            out_file.write('\n')
+
+        out_file.close()
+
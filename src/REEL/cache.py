@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""This module implements the persistent cache of candidates lists (the top
+concepts retrieved for each entity mention). The entries are stored in a
+sqlite3 file keyed by KB, lexicon version and mention, with an in-memory LRU
+tier in front of it."""
+
+import json
+import sqlite3
+from collections import OrderedDict
+
+
+def get_cache_version(lexicon_version, min_match_score, retrieval):
+    """Get the version of the cached candidates lists generated with given
+    settings. The candidates lists depend on the lexicon, on the 
+    min_match_score used as score cutoff and on the retrieval method (the
+    n-gram index, the deletion dictionary and the TF-IDF matrix may miss some
+    candidates, while the exhaustive and the batch retrieval are equivalent).
+
+    :param lexicon_version: version of the lexicon (see load_lexicon)
+    :type lexicon_version: str
+    :param min_match_score: min lexical similarity of the candidates (0-1)
+    :type min_match_score: float
+    :param retrieval: retrieval method, e.g. 'exhaustive'
+    :type retrieval: str
+    :return: cache_version
+    :rtype: str
+    """
+
+    cache_version = '{}_{}'.format(lexicon_version, min_match_score)
+
+    if retrieval in ['ngram', 'symspell', 'tfidf']:
+        cache_version += '_' + retrieval
+
+    return cache_version
+
+
+class CandidatesCache:
+    """Represent the candidates cache of a given KB and lexicon version. It
+    behaves like the dict {entity_text: top_concepts} used by map_to_kb, but
+    only the recently used entries are kept in memory and the new entries are
+    inserted in the sqlite3 file incrementally.
+
+    Several runs can read and write the same file at the same time: the
+    database uses write-ahead logging and the writers wait for each other.
+    """
+
+    def __init__(
+            self, filepath, kb, version, max_size=100000, flush_size=1000):
+        """
+        :param filepath: path of the sqlite3 file
+        :type filepath: str
+        :param kb: target knowledge base
+        :type kb: str
+        :param version: version of the lexicon (and of any retrieval setting)
+            the cached candidates lists were generated with
+        :type version: str
+        :param max_size: maximum number of entries kept in memory, defaults
+            to 100000
+        :type max_size: int
+        :param flush_size: number of new entries that triggers a write to the
+            file, defaults to 1000
+        :type flush_size: int
+        """
+
+        self.kb = kb
+        self.version = version
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(filepath, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS candidates (kb TEXT, version TEXT, '
+            'mention TEXT, top_concepts TEXT, '
+            'PRIMARY KEY (kb, version, mention))')
+        self.connection.commit()
+
+    def _remember(self, entity_text, top_concepts):
+        """Add an entry to the in-memory tier, evicting the least recently
+        used entry if it is full."""
+
+        self.memory[entity_text] = top_concepts
+        self.memory.move_to_end(entity_text)
+
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, entity_text):
+
+        if entity_text in self.memory:
+            self.memory.move_to_end(entity_text)
+
+            return self.memory[entity_text]
+
+        if entity_text in self.pending:
+            return self.pending[entity_text]
+
+        row = self.connection.execute(
+            'SELECT top_concepts FROM candidates WHERE kb = ? AND '
+            'version = ? AND mention = ?',
+            (self.kb, self.version, entity_text)).fetchone()
+
+        if row is None:
+            return None
+
+        top_concepts = json.loads(row[0])
+        self._remember(entity_text, top_concepts)
+
+        return top_concepts
+
+    def __contains__(self, entity_text):
+
+        return self._lookup(entity_text) is not None
+
+    def __getitem__(self, entity_text):
+
+        top_concepts = self._lookup(entity_text)
+
+        if top_concepts is None:
+            raise KeyError(entity_text)
+
+        self.hits += 1
+
+        return top_concepts
+
+    def __setitem__(self, entity_text, top_concepts):
+
+        self.misses += 1
+        self._remember(entity_text, top_concepts)
+        self.pending[entity_text] = top_concepts
+
+        if len(self.pending) >= self.flush_size:
+            self.commit()
+
+    def commit(self):
+        """Insert the new entries in the file in a single transaction."""
+
+        if self.pending == {}:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?)',
+                [(self.kb, self.version, entity_text,
+                json.dumps(top_concepts))
+                for entity_text, top_concepts in self.pending.items()])
+
+        self.pending = {}
+
+    def close(self):
+
+        self.commit()
+        self.connection.close()
+
+    def stats(self):
+        """Get a summary of the cache usage.
+
+        :return: hits (mentions whose candidates were found in the cache),
+            misses (mentions whose candidates had to be retrieved and were
+            added to the cache) and hit_rate
+        :rtype: dict
+        """
+
+        lookups = self.hits + self.misses
+        hit_rate = 0.0
+
+        if lookups > 0:
+            hit_rate = self.hits / lookups
+
+        return {'hits': self.hits, 'misses': self.misses,
+            'hit_rate': hit_rate}
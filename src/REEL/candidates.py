@@ -1,25 +1,335 @@
 import json
+import multiprocessing
+import os
 import networkx as nx
-from rapidfuzz import process, fuzz
+import numpy as np
+from scipy import sparse
+from src.REEL.kb_graph import get_ancestors, get_descendants
+from src.REEL.ngram_index import get_ngrams
 from src.REEL.utils import candidate_string
+from tqdm import tqdm
+
+
+# Min lexical similarity between entity text and candidate text in each 
+# dataset: candidates with a lexical similarity below it are excluded
+MIN_MATCH_SCORES = {
+    'bc5cdr_dis': 0.80, 'bc5cdr_chem': 0.90, 'ncbi_disease': 0.85, 
+    'biored_dis': 0.90, 'biored_chem': 0.90}
+
+# The documents and KB data shared by the processes writing candidates files,
+# inherited by the forked workers without copying
+writer_state = None
+
+
+def merge_matches(name_matches, synonym_matches):
+    """Combine the best matches in the names and in the synonyms of the KB for
+    a given entity text into the list of top concepts for that entity. If 
+    there is a name or a synonym with score 100 it is the only top concept,
+    otherwise the synonyms with a score above the best name score are appended
+    to the name matches.
+
+    :param name_matches: best matches among the KB names with format
+        [(name, score, name_index)]
+    :type name_matches: list
+    :param synonym_matches: best matches among the KB synonyms, it is only
+        considered if there is no exact match among the names
+    :type synonym_matches: list
+    :return: top_concepts with format [(name_or_synonym, score, index)]
+    :rtype: list
+    """
+
+    top_concepts = list(name_matches)
+
+    if top_concepts != [] and top_concepts[0][1] == 100: 
+        # There is an exact match for this entity
+        return [top_concepts[0]]
+
+    # The name matches may be empty if every name is below the score cutoff
+    best_score = -1
+
+    if top_concepts != []:
+        best_score = top_concepts[0][1]
+
+    # Check for synonyms to this entity
+    for synonym in synonym_matches:
+
+        if synonym[1] == 100:
+            top_concepts = [synonym]
+            best_score = 100
+        
+        else:
+        
+            if synonym[1] > best_score:
+                top_concepts.append(synonym)
+    
+    return top_concepts
+
+
+def batch_map_to_kb(entities_text, lexicon, score_cutoff=None, workers=1):
+    """Retrieve the top concepts for several entity texts at once, combining
+    the names and synonyms matches as in map_to_kb. 
+
+    :param entities_text: surface forms of the entities, which should not be
+        present in the candidates cache
+    :type entities_text: list
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
+    :param score_cutoff: KB strings with a lexical similarity (0-100) below
+        this value are rejected, defaults to None
+    :type score_cutoff: float
+    :param workers: number of threads used to compute the score matrices, -1 
+        uses all available cores, defaults to 1
+    :type workers: int
+    :return: prefetched, with format {entity_text: top_concepts}, to pass to
+        map_to_kb
+    :rtype: dict
+    """
+
+    matches = lexicon.batch_extract(
+        entities_text, score_cutoff=score_cutoff, workers=workers)
+    
+    prefetched = {}
+
+    for entity_text, entity_matches in zip(entities_text, matches):
+        prefetched[entity_text] = merge_matches(
+            entity_matches[0], entity_matches[1])
+    
+    return prefetched
+
+
+class TfidfIndex:
+    """Represent the surface forms of a lexicon as L2-normalized sparse TF-IDF
+    vectors of the character n-grams of their token-sorted forms (binary term
+    frequencies). The forms most similar to a batch of entities (cosine 
+    similarity) are found with a single sparse matrix product."""
+
+    def __init__(self, n=3):
+
+        self.n = n
+        self.grams = None
+        self.gram_to_column = None
+        self.idf = None
+        self.matrix = None
+        self.version = None
+
+    def _count(self, texts, update_vocabulary=False):
+        """Build the sparse matrix with the n-grams present in each text. The
+        n-grams outside the vocabulary are ignored unless update_vocabulary
+        is True."""
+
+        rows = []
+        columns = []
+
+        for row, text in enumerate(texts):
+            
+            for gram in get_ngrams(text, n=self.n):
+
+                if gram not in self.gram_to_column:
+
+                    if not update_vocabulary:
+                        continue
+
+                    self.gram_to_column[gram] = len(self.gram_to_column)
+                
+                rows.append(row)
+                columns.append(self.gram_to_column[gram])
+        
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(len(texts), len(self.gram_to_column)))
+
+    def _weight(self, counts):
+        """Apply the IDF weights to given n-gram matrix and normalize its 
+        rows."""
+
+        vectors = sparse.csr_matrix(counts.multiply(self.idf))
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)))
+        norms[norms == 0] = 1
+
+        return sparse.csr_matrix(vectors.multiply(1 / norms))
+
+    def build(self, choices, version):
+        """Build the TF-IDF matrix of the given choices.
+
+        :param choices: surface forms of a lexicon
+        :type choices: list
+        :param version: version of the lexicon
+        :type version: str
+        """
+
+        self.gram_to_column = {}
+        counts = self._count(choices, update_vocabulary=True)
+        self.grams = [None] * len(self.gram_to_column)
+
+        for gram, column in self.gram_to_column.items():
+            self.grams[column] = gram
+
+        df = np.bincount(counts.indices, minlength=len(self.grams))
+        self.idf = (np.log((1 + len(choices)) / (1 + df)) + 1).astype(
+            np.float32)
+        self.matrix = self._weight(counts).T.tocsr()
+        self.version = version
 
+    def save(self, filepath):
+        """Output the vocabulary, the IDF weights and the (transposed) TF-IDF
+        matrix into a .npz file."""
 
-def map_to_kb(entity_text, name_to_id, synonym_to_id, kb_cache, doc_abbrvs):
+        np.savez(
+            filepath, grams=np.array(self.grams, dtype=str), idf=self.idf, 
+            data=self.matrix.data, indices=self.matrix.indices, 
+            indptr=self.matrix.indptr, shape=np.array(self.matrix.shape),
+            settings=np.array([str(self.n), self.version]))
+
+    def load(self, filepath, version):
+        """Load the TF-IDF matrix from a .npz file.
+
+        :raises ValueError: if the stored matrix was built for another
+            version of the lexicon or with a different n-gram size
+        """
+
+        with np.load(filepath) as index_file:
+            
+            if index_file['settings'].tolist() != [str(self.n), version]:
+                raise ValueError('Matrix does not match the given lexicon!')
+
+            self.grams = index_file['grams'].tolist()
+            self.idf = index_file['idf']
+            self.matrix = sparse.csr_matrix(
+                (index_file['data'], index_file['indices'], 
+                index_file['indptr']), shape=tuple(index_file['shape']))
+        
+        self.gram_to_column = {
+            gram: column for column, gram in enumerate(self.grams)}
+        self.version = version
+
+    def top_k(self, entities_text, k=100, chunk_size=1000):
+        """Retrieve the forms with the highest cosine similarity to each one 
+        of the given entity texts.
+
+        :param entities_text: surface forms of the entities
+        :type entities_text: list
+        :param k: number of forms retrieved for each entity, defaults to 100
+        :type k: int
+        :param chunk_size: number of entities multiplied by the TF-IDF matrix
+            at once, defaults to 1000
+        :type chunk_size: int
+        :return: shortlists, with the indexes of the retrieved forms (in 
+            ascending order) for each entity text
+        :rtype: list
+        """
+
+        shortlists = []
+
+        for start in range(0, len(entities_text), chunk_size):
+            vectors = self._weight(
+                self._count(entities_text[start:start + chunk_size]))
+            similarities = sparse.csr_matrix(vectors.dot(self.matrix))
+
+            for row in range(similarities.shape[0]):
+                begin = similarities.indptr[row]
+                end = similarities.indptr[row + 1]
+                columns = similarities.indices[begin:end]
+
+                if len(columns) > k:
+                    top = np.argpartition(
+                        -similarities.data[begin:end], k - 1)[:k]
+                    columns = columns[top]
+                
+                shortlists.append(np.sort(columns).astype(np.int64))
+        
+        return shortlists
+
+
+def load_tfidf_index(filepath, lexicon):
+    """Load the TF-IDF matrix of given lexicon from given file, or build it 
+    and output it to that file if it is not available or if it was built for
+    another version of the lexicon.
+
+    :param filepath: path of the .npz file, e.g. 
+        'data/kbs/dicts/medic/lexicon_ncbi_disease_tfidf.npz'
+    :type filepath: str
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
+    :return: tfidf_index
+    :rtype: TfidfIndex object
+    """
+
+    tfidf_index = TfidfIndex()
+
+    if os.path.exists(filepath):
+
+        try:
+            tfidf_index.load(filepath, lexicon.version)
+
+            return tfidf_index
+        
+        except ValueError:
+            pass
+    
+    tfidf_index.build(lexicon.forms, lexicon.version)
+    tfidf_index.save(filepath)
+
+    return tfidf_index
+
+
+def tfidf_map_to_kb(
+        entities_text, lexicon, tfidf_index, score_cutoff=None, top_k=100):
+    """Retrieve the top concepts for several entity texts at once: the KB 
+    strings most similar to each entity are shortlisted with the TF-IDF 
+    matrix and then scored with token_sort_ratio, so the scores have the same
+    meaning as in map_to_kb.
+
+    :param entities_text: surface forms of the entities
+    :type entities_text: list
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
+    :param tfidf_index: TF-IDF matrix of the lexicon
+    :type tfidf_index: TfidfIndex object
+    :param score_cutoff: KB strings with a lexical similarity (0-100) below
+        this value are rejected, defaults to None
+    :type score_cutoff: float
+    :param top_k: number of KB strings shortlisted for each entity, defaults
+        to 100
+    :type top_k: int
+    :return: prefetched, with format {entity_text: top_concepts}, to pass to
+        map_to_kb
+    :rtype: dict
+    """
+
+    shortlists = tfidf_index.top_k(entities_text, k=top_k)
+    prefetched = {}
+
+    for entity_text, shortlist in zip(entities_text, shortlists):
+        name_matches, synonym_matches = lexicon.extract(
+            entity_text, score_cutoff=score_cutoff, indices=shortlist)
+        prefetched[entity_text] = merge_matches(name_matches, synonym_matches)
+    
+    return prefetched
+
+
+def map_to_kb(
+        entity_text, lexicon, kb_cache, doc_abbrvs, score_cutoff=None, 
+        prefetched=None):
     """Retrieve best knowledge base matches for entity text according to 
-    lexical similarity (edit distance).
+    lexical similarity (edit distance). Entities with an exact match in the 
+    lexicon (up to normalization and inflectional suffixes, or extending an
+    abbreviation long form, see Lexicon.find_exact) are mapped directly to
+    the matching KB string.
 
     :param entity_text: the surface form of given entity 
     :type entity_text: str
-    :param name_to_id: mappings between each KB concept name and 
-        respective KB id
-    :type name_to_id: dict
-    :param synonym_to_id: mappings between each synonym for a 
-        given KB concept and respective KB id
-    :type synonym_to_id: dict
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
     :param kb_cache: candidates cache for the given kb
-    :type kb_cache: dict
+    :type kb_cache: dict or CandidatesCache object
     :param doc_abbrvs: abbreviations identified in the given document
     :type doc_abbrvs: dict
+    :param score_cutoff: KB strings with a lexical similarity (0-100) below
+        this value are rejected when searching the lexicon, defaults to None
+    :type score_cutoff: float
+    :param prefetched: top concepts already retrieved in batch for the 
+        entities that were not in the candidates cache, defaults to None
+    :type prefetched: dict
     :return: matches (list) with format 
         [{'kb_id': <kb_id>, 'name': <name>, 'match_score': (...)}],
         changed_cache indicating wether the candidates cache was updated
@@ -32,50 +342,40 @@ def map_to_kb(entity_text, name_to_id, synonym_to_id, kb_cache, doc_abbrvs):
     changed_cache = False 
     top_concepts = []
     
-    if entity_text in doc_abbrvs:
+    # The long forms of abbreviations may be truncated, so they are also
+    # mapped to the single KB string extending them
+    is_long_form = entity_text in doc_abbrvs
+
+    if is_long_form:
         entity_text = doc_abbrvs[entity_text]
 
     changed_cache = False 
     top_concepts = list()
-   
-    if entity_text in name_to_id or entity_text in synonym_to_id: 
-        # There is an exact match for this entity
-        top_concepts = [entity_text]
-    
-    if entity_text.endswith("s") and entity_text[:-1] in kb_cache:
-        # Removal of suffix -s 
-        top_concepts = kb_cache[entity_text[:-1]]
-    
+    exact_match = lexicon.find_exact(
+        entity_text, count=True, score_cutoff=score_cutoff,
+        prefix=is_long_form)
+
+    if exact_match is not None:
+        # There is an exact match for this entity (up to normalization)
+        # scoring above the cutoff, so the fuzzy retrieval is skipped
+        top_concepts = [exact_match]
+
     elif entity_text in kb_cache: 
         # There is already a candidate list stored in cache file
         top_concepts = kb_cache[entity_text]
 
     else:
-        # Get first ten KB candidates according to lexical similarity 
-        # with entity_text
-        top_concepts = process.extract(
-            entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, 
-            limit=10)
-        
-        if top_concepts[0][1] == 100: 
-            # There is an exact match for this entity
-            top_concepts = [top_concepts[0]]
-
-        elif top_concepts[0][1] < 100: 
-            # Check for synonyms to this entity
-            synonyms = process.extract(
-                entity_text, synonym_to_id.keys(), limit=10, 
-                scorer=fuzz.token_sort_ratio)
 
-            for synonym in synonyms:
-
-                if synonym[1] == 100:
-                    top_concepts = [synonym]
-                
-                else:
-                
-                    if synonym[1] > top_concepts[0][1]:
-                        top_concepts.append(synonym)
+        if prefetched is not None and entity_text in prefetched:
+            # The candidate list was already retrieved in batch
+            top_concepts = prefetched[entity_text]
+        
+        else:
+            # Get first ten KB names and synonyms according to lexical 
+            # similarity with entity_text
+            name_matches, synonym_matches = lexicon.extract(
+                entity_text, score_cutoff=score_cutoff)
+            top_concepts = merge_matches(name_matches, synonym_matches)
         
         kb_cache[entity_text] = top_concepts
         changed_cache = True
@@ -87,15 +387,7 @@ def map_to_kb(entity_text, name_to_id, synonym_to_id, kb_cache, doc_abbrvs):
     for concept in top_concepts:
         
         term_name = concept[0]
-        
-        if term_name in name_to_id.keys():
-            term_id = name_to_id[term_name]
-        
-        elif term_name in synonym_to_id.keys():
-            term_id = synonym_to_id[term_name]
-        
-        else:
-            term_id = "NIL"
+        term_id = lexicon.get_kb_id(term_name)
 
         match = {"kb_id": term_id,
                  "name": term_name,
@@ -107,8 +399,8 @@ def map_to_kb(entity_text, name_to_id, synonym_to_id, kb_cache, doc_abbrvs):
 
     
 def generate_candidates_list(
-        entity_text, kb, kb_graph, name_to_id, synonym_to_id, doc_abbrvs, 
-        kb_cache, min_match_score, nil_candidates=None):
+        entity_text, kb, kb_graph, lexicon, doc_abbrvs, kb_cache, 
+        min_match_score, nil_candidates=None, prefetched=None):
     """
     Retrieve and build a structured candidates list for given entity text.
 
@@ -118,16 +410,12 @@ def generate_candidates_list(
     :type kb: str
     :param kb_graph: Networkx object representing the knowledge base as a graph
     :type kb_graph: Networkx object
-    :param name_to_id: mappings between each ontology concept name and 
-        the respective id
-    :type name_to_id: dict
-    :param synonym_to_id: mappings between each synonym for a given ontology 
-        concept and the respective id
-    :type synonym_to_id: dict
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
     :param doc_abbrvs: abbreviations identified in the given document
     :type doc_abbrvs: dict
     :param kb_cache: candidates cache for the given kb
-    :type kb_cache: dict
+    :type kb_cache: dict or CandidatesCache object
     :param min_match_score: minimum edit distance between the mention text 
         and candidate string, candidates below this threshold are excluded 
         from candidates list
@@ -135,6 +423,9 @@ def generate_candidates_list(
     :param nil_candidates: in cases where the candidates outputed from the 
         'NILINKER' model need to be structured
     :type nil_candidates: list
+    :param prefetched: top concepts already retrieved in batch, with format
+        {entity_text: top_concepts}, defaults to None
+    :type prefetched: dict
     :return: candidates_list including all the structured candidates for given
         entity, changed_cache indicating weter the candidates cache was updated
         in the performed mapping or if it remains inaltered, kb_cache_up 
@@ -150,9 +441,11 @@ def generate_candidates_list(
     kb_cache_up = None
 
     if nil_candidates == None:
-        
+        # Candidates below min_match_score are excluded below, so they can 
+        # be rejected early when scoring the lexicon
         candidate_names, changed_cache, kb_cache_up = map_to_kb(
-            entity_text, name_to_id, synonym_to_id, kb_cache, doc_abbrvs)
+            entity_text, lexicon, kb_cache, doc_abbrvs, 
+            score_cutoff=min_match_score * 100, prefetched=prefetched)
      
     else:
         candidate_names = nil_candidates
@@ -199,7 +492,8 @@ def generate_candidates_list(
     return candidates_list, changed_cache, kb_cache_up
 
 
-def check_if_related(c1, c2, link_mode, extracted_relations, kb_graph):
+def check_if_related(
+        c1, c2, link_mode, extracted_relations, kb_graph, reachability=None):
     """
     Check if two given KB concepts/candidates are linked according to the 
     criterium defined by link_mode.
@@ -212,9 +506,12 @@ def check_if_related(c1, c2, link_mode, extracted_relations, kb_graph):
     'corpus', 'kb_corpus')
     :type link_mode: str
     :param extracted_relations: relations extracted from target corpus
-    :type extracted_relations: list
+    :type extracted_relations: RelationsIndex object
     :param kb_graph: represents the target knowledge base
-    :type kb_graph: Networkx MultiDiGraph object
+    :type kb_graph: Networkx MultiDiGraph or NetworkxView object
+    :param reachability: precomputed ancestors of the KB concepts, replaces 
+        the traversals of kb_graph if given, defaults to None
+    :type reachability: ReachabilityIndex or TreeNumberIndex object
     :return: related, is True if the two candidates are related, False 
              otherwise
     :rtype: bool
@@ -224,7 +521,8 @@ def check_if_related(c1, c2, link_mode, extracted_relations, kb_graph):
     >>> c1 = "ID:01"
     >>> c2 = "ID:02"
     >>> link_mode = "corpus"
-    >>> extracted_relations = {"ID:01": ["ID:02"], "ID:03": ["ID:02"]} 
+    >>> extracted_relations = RelationsIndex()
+    >>> extracted_relations.build({"ID:01": ["ID:02"], "ID:03": ["ID:02"]})
     >>> kb_edges = ["ID:04_ID:O5", "ID:06_ID:07"]
     >>> check_if_related(c1, c2, link_mode, extracted_relations, kb_edges)
     True
@@ -242,17 +540,18 @@ def check_if_related(c1, c2, link_mode, extracted_relations, kb_graph):
         if link_mode == "corpus":
             # Check if there is a relation between the two candidates extracted
             # from the corpus 
-            if c1 in extracted_relations.keys():
-                relations_with_c1 = extracted_relations[c1]
-                                
-                if c2 in relations_with_c1: 
-                    # Found an extracted relation
-                    related = True
+            if extracted_relations.is_related(c1, c2):
+                # Found an extracted relation
+                related = True
 
         else:
             kb_edges = kb_graph.edges
 
-            if c1 == c2 or rel_str1 in kb_edges or rel_str2 in kb_edges: 
+            if reachability is not None:
+                # A KB link is also an ancestor-descendant relation
+                related = c1 == c2 or reachability.is_related(c1, c2)
+
+            elif c1 == c2 or rel_str1 in kb_edges or rel_str2 in kb_edges: 
                 # There is a KB link between the two candidates
                 related = True
             
@@ -260,40 +559,247 @@ def check_if_related(c1, c2, link_mode, extracted_relations, kb_graph):
                 # check if there is a distant relation in the KB 
                 # between the two entities
                 if c1 in kb_graph.nodes and c2 in kb_graph.nodes:
-                    c1_ancestors = nx.ancestors(kb_graph, c1)
-                    c1_descendants = nx.descendants(kb_graph, c1)
+                    c1_ancestors = get_ancestors(kb_graph, c1)
+                    c1_descendants = get_descendants(kb_graph, c1)
                     
                     if c2 in c1_ancestors or c2 in c1_descendants:
                         related = True
 
                     else:
-                        c2_ancestors = nx.ancestors(kb_graph, c2)
-                        c2_descendants = nx.descendants(kb_graph, c2)
+                        c2_ancestors = get_ancestors(kb_graph, c2)
+                        c2_descendants = get_descendants(kb_graph, c2)
 
                         if c1 in c2_ancestors or c1 in c2_descendants:
                             related = True
                     
-                if not related:
-                    # There is no KB link between the two candidates
-                                                            
-                    if link_mode == "kb_corpus": 
-                        # Maybe there is an extracted relation 
-                        # between the two candidates
-                                        
-                        if c1 in extracted_relations.keys():
-                            relations_with_c1 = extracted_relations[c1]
+            if not related:
+                # There is no KB link between the two candidates
+                                                        
+                if link_mode == "kb_corpus": 
+                    # Maybe there is an extracted relation 
+                    # between the two candidates
                                     
-                            if c2 in relations_with_c1: 
-                                # Found an extracted relation
-                                related = True
-                                print('related')
+                    if extracted_relations.is_related(c1, c2):
+                        # Found an extracted relation
+                        related = True
+                        print('related')
+    
+    return related
+
+
+def get_relatedness_matrix(
+        urls, link_mode, extracted_relations, kb_graph, reachability=None):
+    """Check which pairs of the given KB concepts are related according to
+    the criterium defined by link_mode, as in check_if_related.
+
+    :param urls: distinct knowledge base identifiers of the candidates
+    :type urls: list
+    :param link_mode: how the edges are added to the disambiguation graph 
+        ('kb', 'corpus', 'kb_corpus')
+    :type link_mode: str
+    :param extracted_relations: relations extracted from target corpus
+    :type extracted_relations: RelationsIndex object
+    :param kb_graph: represents the target knowledge base
+    :type kb_graph: Networkx MultiDiGraph object
+    :param reachability: precomputed ancestors of the KB concepts (or tree 
+        numbers, for MeSH-based KBs), defaults to None (every pair is 
+        checked with check_if_related)
+    :type reachability: ReachabilityIndex or TreeNumberIndex object
+    :return: related, where related[a, b] is True if check_if_related(
+        urls[a], urls[b]) is True
+    :rtype: Numpy array
+    """
+
+    num_urls = len(urls)
+
+    if reachability is None:
+        related = np.zeros((num_urls, num_urls), dtype=bool)
+
+        for a in range(num_urls):
+
+            for b in range(num_urls):
+                related[a, b] = check_if_related(
+                    urls[a], urls[b], link_mode, extracted_relations, 
+                    kb_graph)
+        
+        return related
+
+    # To bypass composite mentions present in the train and dev set
+    valid = np.array(
+        [url != '-1' and '|' not in url for url in urls], dtype=bool)
+    related = np.zeros((num_urls, num_urls), dtype=bool)
+
+    if link_mode in ['kb', 'kb_corpus']:
+        # Same concept, or one concept is an ancestor of the other
+        related |= reachability.get_related_matrix(urls)
+
+    if link_mode in ['corpus', 'kb_corpus']:
+        # An extracted relation from one concept to the other
+        entity_ids = np.array(
+            [extracted_relations.entity_to_id.get(url, -1) for url in urls],
+            dtype=np.int64)
+        
+        for a in np.flatnonzero(entity_ids >= 0):
+            neighbors = extracted_relations.get_neighbors(entity_ids[a])
+            related[a] |= np.isin(entity_ids, neighbors) & (entity_ids >= 0)
     
+    related &= valid[:, None] & valid[None, :]
+
     return related
 
 
+def get_window_matrix(doc_entities_candidates, window_size):
+    """Check which pairs of entities of given document are close enough to be
+    linked in a windowed disambiguation graph: some occurrence of one entity
+    is at most window_size passages or sentences away from some occurrence 
+    of the other.
+
+    :param doc_entities_candidates: includes entities, respective candidates
+        and the indexes of the passages or sentences where each entity 
+        occurs (None if unknown)
+    :type doc_entities_candidates: list
+    :param window_size: max distance between the passages or sentences of
+        two linked entities
+    :type window_size: int
+    :return: near, where near[i, j] is True if the entities i and j can be
+        linked
+    :rtype: Numpy array
+    """
+
+    num_annotations = len(doc_entities_candidates)
+    windows = [annotation[2] if len(annotation) > 2 else None 
+        for annotation in doc_entities_candidates]
+    units = [unit for window in windows if window is not None 
+        for unit in window]
+    
+    if units == []:
+        return np.ones((num_annotations, num_annotations), dtype=bool)
+
+    # occurs[i, u] is True if the entity i occurs in the unit u and 
+    # reaches[i, u] if the unit u is inside the window of some occurrence
+    occurs = np.zeros((num_annotations, max(units) + 1), dtype=np.int64)
+
+    for i, window in enumerate(windows):
+
+        if window is not None:
+            occurs[i, list(window)] = 1
+    
+    counts = np.zeros((num_annotations, occurs.shape[1] + 1), dtype=np.int64)
+    np.cumsum(occurs, axis=1, out=counts[:, 1:])
+    starts = np.maximum(np.arange(occurs.shape[1]) - window_size, 0)
+    ends = np.minimum(
+        np.arange(occurs.shape[1]) + window_size + 1, occurs.shape[1])
+    reaches = counts[:, ends] - counts[:, starts]
+
+    near = (occurs @ reaches.T) > 0
+
+    # Entities without known position are linked to every entity
+    unknown = np.array([window is None for window in windows], dtype=bool)
+    near[unknown] = True
+    near[:, unknown] = True
+
+    return near
+
+
+def get_candidates_links(
+        doc_entities_candidates, link_mode, extracted_relations, kb_graph,
+        reachability=None, window_size=None):
+    """Find the links of every candidate of the entities in given document:
+    the ids of the related candidates of the other entities (candidates for
+    the same entity cannot be linked). The candidates are mapped to integer
+    ids and the relatedness of every pair of candidates is calculated at 
+    once. As the links of a KB concept are the same for all its candidates,
+    they are found for the first entity where the concept is a candidate.
+
+    :param doc_entities_candidates: includes entities and respective 
+        candidates to output
+    :type doc_entities_candidates: list
+    :param window_size: only link the candidates of entities at most 
+        window_size passages or sentences apart (see get_window_matrix), 
+        defaults to None (every pair of entities can be linked)
+    :type window_size: int
+    :return: candidates_links with format {url: links}
+    :rtype: dict
+    """
+
+    # Flatten the candidates of the document
+    urls = []
+    url_to_index = {}
+    first_annotation = []
+    candidate_urls = []
+    candidate_annotations = []
+    candidate_ids = []
+
+    for i, annotation in enumerate(doc_entities_candidates):
+
+        for c in annotation[1]:
+
+            if c["url"] not in url_to_index:
+                url_to_index[c["url"]] = len(urls)
+                urls.append(c["url"])
+                first_annotation.append(i)
+            
+            candidate_urls.append(url_to_index[c["url"]])
+            candidate_annotations.append(i)
+            candidate_ids.append(str(c["id"]))
+
+    if urls == []:
+        return {}
+
+    candidate_urls = np.array(candidate_urls, dtype=np.int64)
+    candidate_annotations = np.array(candidate_annotations, dtype=np.int64)
+    first_annotation = np.array(first_annotation, dtype=np.int64)
+
+    # same_entity[i, j] is True if the annotations i and j are equal, since 
+    # the candidates of an annotation are not linked to the candidates of 
+    # any annotation equal to it
+    num_annotations = len(doc_entities_candidates)
+    same_entity = np.eye(num_annotations, dtype=bool)
+    annotations_by_str = {}
+
+    for i, annotation in enumerate(doc_entities_candidates):
+        annotations_by_str.setdefault(annotation[0], []).append(i)
+    
+    for indexes in annotations_by_str.values():
+
+        for i in indexes:
+
+            for j in indexes:
+                
+                if doc_entities_candidates[i] == doc_entities_candidates[j]:
+                    same_entity[i, j] = True
+
+    related = get_relatedness_matrix(
+        urls, link_mode, extracted_relations, kb_graph, 
+        reachability=reachability)
+    
+    # links[a, k] is True if the candidate k is linked to the concept a
+    links = related[:, candidate_urls] & \
+        ~same_entity[first_annotation][:, candidate_annotations]
+
+    if window_size is not None:
+        # A concept is only linked to the candidates of the entities near
+        # some entity where the concept is a candidate (the PPR graph keeps
+        # the edges between nodes of near entities alone)
+        url_annotations = np.zeros((len(urls), num_annotations), dtype=bool)
+        url_annotations[candidate_urls, candidate_annotations] = True
+        near = get_window_matrix(doc_entities_candidates, window_size) & \
+            ~same_entity
+        links &= (url_annotations.astype(np.int64) @ 
+            near.astype(np.int64) > 0)[:, candidate_annotations]
+
+    candidates_links = {}
+
+    for a, url in enumerate(urls):
+        candidates_links[url] = ";".join(
+            set(candidate_ids[k] for k in np.flatnonzero(links[a])))
+    
+    return candidates_links
+
+
 def write_candidates_file(
         doc_entities_candidates, candidates_filename, entity_type, kb_graph, 
-        link_mode, extracted_relations):
+        link_mode, extracted_relations, reachability=None, window_size=None):
     """Output the candidates file associated with given input document. 
 
     :param doc_entities_candidates: includes entities and respective 
@@ -310,12 +816,20 @@ def write_candidates_file(
     :type link_mode: str
     :param extracted_relations: includes extracted relations or is empty if
         link_mode=kb
-    :type extracted_relations: list
+    :type extracted_relations: RelationsIndex object
+    :param reachability: precomputed ancestors of the KB concepts, defaults 
+        to None
+    :type reachability: ReachabilityIndex or TreeNumberIndex object
+    :param window_size: max distance (in passages or sentences) between 
+        linked entities, defaults to None (no window)
+    :type window_size: int
     :return: outputted filename
     :rtype: .txt file
     """
     
-    candidates_links = {} 
+    candidates_links = get_candidates_links(
+        doc_entities_candidates, link_mode, extracted_relations, kb_graph,
+        reachability=reachability, window_size=window_size)
 
     candidates_file = open(candidates_filename, 'w')
     
@@ -325,44 +839,114 @@ def write_candidates_file(
    
         # Iterate on candidates for current entity
         for c in annotation[1]:
+            c["links"] = candidates_links[c["url"]]
             
-            if c["url"] in candidates_links:
-                c["links"] = candidates_links[c["url"]]
-    
-            else: 
-                links = []
-                other_candidates = []
-
-                # Iterate over candidates for every other entity except the 
-                # current one to find links between candidates for different
-                # entities (candidates for the same entity cannot be linked) 
-                for annotation_2 in doc_entities_candidates:   
-                    
-                    if annotation_2 != annotation:
-                       
-                        for c2 in annotation_2[1]:
-                            other_candidates.append((c2["url"], c2["id"]))
-
-                if other_candidates != []:
-                    # Find entity-entity pair relation
-                    
-                    for c2 in other_candidates: 
-                        c1_url = c["url"]
-                        c2_url = c2[0]
-                      
-                        related = check_if_related(
-                            c1_url, c2_url, link_mode, 
-                            extracted_relations, kb_graph)
-                        
-                        if related:
-                            links.append(str(c2[1]))
-
-                c["links"] = ";".join(set(links))
-                candidates_links[c["url"]] = c["links"][:]
-
             candidates_file.write(
                 candidate_string.format(c["id"], c["incount"], c["outcount"], 
                 c["links"], c["url"], c["name"], c["name"].lower(), 
                 c["name"].lower(), entity_type))
     
-    candidates_file.close()
\ No newline at end of file
+    candidates_file.close()
+
+
+def get_balanced_chunks(sizes, num_chunks):
+    """Split items into chunks with similar total size: the items are
+    assigned in descending order of size to the chunk with the smallest 
+    total size so far.
+
+    :param sizes: the size of each item, with format {item: size}
+    :type sizes: dict
+    :param num_chunks: number of chunks
+    :type num_chunks: int
+    :return: chunks, the non-empty chunks in descending order of size
+    :rtype: list
+    """
+
+    chunks = [[] for i in range(num_chunks)]
+    totals = np.zeros(num_chunks, dtype=np.int64)
+
+    for item in sorted(sizes, key=lambda item: -sizes[item]):
+        chunk = int(np.argmin(totals))
+        chunks[chunk].append(item)
+        totals[chunk] += sizes[item]
+
+    return [chunks[chunk] for chunk in np.argsort(-totals, kind='stable')
+        if chunks[chunk] != []]
+
+
+def write_candidates_chunk(documents):
+    """Output the candidates files of a chunk of documents with the state of
+    the writer process."""
+
+    for document in documents:
+        write_candidates_file(
+            writer_state['entities_candidates'][document], 
+            writer_state['candidates_dir'] + document, 
+            writer_state['entity_type'], writer_state['kb_graph'], 
+            writer_state['link_mode'], writer_state['extracted_relations'], 
+            reachability=writer_state['reachability'], 
+            window_size=writer_state['window_size'])
+
+    return len(documents)
+
+
+def write_candidates_files(
+        entities_candidates, candidates_dir, entity_type, kb_graph, 
+        link_mode, extracted_relations, reachability=None, window_size=None,
+        workers=1):
+    """Output the candidates files of all the given documents. With several
+    workers, the documents are split into chunks with similar number of
+    candidate pairs and the chunks are written by a pool of forked processes,
+    which share the KB graph and the relations with the parent process 
+    (copy-on-write) instead of receiving a copy of them.
+
+    :param entities_candidates: candidates for all entity mentions in all 
+        documents, with format {doc_id: [(entity_str, candidates_list)]}
+    :type entities_candidates: dict
+    :param candidates_dir: output dir of the candidates files
+    :type candidates_dir: str
+    :param workers: number of processes, -1 uses all available cores, 
+        defaults to 1
+    :type workers: int
+    :return: the number of written files
+    :rtype: int
+    """
+
+    global writer_state
+    writer_state = {
+        'entities_candidates': entities_candidates, 
+        'candidates_dir': candidates_dir, 'entity_type': entity_type, 
+        'kb_graph': kb_graph, 'link_mode': link_mode, 
+        'extracted_relations': extracted_relations, 
+        'reachability': reachability, 'window_size': window_size}
+
+    if workers == -1:
+        workers = os.cpu_count()
+
+    # Linking the candidates of a document is quadratic in their number
+    sizes = {document: sum(len(annotation[1]) 
+        for annotation in entities_candidates[document]) ** 2 
+        for document in entities_candidates}
+    pbar = tqdm(total=len(sizes))
+
+    if workers <= 1 or len(sizes) <= 1 or \
+            'fork' not in multiprocessing.get_all_start_methods():
+        
+        for document in entities_candidates:
+            pbar.update(write_candidates_chunk([document]))
+    
+    else:
+        chunks = get_balanced_chunks(
+            sizes, min(len(sizes), workers * 4))
+        
+        with multiprocessing.get_context('fork').Pool(
+                processes=workers) as pool:
+
+            for num_written in pool.imap_unordered(
+                    write_candidates_chunk, chunks):
+                pbar.update(num_written)
+
+    pbar.close()
+    writer_state = None
+
+    return len(sizes)
\ No newline at end of file
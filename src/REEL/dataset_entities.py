@@ -5,10 +5,10 @@
 # The generated dicts are concatenated with the synonym_to_id dict of the target
 # KB
 import argparse
-import json
 import os
 import sys
 sys.path.append('./')
+from src.REEL.overlay import load_dict, write_overlay
 
 
 def get_annotations_from_pubtator(filename, ent_types):
@@ -75,7 +75,17 @@ def get_annotations_from_brat(filename, ent_type):
     return brat_annots 
 
 
-def build_annotations_dict(corpora_dir, out_dir, kb, dataset):
+def get_dataset_entities(corpora_dir, dataset):
+    """Get the entities annotated in the train and dev sets of given dataset,
+    associated with the respective KB identifier.
+
+    :param corpora_dir: dir with the corpora, e.g. 'data/corpora/'
+    :type corpora_dir: str
+    :param dataset: the dataset to harvest, e.g. 'ncbi_disease'
+    :type dataset: str
+    :return: entity_2_kb_id with format {entity_text: kb_id}
+    :rtype: dict
+    """
 
     entity_2_kb_id = {}
 
@@ -147,13 +157,18 @@ def build_annotations_dict(corpora_dir, out_dir, kb, dataset):
        
         entity_2_kb_id = {**entity_2_kb_id, **file_annots}
 
+    return entity_2_kb_id
+
+
+def build_annotations_dict(corpora_dir, out_dir, kb, dataset):
+
+    entity_2_kb_id = get_dataset_entities(corpora_dir, dataset)
+
     # ------------------------------------------------------------------------
     # Filter out the annotations that have an exact match in the target KB
     # ------------------------------------------------------------------------
 
-    with open('data/kbs/dicts/{}/name_to_id.json'.format(kb), 'r') as dictfile1:
-        name_to_id = json.load(dictfile1)
-        dictfile1.close()
+    name_to_id = load_dict('data/kbs/dicts/{}/name_to_id.json'.format(kb))
     
     to_delete = []
     corrected_nodes = {}
@@ -183,19 +198,15 @@ def build_annotations_dict(corpora_dir, out_dir, kb, dataset):
     #     Concatenate the generated dict with the respective synonym_to_id
     # ------------------------------------------------------------------------
     synonyms_filepath = 'data/kbs/dicts/{}/synonym_to_id.json'.format(kb)
-
-    with open(synonyms_filepath, 'r') as synonyms_file:
-        synonym_to_id = json.load(synonyms_file)
-        synonyms_file.close()
+    synonym_to_id = load_dict(synonyms_filepath)
     
-    output_dict = {**synonym_to_id, **entity_2_kb_id}
+    output_dict = dict(synonym_to_id.items())
+    output_dict.update(entity_2_kb_id)
     
-    synonym_to_id_plus = json.dumps(output_dict, indent=4, ensure_ascii=True)
+    # Only the entries added by the dataset are stored, as an overlay over 
+    # the synonym_to_id dict of the KB
     out_filename = out_dir + 'synonym_to_id_' + dataset + '.json'
-    
-    with open(out_filename, 'w') as out_file:
-        out_file.write(synonym_to_id_plus)
-        out_file.close()
+    write_overlay(out_filename, synonyms_filepath, synonym_to_id, output_dict)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""This module builds a symmetric deletion dictionary (as in SymSpell) over
+the surface forms (concept names and synonyms) of a KB. Every string obtained
+by deleting up to max_distance characters from the prefix of a surface form
+is indexed, so that the surface forms within edit distance max_distance of a
+given entity mention are found by generating the deletions of the mention
+alone, in a time that does not depend on the size of the KB."""
+
+import os
+import zlib
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+from src.REEL.ngram_index import get_sorted_form
+
+
+def get_deletions(text, max_distance):
+    """Get every string obtained by deleting up to max_distance characters
+    from given string, including the string itself.
+
+    :param text: the string to delete characters from
+    :type text: str
+    :param max_distance: maximum number of deleted characters
+    :type max_distance: int
+    :return: deletions
+    :rtype: set
+
+    >>> sorted(get_deletions("abc", 1))
+    ['ab', 'abc', 'ac', 'bc']
+    """
+
+    deletions = {text}
+    current = {text}
+
+    for distance in range(max_distance):
+        current = {word[:i] + word[i + 1:] for word in current
+            for i in range(len(word))}
+        deletions.update(current)
+
+    return deletions
+
+
+def hash_deletions(deletions):
+    """Map the deletions to 32-bit keys. Colliding keys only add surface
+    forms to the shortlist, which are then rejected by the edit distance
+    check."""
+
+    return np.array(
+        [zlib.crc32(deletion.encode('utf-8')) for deletion in deletions],
+        dtype=np.uint32)
+
+
+class DeletionIndex:
+    """Represent a symmetric deletion dictionary over a list of token-sorted
+    strings (the choices, see ngram_index.get_sorted_form). The dictionary
+    is stored as two aligned arrays sorted by key: the choices with deletion
+    key k are postings[keys == k]."""
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        """
+        :param max_distance: maximum edit distance between the token-sorted
+            forms of an entity and of the retrieved choices, defaults to 2
+        :type max_distance: int
+        :param prefix_length: only the deletions of the first prefix_length
+            characters of each string are indexed, which bounds the size of
+            the dictionary, defaults to 7
+        :type prefix_length: int
+        """
+
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.choices = None
+        self.keys = None
+        self.postings = None
+
+    def build(self, choices):
+        """Build the deletion dictionary for given choices.
+
+        :param choices: token-sorted strings to index, e.g. the sorted
+            forms of a lexicon
+        :type choices: sequence
+        """
+
+        self.choices = choices
+        keys = []
+        postings = []
+
+        for i, choice in enumerate(self.choices):
+            choice_keys = np.unique(hash_deletions(get_deletions(
+                choice[:self.prefix_length], self.max_distance)))
+            keys.append(choice_keys)
+            postings.append(np.full(len(choice_keys), i, dtype=np.int32))
+
+        keys = np.concatenate(keys) if keys != [] \
+            else np.zeros(0, dtype=np.uint32)
+        postings = np.concatenate(postings) if postings != [] \
+            else np.zeros(0, dtype=np.int32)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.postings = postings[order]
+
+    def save(self, filepath):
+        """Output the dictionary arrays into a .npz file."""
+
+        np.savez(
+            filepath, keys=self.keys, postings=self.postings,
+            settings=np.array([
+                self.max_distance, self.prefix_length, len(self.choices)]))
+
+    def load(self, filepath, choices):
+        """Load the dictionary arrays from a .npz file previously generated
+        for the given choices.
+
+        :raises ValueError: if the stored dictionary was built for different
+            choices or with different settings
+        """
+
+        self.choices = choices
+
+        with np.load(filepath) as index_file:
+            settings = index_file['settings'].tolist()
+
+            if settings != [
+                    self.max_distance, self.prefix_length, len(self.choices)]:
+                raise ValueError('Index does not match the given choices!')
+
+            self.keys = index_file['keys']
+            self.postings = index_file['postings']
+
+    def shortlist(self, entity_text):
+        """Retrieve the indexes of the choices whose token-sorted form is
+        within edit distance max_distance of the token-sorted entity text.
+
+        :param entity_text: the surface form of given entity
+        :type entity_text: str
+        :return: candidates, the indexes of the retrieved choices in
+            ascending order
+        :rtype: Numpy array
+        """
+
+        query = get_sorted_form(entity_text)
+        query_keys = np.unique(hash_deletions(get_deletions(
+            query[:self.prefix_length], self.max_distance)))
+        starts = np.searchsorted(self.keys, query_keys, side='left')
+        ends = np.searchsorted(self.keys, query_keys, side='right')
+        hits = [self.postings[start:end]
+            for start, end in zip(starts, ends) if end > start]
+
+        if hits == []:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = np.unique(np.concatenate(hits))
+
+        # Different prefixes may share a deletion, so the full strings are
+        # checked
+        within_distance = [
+            Levenshtein.distance(
+                query, self.choices[i], score_cutoff=self.max_distance)
+                <= self.max_distance for i in candidates]
+
+        return candidates[np.array(within_distance, dtype=bool)].astype(
+            np.int64)
+
+
+def load_deletion_index(
+        index_filepath, choices, sources, max_distance=2, prefix_length=7):
+    """Load the deletion dictionary stored in given file, if it is available
+    and up to date with the source files of the choices, or build it and
+    output it to that file otherwise.
+
+    :param index_filepath: path of the .npz file storing the dictionary
+    :type index_filepath: str
+    :param choices: the token-sorted strings to index
+    :type choices: sequence
+    :param sources: paths of the files (e.g. name_to_id.json) the choices
+        were loaded from
+    :type sources: list
+    :return: deletion_index
+    :rtype: DeletionIndex object
+    """
+
+    deletion_index = DeletionIndex(
+        max_distance=max_distance, prefix_length=prefix_length)
+
+    if os.path.exists(index_filepath) and \
+            all(os.path.getmtime(index_filepath) >= os.path.getmtime(source)
+                for source in sources):
+
+        try:
+            deletion_index.load(index_filepath, choices)
+
+            return deletion_index
+
+        except ValueError:
+            pass
+
+    deletion_index.build(choices)
+    deletion_index.save(index_filepath)
+
+    return deletion_index
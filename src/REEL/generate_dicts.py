@@ -1,13 +1,19 @@
 import argparse
 import json
-import networkx as nx
 import os
+import shutil
 import sys
 from kb import KnowledgeBase
+sys.path.append('./')
+from src.REEL.kb_artifact import CompiledKB
+from src.REEL.kb_graph import load_kb_graph
+from src.REEL.overlay import load_dict, write_graph_overlay, write_overlay
+from src.REEL.reachability import ReachabilityIndex
 
 
-def generate_dicts(kb, mode, include_omim):
-    """Generate target dictionaries for candidate retrieval."""
+def generate_dicts(kb, mode, include_omim, workers=1):
+    """Generate target dictionaries for candidate retrieval. The KB files 
+    that support it (ctd_chem) are parsed by the given number of processes."""
     
     if include_omim:
         out_dir = 'data/kbs/dicts/{}_OMIM/'.format(kb)
@@ -19,30 +25,31 @@ def generate_dicts(kb, mode, include_omim):
         os.mkdir(out_dir)
 
     kb_obj = KnowledgeBase(kb, mode)
-    kb_obj.load(include_omim=include_omim)
+    kb_obj.load(include_omim=include_omim, workers=workers)
     
-    if mode == 'reel':
+    if mode == 'reel' and include_omim:
+        # The dicts and the graph including the OMIM concepts are stored as
+        # overlays over the compiled KB without them, with only the names,
+        # synonyms and edges added by the OMIM concepts
+        base_dir = 'data/kbs/dicts/{}/'.format(kb)
 
-        #----------------------------------------------------------------------
-        name_to_id = kb_obj.name_to_id
-        out_dict_json = json.dumps(name_to_id, indent=4, ensure_ascii=True)
+        for dict_name in ['name_to_id', 'synonym_to_id', 'id_to_name']:
+            write_overlay(
+                out_dir + dict_name + '.json', base_dir + dict_name + '.json',
+                load_dict(base_dir + dict_name + '.json'),
+                getattr(kb_obj, dict_name))
 
-        with open(out_dir + '/name_to_id.json', 'w') as outfile:
-            outfile.write(out_dict_json)
-            outfile.close
-        
-        del name_to_id
+        write_graph_overlay(
+            out_dir, base_dir, load_kb_graph(base_dir), kb_obj.graph)
 
-        #----------------------------------------------------------------------
-        id_to_name = json.dumps(kb_obj.id_to_name, indent=4, ensure_ascii=True)
-        
-        with open(out_dir + '/id_to_name.json', 'w') as outfile2:
-            outfile2.write(id_to_name)
-            outfile2.close
-        
-        del id_to_name
-        
-        #----------------------------------------------------------------------
+        # The overlays are loaded only if there is no compiled KB in the dir
+        if os.path.exists(out_dir + 'compiled/'):
+            shutil.rmtree(out_dir + 'compiled/')
+
+    elif mode == 'reel':
+        # Binary artifact with the dicts (packed strings with a hash index)
+        # and the graph (with integer node ids in CSR format), memory-mapped
+        # by the loaders instead of parsing JSON and GraphML files
         synonym_to_id = kb_obj.synonym_to_id
 
         #if kb == 'medic':
@@ -52,17 +59,30 @@ def generate_dicts(kb, mode, include_omim):
         #    mesh_synonyms = kb_obj_2.synonym_to_id
         #    synonym_to_id = {**synonym_to_id, **mesh_synonyms}
 
-        synonym_to_id_dump = json.dumps(
-            synonym_to_id, indent=4, ensure_ascii=True)
-        
-        with open(out_dir + '/synonym_to_id.json', 'w') as outfile3:
-            outfile3.write(synonym_to_id_dump)
-            outfile3.close
-        
+        compiled_kb = CompiledKB()
+        compiled_kb.build(
+            kb_obj.name_to_id, synonym_to_id, kb_obj.id_to_name, 
+            kb_obj.graph)
+        compiled_kb.save(out_dir + '/compiled/')
+
+        del compiled_kb
         del synonym_to_id
 
+    if mode == 'reel':
         #----------------------------------------------------------------------
-        nx.write_graphml_lxml(kb_obj.graph, out_dir + "/graph.graphml")
+        # Ancestors of each concept, to check if two concepts are related
+        reachability = ReachabilityIndex()
+        reachability.build(kb_obj.graph)
+        reachability.save(out_dir + "/reachability.npz")
+
+        if kb in kb_obj.xml_file:
+            # MeSH tree numbers, to check if two concepts are related
+            id_to_tree_numbers = json.dumps(
+                kb_obj.id_to_tree_numbers, indent=4, ensure_ascii=True)
+
+            with open(out_dir + '/id_to_tree_numbers.json', 'w') as outfile5:
+                outfile5.write(id_to_tree_numbers)
+                outfile5.close()
     
     elif mode == 'nilinker' and kb == 'chebi':
         
@@ -81,6 +101,8 @@ if __name__ == '__main__':
     parser.add_argument('-kb', type=str)
     parser.add_argument('-mode', type=str)
     parser.add_argument('--include_omim', type=str, default='False')
+    parser.add_argument('--workers', type=int, default=1, 
+        help='Number of processes parsing the KB file (-1 to use all cores)')
     args = parser.parse_args()
 
     if args.include_omim == 'True':
@@ -89,4 +111,9 @@ if __name__ == '__main__':
     elif args.include_omim == 'False':
         include_omim =False
 
-    generate_dicts(args.kb, args.mode, include_omim)
+    workers = args.workers
+
+    if workers == -1:
+        workers = os.cpu_count()
+
+    generate_dicts(args.kb, args.mode, include_omim, workers=workers)
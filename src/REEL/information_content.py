@@ -4,6 +4,7 @@ import sys
 import xml.etree.ElementTree as ET
 from math import log
 sys.path.append("./")
+from src.REEL.kb_graph import count_descendants
 
 
 def build_term_counts(entities_candidates):
@@ -56,7 +57,7 @@ def build_information_content_dict(entities_candidates, mode=None, kb_graph=None
         elif mode == 'intrinsic':
 
             try:
-                num_descendants = len(nx.descendants(kb_graph, term_id))
+                num_descendants = count_descendants(kb_graph, term_id)
                 term_probability = (num_descendants + 1) / total_terms
             
             except:
@@ -74,7 +75,7 @@ def build_information_content_dict(entities_candidates, mode=None, kb_graph=None
 def generate_ic_file(
         run_id, entities_candidates, kb_graph):
     """Generate file with information content of all entities present in the 
-    candidates files."""
+    candidates files and return it as a dict {kb_id: information_content}."""
 
     ic = build_information_content_dict(
         entities_candidates, mode='intrinsic', kb_graph=kb_graph) 
@@ -91,4 +92,6 @@ def generate_ic_file(
 
     with open(output_file_name, 'w') as ic_file:
         ic_file.write(out_string)
-        ic_file.close()
\ No newline at end of file
+        ic_file.close()
+
+    return ic
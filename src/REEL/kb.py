@@ -3,10 +3,213 @@
 objects (dictionaries and Networkx graph)."""
 
 import csv
+import io
+import multiprocessing
 import networkx as nx
-import obonet
+import os
+import re
 import xml.etree.ElementTree as ET
 
+# Tags of the OBO term stanzas used by load_obo: the single-valued tags keep 
+# the last value and the others keep a list with every value, as in obonet
+obo_term_tags = {
+    'id': True, 'name': True, 'is_obsolete': True, 'alt_id': False, 
+    'is_a': False, 'synonym': False}
+
+# Tag, value, trailing modifier and comment of an OBO tag-value line (the 
+# pattern of obonet 0.3.0, so that the values are the same)
+obo_tag_line = re.compile(
+    r"^(?P<tag>.+?): *(?P<value>.+?) ?(?P<trailing_modifier>(?<!\\)\{.*?"
+    r"(?<!\\)\})? ?(?P<comment>(?<!\\)!.*?)?$")
+
+
+def iter_records(filepath, tag):
+    """Parse the given XML file incrementally, yielding each record with 
+    given tag (e.g. 'DescriptorRecord') once it is complete. The parsed 
+    records are removed from the tree after use, so memory does not grow with 
+    the size of the file.
+
+    :param filepath: path of the XML file, e.g. 
+        'data/kbs/original_files/desc2014.xml'
+    :type filepath: str
+    :param tag: tag of the records
+    :type tag: str
+    :return: record elements
+    :rtype: iterator
+    """
+
+    context = ET.iterparse(filepath, events=('start', 'end'))
+    _, root = next(context)
+
+    for event, element in context:
+
+        if event == 'end' and element.tag == tag:
+            yield element
+            root.clear()
+
+
+def read_obo_terms(filepath):
+    """Read the [Term] stanzas of an OBO file line by line, keeping only the 
+    tags in obo_term_tags. As in obonet.read_obo, obsolete terms are skipped 
+    and the stanzas with an already seen id update the fields of that term.
+
+    :param filepath: path of the OBO file, e.g. 
+        'data/kbs/original_files/CTD_diseases.obo'
+    :type filepath: str
+    :return: terms with format {term_id: {tag: value}}, in file order
+    :rtype: dict
+    """
+
+    terms = {}
+    term = None
+    stanza_start = True
+
+    with open(filepath, 'r') as obo_file:
+
+        for line in obo_file:
+
+            if line.strip() == '':
+
+                if term is not None and term.get('is_obsolete') != 'true':
+                    terms.setdefault(term.pop('id'), {}).update(term)
+                
+                term = None
+                stanza_start = True
+                continue
+
+            if stanza_start:
+                # Only the [Term] stanzas are read
+                stanza_start = False
+                
+                if line.startswith('[Term]'):
+                    term = {}
+
+                continue
+
+            if term is None or line.startswith('!') or \
+                    line.split(':', 1)[0] not in obo_term_tags:
+                continue
+
+            match = obo_tag_line.match(line)
+
+            if match is None:
+                raise ValueError(
+                    'Tag-value pair parsing failed for:\n{}'.format(line))
+
+            tag, value = match.group('tag'), match.group('value')
+
+            if obo_term_tags[tag]:
+                term[tag] = value
+
+            else:
+                term.setdefault(tag, []).append(value)
+
+        if term is not None and term.get('is_obsolete') != 'true':
+            terms.setdefault(term.pop('id'), {}).update(term)
+
+        obo_file.close()
+
+    return terms
+
+
+def get_line_chunks(filepath, num_chunks, skip_lines=0):
+    """Split the given file into byte ranges of similar size that start and 
+    end at line boundaries, after its first skip_lines lines.
+
+    :param filepath: path of the file
+    :type filepath: str
+    :param num_chunks: max number of byte ranges
+    :type num_chunks: int
+    :param skip_lines: number of lines at the start of the file (e.g. the 
+        header) excluded from the ranges, defaults to 0
+    :type skip_lines: int
+    :return: chunks with format [(filepath, start, end)], in file order
+    :rtype: list
+    """
+
+    file_size = os.path.getsize(filepath)
+
+    with open(filepath, 'rb') as in_file:
+
+        for i in range(skip_lines):
+            in_file.readline()
+
+        start = in_file.tell()
+        boundaries = [start]
+
+        for i in range(1, num_chunks):
+            position = start + (file_size - start) * i // num_chunks
+            # Move to the start of the next line (or stay if the position is 
+            # already at the start of a line)
+            in_file.seek(max(position - 1, 0))
+            in_file.readline()
+            
+            if boundaries[-1] < in_file.tell() < file_size:
+                boundaries.append(in_file.tell())
+
+        in_file.close()
+
+    boundaries.append(file_size)
+
+    return [(filepath, boundaries[i], boundaries[i + 1]) 
+        for i in range(len(boundaries) - 1) 
+        if boundaries[i] < boundaries[i + 1]]
+
+
+def parse_tsv_chunk(chunk):
+    """Parse the rows of CTD_chemicals.tsv in the given byte range into 
+    partial dicts and edges list, see KnowledgeBase.load_tsv.
+
+    :param chunk: (filepath, start, end)
+    :type chunk: tuple
+    :return: name_to_id, id_to_name, synonym_to_id, child_to_parent and 
+        edges of the rows, in file order
+    :rtype: tuple (dict, dict, dict, dict, list)
+    """
+
+    filepath, start, end = chunk
+    name_to_id = {}
+    id_to_name = {}
+    synonym_to_id = {}
+    child_to_parent = {}
+    edges = []
+
+    with open(filepath, 'rb') as kb_file:
+        kb_file.seek(start)
+        data = kb_file.read(end - start)
+        kb_file.close()
+
+    # Universal newlines, as when the file is read in text mode
+    reader = csv.reader(
+        io.StringIO(data.decode('utf-8'), newline=None), delimiter="\t")
+
+    for row in reader:
+        node_name = row[0] 
+        node_id = row[1].split(':')[1]
+
+        node_parents = row[4].split('|')
+        synonyms = row[7].split('|')
+        name_to_id[node_name] = node_id
+
+        # To be used by NILINKER, so it need the prefix 'MESH:'
+        id_to_name['MESH:' + node_id] = node_name
+        
+        if len(node_parents) == 1: #
+            # Only consider concepts with 1 direct ancestor
+            child_to_parent[node_id] = node_parents[0]
+        
+        for synonym in synonyms:
+            synonym_to_id[synonym] = node_id
+
+        for parent in node_parents: 
+            # To build the edges list, consider 
+            # all concepts with at least one ancestor 
+            
+            if parent != '':
+                edges.append((parent.split(':')[1], node_id))
+
+    return name_to_id, id_to_name, synonym_to_id, child_to_parent, edges
+
 
 class KnowledgeBase:
     """Represent a knowledge base that is loaded from a given local file."""
@@ -31,7 +234,7 @@ class KnowledgeBase:
         self.xml_file = {"mesh_dis", "mesh_chem"}
         
         assert kb in self.obo_file or kb in self.tsv_file or kb in self.xml_file, \
-            'Invalid knowledge base! Available: medic, ctd_chem
+            'Invalid knowledge base! Available: medic, ctd_chem, mesh_dis, mesh_chem'
 
     def load_obo(self, include_omim=False):
         """Load KBs from local .obo files into structured dicts containing
@@ -52,10 +255,11 @@ class KnowledgeBase:
         child_to_parent = {}
         alt_id_to_id = {}
 
-        graph = obonet.read_obo(filepath)
+        # Only the fields used below are kept in memory
+        terms = read_obo_terms(filepath)
         edges = []
         
-        for node in  graph.nodes(data=True):
+        for node in terms.items():
             add_node = False
             
             if "name" in node[1].keys():
@@ -142,13 +346,15 @@ class KnowledgeBase:
         self.alt_id_to_id = alt_id_to_id
         self.edges = edges
         
-    def load_tsv(self):
+    def load_tsv(self, workers=1):
         """Load KBs from local .tsv files into structured dicts containing 
         the mappings name_to_id, id_to_name, synonym_to_id, child_to_parent, 
         and the list of edges between concepts.
         
         :param kb: target ontology to load, has value 'ctd_chem'
         :type kb: str
+        :param workers: number of processes parsing the file, defaults to 1
+        :type workers: int
         """
                 
         kb_dict = {"ctd_chem": "CTD_chemicals"}
@@ -160,37 +366,25 @@ class KnowledgeBase:
         child_to_parent= {}
         edges = []
 
-        with open(filepath) as kb_file:
-            reader = csv.reader(kb_file, delimiter="\t")
-            row_count = int()
-        
-            for row in reader:
-                row_count += 1
-                
-                if row_count >= 30:
-                    node_name = row[0] 
-                    node_id = row[1].split(':')[1]
-        
-                    node_parents = row[4].split('|')
-                    synonyms = row[7].split('|')
-                    name_to_id[node_name] = node_id
+        # The rows after the header (the first 29 lines) are split into 
+        # chunks parsed by several processes, and the partial dicts are merged
+        # in file order, so the output is the same of a sequential parsing
+        chunks = get_line_chunks(filepath, workers * 4, skip_lines=29)
 
-                    # To be used by NILINKER, so it need the prefix 'MESH:'
-                    id_to_name['MESH:' + node_id] = node_name
-                    
-                    if len(node_parents) == 1: #
-                        # Only consider concepts with 1 direct ancestor
-                        child_to_parent[node_id] = node_parents[0]
-                    
-                    for synonym in synonyms:
-                        synonym_to_id[synonym] = node_id
+        if workers > 1:
 
-                    for parent in node_parents: 
-                        # To build the edges list, consider 
-                        # all concepts with at least one ancestor 
-                        
-                        if parent != '':
-                            edges.append((parent.split(':')[1], node_id))
+            with multiprocessing.Pool(processes=workers) as pool:
+                chunk_outputs = pool.map(parse_tsv_chunk, chunks)
+        
+        else:
+            chunk_outputs = map(parse_tsv_chunk, chunks)
+
+        for chunk_output in chunk_outputs:
+            name_to_id.update(chunk_output[0])
+            id_to_name.update(chunk_output[1])
+            synonym_to_id.update(chunk_output[2])
+            child_to_parent.update(chunk_output[3])
+            edges.extend(chunk_output[4])
         
         root_concept_name = self.root_dict[self.kb][1]
         root_concept_id = self.root_dict[self.kb][0]
@@ -213,8 +407,11 @@ class KnowledgeBase:
         id_to_name = {}
         synonym_to_id = {}
         tree_number_to_id = {}
+        id_to_tree_numbers = {}
         edges_tmp = []
         edges = []
+        # Edges already added to the edges list, for constant time lookups
+        added_edges = set()
         graph = None
         cutoff_year = 2014 # only concepts added until this year are considered
         
@@ -223,9 +420,6 @@ class KnowledgeBase:
         #----------------------------------------------------------------------
         data_dir = "data/kbs/original_files/"
         
-        desc_tree = ET.parse(data_dir + "desc2014.xml") 
-        desc_root = desc_tree.getroot()
-
         reference_letter = ''
 
         if self.kb == "mesh_dis":
@@ -234,12 +428,15 @@ class KnowledgeBase:
         elif self.kb == "mesh_chem":
             reference_letter = "D"
         
-        for i , descriptor in enumerate(desc_root.iter("DescriptorRecord")):
+        # The records are streamed instead of loading the whole tree
+        for i , descriptor in enumerate(
+                iter_records(data_dir + "desc2014.xml", "DescriptorRecord")):
             node_name = ''
             node_id = ''
             node_tree_number = ''
             add_node = False
             synonyms = []
+            node_tree_numbers = []
             parent_tree_numbers = []
             year_added = 10000
 
@@ -262,6 +459,7 @@ class KnowledgeBase:
                         if node_tree_number[0] == reference_letter:
                             add_node = True
                             tree_number_to_id[node_tree_number] = node_id
+                            node_tree_numbers.append(node_tree_number)
                             parent_tree_number = node_tree_number[:-4]
                             parent_tree_numbers.append(parent_tree_number)
 
@@ -280,6 +478,7 @@ class KnowledgeBase:
 
                 name_to_id[node_name] = node_id
                 id_to_name[node_id] = node_name
+                id_to_tree_numbers[node_id] = node_tree_numbers
 
                 for parent_tree_number in parent_tree_numbers:
                     edges_tmp.append((parent_tree_number, node_id))
@@ -290,10 +489,8 @@ class KnowledgeBase:
         #----------------------------------------------------------------------
         #               Import supplementary records data
         #----------------------------------------------------------------------
-        sup_tree = ET.parse(data_dir + "supp2014.xml") 
-        sup_root = sup_tree.getroot()
-        
-        for i , concept in enumerate(sup_root.iter("SupplementalRecord")):
+        for i , concept in enumerate(
+                iter_records(data_dir + "supp2014.xml", "SupplementalRecord")):
             node_name = ''
             node_id = ''
             add_node = False
@@ -347,6 +544,15 @@ class KnowledgeBase:
                 for parent_id in parent_ids:
                     edges_tmp.append((parent_id, node_id))
 
+                # Supplementary records have no tree numbers, so they are 
+                # placed below the tree numbers of the descriptors they are 
+                # mapped to
+                id_to_tree_numbers[node_id] = [
+                    parent_tree_number + '.' + node_id 
+                    for parent_id in parent_ids 
+                    for parent_tree_number in id_to_tree_numbers.get(
+                        parent_id, [])]
+
                 for synonym in synonyms:
                     synonym_to_id[synonym] = node_id      
 
@@ -374,16 +580,21 @@ class KnowledgeBase:
     
             edge = (parent_id, node_id)
 
-            if edge not in edges:
+            if edge not in added_edges:
+                added_edges.add(edge)
                 edges.append(edge)
        
+        # The root concept is the tree category ('C' or 'D')
+        id_to_tree_numbers[reference_letter] = [reference_letter]
+
         kb_graph = nx.DiGraph([edge for edge in edges])
         self.name_to_id = name_to_id
         self.id_to_name = id_to_name
         self.synonym_to_id = synonym_to_id
+        self.id_to_tree_numbers = id_to_tree_numbers
         self.graph = kb_graph
             
-    def load(self, include_omim=False):
+    def load(self, include_omim=False, workers=1):
 
         loaded_kb = None
 
@@ -392,7 +603,7 @@ class KnowledgeBase:
                 self, include_omim=include_omim)
 
         elif self.kb in self.tsv_file:
-            loaded_kb = KnowledgeBase.load_tsv(self)
+            loaded_kb = KnowledgeBase.load_tsv(self, workers=workers)
 
         elif self.kb in self.xml_file:
             loaded_kb = KnowledgeBase.load_xml(self)
@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+"""This module compiles the dicts and the graph of a KB into a binary
+artifact, the only KB file generated by generate_dicts.py: a sorted table of
+the KB ids (so each concept has an integer id), the names, synonyms and
+id_to_name entries as UTF-8 string tables pointing to the integer ids (with
+the sorted hashes of the keys to look them up), the in- and outdegrees of
+the concepts and their parents and children in CSR format. The arrays are
+stored as .npy files and memory-mapped when loaded, and the dicts are
+read-only views of the arrays (see CompiledDict), so opening the KB does not
+parse any file or copy the dicts into Python objects. The degrees, ancestors
+and descendants of the concepts are found with the CSR arrays (see
+kb_graph.NetworkxView)."""
+
+import hashlib
+import os
+from collections.abc import Mapping, Sequence
+import networkx as nx
+import numpy as np
+from src.REEL.trie import pack_strings
+
+# Number of strings decoded at once when iterating a string table
+CHUNK_SIZE = 65536
+
+
+def get_key_hash(key):
+    """Get the 64-bit hash of given UTF-8 encoded key."""
+
+    return int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def get_hash_index(keys):
+    """Get the sorted hashes of the given keys and the position of the key
+    of each hash, to look up the keys by binary search.
+
+    :param keys: e.g. the keys of name_to_id
+    :type keys: iterable
+    :return: hashes and order
+    :rtype: tuple (Numpy array, Numpy array)
+    """
+
+    hashes = np.array(
+        [get_key_hash(key.encode('utf-8')) for key in keys], dtype=np.uint64)
+    order = np.argsort(hashes, kind='stable')
+
+    return hashes[order], order.astype(np.int64)
+
+
+class PackedStrings(Sequence):
+    """Represent the strings packed by trie.pack_strings, decoded on
+    access."""
+
+    def __init__(self, buffer, offsets):
+
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+
+        return len(self.offsets) - 1
+
+    def get_bytes(self, i):
+
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+
+        return self.get_bytes(i).decode('utf-8')
+
+    def __iter__(self):
+
+        for start in range(0, len(self), CHUNK_SIZE):
+            offsets = self.offsets[start:start + CHUNK_SIZE + 1].tolist()
+            data = self.buffer[offsets[0]:offsets[-1]].tobytes()
+
+            for i in range(len(offsets) - 1):
+                yield data[offsets[i] - offsets[0]:
+                    offsets[i + 1] - offsets[0]].decode('utf-8')
+
+
+class ConceptIds:
+    """Represent the KB ids of a sequence of integer ids, decoded on
+    access."""
+
+    def __init__(self, ids, concepts):
+
+        self.ids = ids
+        self.concepts = concepts
+
+    def __len__(self):
+
+        return len(self.concepts)
+
+    def __getitem__(self, i):
+
+        return self.ids[self.concepts[i]].decode('utf-8')
+
+    def __iter__(self):
+
+        for start in range(0, len(self), CHUNK_SIZE):
+
+            for kb_id in self.ids[
+                    self.concepts[start:start + CHUNK_SIZE]].tolist():
+                yield kb_id.decode('utf-8')
+
+
+class CompiledDict(Mapping):
+    """Represent a KB dict stored in the compiled KB, read-only. The keys are
+    looked up by their hash and iterated in the original order of the dict,
+    and the keys and values are only decoded when they are accessed."""
+
+    def __init__(self, keys, hashes, order, values):
+        """
+        :param keys: the keys of the dict
+        :type keys: PackedStrings object
+        :param hashes: sorted hashes of the keys, see get_hash_index
+        :type hashes: Numpy array
+        :param order: position of the key of each hash
+        :type order: Numpy array
+        :param values: the values of the dict, in the order of the keys
+        :type values: PackedStrings or ConceptIds object
+        """
+
+        self.keys_table = keys
+        self.hashes = hashes
+        self.order = order
+        self.values_table = values
+
+    def get_position(self, key):
+        """Get the position of given key in the dict, or -1."""
+
+        if not isinstance(key, str):
+            return -1
+
+        key = key.encode('utf-8')
+        key_hash = np.uint64(get_key_hash(key))
+        position = int(np.searchsorted(self.hashes, key_hash))
+
+        while position < len(self.hashes) and \
+                self.hashes[position] == key_hash:
+            i = int(self.order[position])
+
+            if self.keys_table.get_bytes(i) == key:
+                return i
+
+            position += 1
+
+        return -1
+
+    def __getitem__(self, key):
+
+        i = self.get_position(key)
+
+        if i < 0:
+            raise KeyError(key)
+
+        return self.values_table[i]
+
+    def __contains__(self, key):
+
+        return self.get_position(key) >= 0
+
+    def __iter__(self):
+
+        return iter(self.keys_table)
+
+    def __len__(self):
+
+        return len(self.keys_table)
+
+    def items(self):
+        """Iterate the (key, value) pairs in order, decoding the keys and
+        the values sequentially instead of looking up each key."""
+
+        return zip(self.keys_table, self.values_table)
+
+    def values(self):
+
+        return iter(self.values_table)
+
+
+def get_csr(sources, targets, num_nodes):
+    """Build the CSR arrays of the adjacency lists of given edges: the
+    targets of node i are targets[offsets[i]:offsets[i + 1]], in ascending
+    order."""
+
+    order = np.lexsort((targets, sources))
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=offsets[1:])
+
+    return offsets, targets[order].astype(np.int32)
+
+
+def get_neighbours(offsets, targets, nodes):
+    """Get the concatenated adjacency lists of the given nodes.
+
+    :param offsets: CSR offsets, the targets of node i are
+        targets[offsets[i]:offsets[i + 1]]
+    :type offsets: Numpy array
+    :param targets: CSR targets
+    :type targets: Numpy array
+    :param nodes: integer node ids
+    :type nodes: Numpy array
+    :return: neighbours, may include repeated nodes
+    :rtype: Numpy array
+    """
+
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+    # Position of every neighbour in targets
+    positions = np.arange(lengths.sum()) + np.repeat(
+        starts - (np.cumsum(lengths) - lengths), lengths)
+
+    return targets[positions]
+
+
+def search_ids(ids, kb_ids):
+    """Get the positions of the given KB ids in the sorted table ids, -1 for
+    the KB ids that are not in the table."""
+
+    kb_ids = np.array(
+        [kb_id.encode('utf-8') for kb_id in kb_ids], dtype=bytes)
+
+    if len(kb_ids) == 0 or len(ids) == 0:
+        return np.full(len(kb_ids), -1, dtype=np.int64)
+
+    positions = np.searchsorted(ids, kb_ids)
+    positions[positions == len(ids)] = 0
+    found = ids[positions] == kb_ids
+
+    return np.where(found, positions, -1).astype(np.int64)
+
+
+class CompiledKB:
+    """Represent the compiled artifact of a KB. The ids table also includes
+    the KB ids of the dicts that are not in the graph, so graph_nodes marks
+    the integer ids of the graph nodes. The children of the concept i are
+    children[child_offsets[i]:child_offsets[i + 1]] and its parents are
+    parents[parent_offsets[i]:parent_offsets[i + 1]], both in ascending
+    order."""
+
+    array_names = [
+        'ids', 'name_forms', 'name_offsets', 'name_concepts', 'name_hashes',
+        'name_order', 'synonym_forms', 'synonym_offsets',
+        'synonym_concepts', 'synonym_hashes', 'synonym_order', 'id_keys',
+        'id_key_offsets', 'id_names', 'id_name_offsets', 'id_key_hashes',
+        'id_key_order', 'graph_nodes', 'in_degrees', 'out_degrees',
+        'parent_offsets', 'parents', 'child_offsets', 'children']
+
+    # Arrays with the content of each dict (the hashes are derived from it)
+    dict_arrays = {
+        'name_to_id': ['ids', 'name_forms', 'name_offsets', 'name_concepts'],
+        'synonym_to_id': [
+            'ids', 'synonym_forms', 'synonym_offsets', 'synonym_concepts'],
+        'id_to_name': [
+            'id_keys', 'id_key_offsets', 'id_names', 'id_name_offsets']}
+
+    def __init__(self):
+
+        for array_name in self.array_names:
+            setattr(self, array_name, None)
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def __contains__(self, kb_id):
+
+        return self.get_concept(kb_id) >= 0
+
+    def build(self, name_to_id, synonym_to_id, id_to_name, kb_graph):
+        """Compile the given dicts and graph of a KB.
+
+        :param name_to_id: KB names and respective KB ids
+        :type name_to_id: dict
+        :param synonym_to_id: KB synonyms and respective KB ids
+        :type synonym_to_id: dict
+        :param id_to_name: KB ids (as used by NILINKER) and respective names
+        :type id_to_name: dict
+        :param kb_graph: represents the KB
+        :type kb_graph: Networkx DiGraph object
+        """
+
+        kb_ids = set(kb_graph.nodes())
+        kb_ids.update(name_to_id.values())
+        kb_ids.update(synonym_to_id.values())
+        self.ids = np.array(
+            sorted(kb_id.encode('utf-8') for kb_id in kb_ids), dtype=bytes)
+
+        self.name_forms, self.name_offsets = pack_strings(name_to_id.keys())
+        self.name_concepts = self.get_concepts(name_to_id.values())
+        self.name_hashes, self.name_order = get_hash_index(name_to_id.keys())
+        self.synonym_forms, self.synonym_offsets = pack_strings(
+            synonym_to_id.keys())
+        self.synonym_concepts = self.get_concepts(synonym_to_id.values())
+        self.synonym_hashes, self.synonym_order = get_hash_index(
+            synonym_to_id.keys())
+        self.id_keys, self.id_key_offsets = pack_strings(id_to_name.keys())
+        self.id_names, self.id_name_offsets = pack_strings(
+            id_to_name.values())
+        self.id_key_hashes, self.id_key_order = get_hash_index(
+            id_to_name.keys())
+
+        self.graph_nodes = np.zeros(len(self.ids), dtype=bool)
+        self.graph_nodes[self.get_concepts(kb_graph.nodes())] = True
+        edges = list(kb_graph.edges())
+        sources = self.get_concepts([edge[0] for edge in edges])
+        targets = self.get_concepts([edge[1] for edge in edges])
+        self.out_degrees = np.bincount(
+            sources, minlength=len(self.ids)).astype(np.int32)
+        self.in_degrees = np.bincount(
+            targets, minlength=len(self.ids)).astype(np.int32)
+        self.child_offsets, self.children = get_csr(
+            sources, targets, len(self.ids))
+        self.parent_offsets, self.parents = get_csr(
+            targets, sources, len(self.ids))
+
+    def save(self, dirpath):
+        """Output the arrays into .npy files in given dir."""
+
+        if not os.path.exists(dirpath):
+            os.mkdir(dirpath)
+
+        for array_name in self.array_names:
+            np.save(
+                os.path.join(dirpath, array_name + '.npy'),
+                getattr(self, array_name))
+
+    def load(self, dirpath):
+        """Memory-map the arrays stored in given dir."""
+
+        for array_name in self.array_names:
+            setattr(self, array_name, np.load(
+                os.path.join(dirpath, array_name + '.npy'), mmap_mode='r'))
+
+    def get_concepts(self, kb_ids):
+        """Get the integer ids of the given KB ids, -1 for the KB ids that
+        are not in the artifact.
+
+        :param kb_ids: KB ids, e.g. ['D000001']
+        :type kb_ids: iterable
+        :return: concepts
+        :rtype: Numpy array
+        """
+
+        return search_ids(self.ids, kb_ids)
+
+    def get_concept(self, kb_id):
+        """Get the integer id of given KB id, or -1."""
+
+        return int(self.get_concepts([kb_id])[0])
+
+    def get_kb_id(self, concept):
+        """Get the KB id of given integer id."""
+
+        return self.ids[concept].decode('utf-8')
+
+    def get_kb_ids(self, concepts):
+        """Get the KB ids of the given integer ids."""
+
+        return [kb_id.decode('utf-8') for kb_id in self.ids[concepts].tolist()]
+
+    #-------------------------------------------------------------------------
+    #                               KB graph
+    #-------------------------------------------------------------------------
+    def get_graph_nodes(self):
+        """Get the integer ids of the graph nodes, in ascending order."""
+
+        return np.flatnonzero(self.graph_nodes)
+
+    def has_node(self, kb_id):
+        """Check if given KB concept is a node of the graph."""
+
+        concept = self.get_concept(kb_id)
+
+        return concept >= 0 and bool(self.graph_nodes[concept])
+
+    def number_of_nodes(self):
+
+        return int(np.count_nonzero(self.graph_nodes))
+
+    def number_of_edges(self):
+
+        return len(self.children)
+
+    def in_degree(self, kb_id):
+        """Number of parents of given KB concept (0 if it is not in the
+        graph)."""
+
+        concept = self.get_concept(kb_id)
+
+        return int(self.in_degrees[concept]) if concept >= 0 else 0
+
+    def out_degree(self, kb_id):
+        """Number of children of given KB concept (0 if it is not in the
+        graph)."""
+
+        concept = self.get_concept(kb_id)
+
+        return int(self.out_degrees[concept]) if concept >= 0 else 0
+
+    def get_parents(self, concept):
+        """Get the integer ids of the parents of given integer id."""
+
+        return self.parents[
+            self.parent_offsets[concept]:self.parent_offsets[concept + 1]]
+
+    def get_children(self, concept):
+        """Get the integer ids of the children of given integer id."""
+
+        return self.children[
+            self.child_offsets[concept]:self.child_offsets[concept + 1]]
+
+    def has_edge(self, source, target):
+        """Check if there is an edge from the KB concept source to the KB
+        concept target."""
+
+        source, target = self.get_concepts([source, target])
+
+        if source < 0 or target < 0:
+            return False
+
+        children = self.get_children(source)
+        position = np.searchsorted(children, target)
+
+        return bool(position < len(children) and children[position] == target)
+
+    def _traverse(self, concept, offsets, targets):
+        """Mark the concepts reachable from given integer id following the
+        given CSR arrays, excluding the concept itself (as networkx does)."""
+
+        reached = np.zeros(len(self.ids), dtype=bool)
+        reached[concept] = True
+        frontier = np.array([concept], dtype=np.int64)
+
+        while len(frontier) > 0:
+            neighbours = get_neighbours(offsets, targets, frontier)
+            frontier = np.unique(neighbours[~reached[neighbours]])
+            reached[frontier] = True
+
+        reached[concept] = False
+
+        return reached
+
+    def get_ancestors(self, concept):
+        """Get the integer ids of the ancestors of given integer id."""
+
+        return np.flatnonzero(self._traverse(
+            concept, self.parent_offsets, self.parents))
+
+    def get_descendants(self, concept):
+        """Get the integer ids of the descendants of given integer id."""
+
+        return np.flatnonzero(self._traverse(
+            concept, self.child_offsets, self.children))
+
+    def count_descendants(self, concept):
+        """Number of descendants of given integer id."""
+
+        return int(self._traverse(
+            concept, self.child_offsets, self.children).sum())
+
+    def to_networkx(self):
+        """Build the networkx graph of the KB.
+
+        :return: kb_graph
+        :rtype: Networkx DiGraph object
+        """
+
+        kb_ids = self.get_kb_ids(np.arange(len(self.ids)))
+        sources = np.repeat(np.arange(len(self.ids)), self.out_degrees)
+        kb_graph = nx.DiGraph()
+        kb_graph.add_nodes_from(
+            kb_ids[concept] for concept in self.get_graph_nodes().tolist())
+        kb_graph.add_edges_from(
+            (kb_ids[source], kb_ids[target]) for source, target in
+            zip(sources.tolist(), self.children.tolist()))
+
+        return kb_graph
+
+    #-------------------------------------------------------------------------
+    #                               KB dicts
+    #-------------------------------------------------------------------------
+    def get_name_to_id(self):
+        """Get the name_to_id dict of the KB, in the original order, as a
+        read-only view of the arrays."""
+
+        return CompiledDict(
+            PackedStrings(self.name_forms, self.name_offsets),
+            self.name_hashes, self.name_order,
+            ConceptIds(self.ids, self.name_concepts))
+
+    def get_synonym_to_id(self):
+        """Get the synonym_to_id dict of the KB, in the original order, as a
+        read-only view of the arrays."""
+
+        return CompiledDict(
+            PackedStrings(self.synonym_forms, self.synonym_offsets),
+            self.synonym_hashes, self.synonym_order,
+            ConceptIds(self.ids, self.synonym_concepts))
+
+    def get_id_to_name(self):
+        """Get the id_to_name dict of the KB, in the original order, as a
+        read-only view of the arrays."""
+
+        return CompiledDict(
+            PackedStrings(self.id_keys, self.id_key_offsets),
+            self.id_key_hashes, self.id_key_order,
+            PackedStrings(self.id_names, self.id_name_offsets))
+
+
+def get_dict_arrays(kb_dicts_dir, dict_name):
+    """Get the paths of the .npy files with the content of given dict in the
+    compiled artifact of the KB in given dir.
+
+    :param kb_dicts_dir: e.g. 'data/kbs/dicts/medic/'
+    :type kb_dicts_dir: str
+    :param dict_name: 'name_to_id', 'synonym_to_id' or 'id_to_name'
+    :type dict_name: str
+    :return: filepaths, or None if the KB was not compiled
+    :rtype: list
+    """
+
+    artifact_dir = os.path.join(kb_dicts_dir, 'compiled')
+
+    if not os.path.exists(os.path.join(artifact_dir, 'ids.npy')):
+        return None
+
+    return [os.path.join(artifact_dir, array_name + '.npy')
+        for array_name in CompiledKB.dict_arrays[dict_name]]
+
+
+def load_compiled_kb(kb_dicts_dir):
+    """Memory-map the compiled artifact of the KB in given dir, e.g.
+    'data/kbs/dicts/medic/', generated by generate_dicts.py.
+
+    :return: compiled_kb, or None if the KB was not compiled
+    :rtype: CompiledKB object
+    """
+
+    artifact_dir = os.path.join(kb_dicts_dir, 'compiled')
+
+    if not os.path.exists(os.path.join(artifact_dir, 'ids.npy')):
+        return None
+
+    compiled_kb = CompiledKB()
+    compiled_kb.load(artifact_dir)
+
+    return compiled_kb
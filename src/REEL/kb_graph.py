@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""This module exposes the graph of a KB stored in the compiled KB artifact
+(see kb_artifact.CompiledKB) to the code that expects a networkx graph. The
+nodes have integer ids and the children and parents of every node are
+memory-mapped CSR arrays, so the degrees are read from the arrays and the
+ancestors and descendants are found by traversing the arrays level by
+level, without building a networkx graph."""
+
+import os
+import networkx as nx
+import numpy as np
+from src.REEL.kb_artifact import load_compiled_kb
+from src.REEL.overlay import (apply_graph_overlay, get_graph_overlay_filepath,
+    read_graph_overlay)
+
+
+class NodeView:
+    """Membership, iteration and size of the nodes of a compiled KB graph, as
+    in Networkx graph.nodes."""
+
+    def __init__(self, kb_graph):
+
+        self.kb_graph = kb_graph
+
+    def __call__(self):
+
+        return self
+
+    def __contains__(self, kb_id):
+
+        return self.kb_graph.has_node(kb_id)
+
+    def __iter__(self):
+
+        return iter(self.kb_graph.get_kb_ids(self.kb_graph.get_graph_nodes()))
+
+    def __len__(self):
+
+        return self.kb_graph.number_of_nodes()
+
+
+class EdgeView:
+    """Membership, iteration and size of the edges of a compiled KB graph, as
+    in Networkx graph.edges."""
+
+    def __init__(self, kb_graph):
+
+        self.kb_graph = kb_graph
+
+    def __call__(self):
+
+        return self
+
+    def __contains__(self, edge):
+
+        return self.kb_graph.has_edge(edge[0], edge[1])
+
+    def __iter__(self):
+
+        kb_graph = self.kb_graph
+        kb_ids = kb_graph.get_kb_ids(np.arange(len(kb_graph)))
+        sources = np.repeat(np.arange(len(kb_graph)), kb_graph.out_degrees)
+
+        for source, target in zip(
+                sources.tolist(), kb_graph.children.tolist()):
+            yield kb_ids[source], kb_ids[target]
+
+    def __len__(self):
+
+        return self.kb_graph.number_of_edges()
+
+
+class NetworkxView:
+    """Expose the graph of a compiled KB with the interface of a Networkx
+    DiGraph. Nodes,
+    edges, degrees, neighbours, ancestors and descendants are answered with
+    the arrays, and any other attribute (e.g. used by the networkx
+    algorithms) is taken from a networkx graph built on first use."""
+
+    def __init__(self, kb_graph):
+        """
+        :param kb_graph: the compiled KB with the graph arrays
+        :type kb_graph: CompiledKB object
+        """
+
+        self.kb_graph = kb_graph
+        self.nodes = NodeView(kb_graph)
+        self.edges = EdgeView(kb_graph)
+        self._nx_graph = None
+
+    def __getattr__(self, name):
+
+        if name.startswith('__') or name in ('kb_graph', '_nx_graph'):
+            raise AttributeError(name)
+
+        if self._nx_graph is None:
+            self._nx_graph = self.kb_graph.to_networkx()
+
+        return getattr(self._nx_graph, name)
+
+    def __contains__(self, kb_id):
+
+        return self.kb_graph.has_node(kb_id)
+
+    def __iter__(self):
+
+        return iter(self.nodes)
+
+    def __len__(self):
+
+        return self.kb_graph.number_of_nodes()
+
+    def is_directed(self):
+
+        return True
+
+    def is_multigraph(self):
+
+        return False
+
+    def number_of_nodes(self):
+
+        return self.kb_graph.number_of_nodes()
+
+    def number_of_edges(self):
+
+        return self.kb_graph.number_of_edges()
+
+    def has_node(self, kb_id):
+
+        return self.kb_graph.has_node(kb_id)
+
+    def has_edge(self, source, target):
+
+        return self.kb_graph.has_edge(source, target)
+
+    def in_degree(self, kb_id=None):
+        """Indegree of given KB concept, or (kb_id, indegree) pairs of all
+        nodes if no KB concept is given."""
+
+        if kb_id is None:
+            return zip(self.nodes, self.kb_graph.in_degrees[
+                self.kb_graph.get_graph_nodes()].tolist())
+
+        return self.kb_graph.in_degree(kb_id)
+
+    def out_degree(self, kb_id=None):
+        """Outdegree of given KB concept, or (kb_id, outdegree) pairs of all
+        nodes if no KB concept is given."""
+
+        if kb_id is None:
+            return zip(self.nodes, self.kb_graph.out_degrees[
+                self.kb_graph.get_graph_nodes()].tolist())
+
+        return self.kb_graph.out_degree(kb_id)
+
+    def _get_node(self, kb_id):
+
+        if not self.kb_graph.has_node(kb_id):
+            raise nx.NetworkXError(
+                'The node {} is not in the graph.'.format(kb_id))
+
+        return self.kb_graph.get_concept(kb_id)
+
+    def predecessors(self, kb_id):
+
+        return iter(self.kb_graph.get_kb_ids(
+            self.kb_graph.get_parents(self._get_node(kb_id))))
+
+    def successors(self, kb_id):
+
+        return iter(self.kb_graph.get_kb_ids(
+            self.kb_graph.get_children(self._get_node(kb_id))))
+
+    def ancestors(self, kb_id):
+
+        return set(self.kb_graph.get_kb_ids(
+            self.kb_graph.get_ancestors(self._get_node(kb_id))))
+
+    def descendants(self, kb_id):
+
+        return set(self.kb_graph.get_kb_ids(
+            self.kb_graph.get_descendants(self._get_node(kb_id))))
+
+    def count_descendants(self, kb_id):
+
+        return self.kb_graph.count_descendants(self._get_node(kb_id))
+
+
+def get_ancestors(kb_graph, kb_id):
+    """Get the ancestors of given KB concept with the arrays of a
+    NetworkxView or with networkx otherwise."""
+
+    if isinstance(kb_graph, NetworkxView):
+        return kb_graph.ancestors(kb_id)
+
+    return nx.ancestors(kb_graph, kb_id)
+
+
+def get_descendants(kb_graph, kb_id):
+    """Get the descendants of given KB concept with the arrays of a
+    NetworkxView or with networkx otherwise."""
+
+    if isinstance(kb_graph, NetworkxView):
+        return kb_graph.descendants(kb_id)
+
+    return nx.descendants(kb_graph, kb_id)
+
+
+def count_descendants(kb_graph, kb_id):
+    """Number of descendants of given KB concept, raises NetworkXError if it
+    is not in the graph."""
+
+    if isinstance(kb_graph, NetworkxView):
+        return kb_graph.count_descendants(kb_id)
+
+    return len(nx.descendants(kb_graph, kb_id))
+
+
+def load_kb_graph(kb_dicts_dir):
+    """Memory-map the graph arrays of the compiled KB in given dir, e.g.
+    'data/kbs/dicts/medic/', generated by generate_dicts.py. The graph of a
+    KB stored as an overlay over another KB (e.g. 'data/kbs/dicts/medic_OMIM/')
+    is built from the graph of the base KB and the overlay.
+
+    :return: kb_graph
+    :rtype: NetworkxView or Networkx DiGraph object
+    """
+
+    compiled_kb = load_compiled_kb(kb_dicts_dir)
+
+    if compiled_kb is not None:
+        return NetworkxView(compiled_kb)
+
+    overlay = read_graph_overlay(kb_dicts_dir)
+
+    if overlay is None:
+        raise FileNotFoundError(
+            'The KB in {} was not compiled: run generate_dicts.py (see '
+            'prepare.sh)'.format(kb_dicts_dir))
+
+    return apply_graph_overlay(load_kb_graph(overlay['base']), overlay)
+
+
+def get_graph_filepath(kb_dicts_dir):
+    """Get the path of the file the graph of the KB in given dir is loaded
+    from: the children array of the compiled KB or the graph overlay."""
+
+    if os.path.exists(os.path.join(kb_dicts_dir, 'compiled', 'ids.npy')):
+        return os.path.join(kb_dicts_dir, 'compiled', 'children.npy')
+
+    return get_graph_overlay_filepath(kb_dicts_dir)
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""This module represents the surface forms of a KB (concept names and
+synonyms) as a single deduplicated lexicon that is scored once per entity
+mention during candidate retrieval. The lexicon is stored as packed string
+tables and arrays (as in the compiled KB artifact, see kb_artifact.py) that
+are memory-mapped when loaded, so the surface forms are only decoded when
+they are scored or returned."""
+
+import argparse
+import os
+import sys
+import numpy as np
+sys.path.append('./')
+from rapidfuzz import fuzz, process
+from src.REEL.deletion_index import load_deletion_index
+from src.REEL.kb_artifact import CompiledDict, PackedStrings, get_hash_index
+from src.REEL.ngram_index import get_sorted_form, load_ngram_index
+from src.REEL.overlay import get_dict_sources, load_dict
+from src.REEL.trie import FormTrie, pack_strings
+from src.REEL.utils import get_fingerprint
+
+
+class Lexicon:
+    """Represent the distinct surface forms of a KB, built from name_to_id and
+    synonym_to_id. Each surface form is stored once together with its
+    token-sorted form and the KB id of the concept it refers to (the concept
+    with that name, if it is a name). The rank of each surface form in
+    name_to_id and in synonym_to_id (-1 if it is not in the dict) is also
+    kept, so that the matches retrieved for a given entity are the same (and
+    in the same order) as when name_to_id and synonym_to_id were scanned
+    separately. The forms are looked up by their hash, and the trie resolves
+    the exact matches up to normalization. The version is a fingerprint of
+    the dict files the lexicon was loaded from."""
+
+    array_names = [
+        'form_buffer', 'form_offsets', 'sorted_buffer', 'sorted_offsets',
+        'id_buffer', 'id_offsets', 'form_hashes', 'form_order', 'name_rank',
+        'synonym_rank']
+
+    def __init__(self):
+
+        for array_name in self.array_names:
+            setattr(self, array_name, None)
+
+        self.forms = None
+        self.sorted_forms = None
+        self.form_to_id = None
+        self.trie = None
+        self.all_indices = None
+        self.active_indices = None
+        self.active_forms = None
+        self.ngram_index = None
+        self.deletion_index = None
+        self.version = None
+        self.fast_path = {
+            'exact': 0, 'normalized': 0, 'suffix': 0, 'prefix': 0}
+
+    def build(self, name_to_id, synonym_to_id):
+        """Build the lexicon of the given KB dicts.
+
+        :param name_to_id: KB names and respective KB ids
+        :type name_to_id: dict
+        :param synonym_to_id: KB synonyms and respective KB ids
+        :type synonym_to_id: dict
+        """
+
+        forms = []
+        kb_ids = []
+        name_rank = []
+        synonym_rank = []
+        form_to_index = {}
+
+        # The dicts are read sequentially, as they may be views of the
+        # compiled KB
+        for rank, (name, kb_id) in enumerate(name_to_id.items()):
+            form_to_index[name] = len(forms)
+            forms.append(name)
+            kb_ids.append(kb_id)
+            name_rank.append(rank)
+            synonym_rank.append(-1)
+
+        for rank, (synonym, kb_id) in enumerate(synonym_to_id.items()):
+
+            if synonym in form_to_index:
+                # The synonym is also a name of some concept
+                synonym_rank[form_to_index[synonym]] = rank
+
+            else:
+                form_to_index[synonym] = len(forms)
+                forms.append(synonym)
+                kb_ids.append(kb_id)
+                name_rank.append(-1)
+                synonym_rank.append(rank)
+
+        self.form_buffer, self.form_offsets = pack_strings(forms)
+        self.sorted_buffer, self.sorted_offsets = pack_strings(
+            [get_sorted_form(form) for form in forms])
+        self.id_buffer, self.id_offsets = pack_strings(kb_ids)
+        self.form_hashes, self.form_order = get_hash_index(forms)
+        self.name_rank = np.array(name_rank, dtype=np.int64)
+        self.synonym_rank = np.array(synonym_rank, dtype=np.int64)
+
+        # The trie gives precedence to the first form of the lexicon with
+        # each key, i.e. the form that fuzzy retrieval would rank first
+        self.trie = FormTrie()
+        self.trie.build(forms)
+        self._set_views()
+
+    def save(self, dirpath):
+        """Output the arrays of the lexicon and of its trie into .npy files in
+        given dir."""
+
+        if not os.path.exists(dirpath):
+            os.mkdir(dirpath)
+
+        for array_name in self.array_names:
+            np.save(
+                os.path.join(dirpath, array_name + '.npy'),
+                getattr(self, array_name))
+
+        self.trie.save(dirpath)
+
+    def load(self, dirpath):
+        """Memory-map the arrays of the lexicon and of its trie stored in
+        given dir."""
+
+        for array_name in self.array_names:
+            setattr(self, array_name, np.load(
+                os.path.join(dirpath, array_name + '.npy'), mmap_mode='r'))
+
+        self.trie = FormTrie()
+        self.trie.load(dirpath)
+        self._set_views()
+
+    def _set_views(self):
+        """Set the read-only views of the forms over the arrays."""
+
+        self.forms = PackedStrings(self.form_buffer, self.form_offsets)
+        self.sorted_forms = PackedStrings(
+            self.sorted_buffer, self.sorted_offsets)
+        self.form_to_id = CompiledDict(
+            self.forms, self.form_hashes, self.form_order,
+            PackedStrings(self.id_buffer, self.id_offsets))
+        self.all_indices = np.arange(len(self.forms))
+        self.active_indices = self.all_indices
+        self.active_forms = None
+
+    def __contains__(self, form):
+
+        return form in self.form_to_id
+
+    def __len__(self):
+
+        return len(self.forms)
+
+    def get_kb_id(self, form):
+        """Get the KB id associated with given surface form. If the form is
+        both a name and a synonym, the id of the concept with that name is
+        returned.
+
+        :param form: concept name or synonym
+        :type form: str
+        :return: kb_id, or 'NIL' if the form is not in the lexicon
+        :rtype: str
+        """
+
+        return self.form_to_id.get(form, 'NIL')
+
+    def find_exact(
+            self, entity_text, count=False, score_cutoff=None, prefix=False):
+        """Look up given entity text in the lexicon without fuzzy matching:
+        first the text itself, then its normalized form, its normalized form
+        without inflectional suffixes (see trie.get_suffix_variants) and
+        finally, if required, the single normalized form extending it by
+        whole words (see FormTrie.lookup_prefix). Exact matches have score
+        100, and the other matches are scored with token_sort_ratio, like the
+        forms retrieved by extract.
+
+        :param entity_text: the surface form of given entity
+        :type entity_text: str
+        :param count: whether to update the fast path counters, defaults to
+            False
+        :type count: bool
+        :param score_cutoff: matches with a score (0-100) not above this
+            value are rejected, as they would be excluded from the candidates
+            list (the entity is then searched with fuzzy matching), defaults
+            to None
+        :type score_cutoff: float
+        :param prefix: whether to look up the forms extending the text, e.g.
+            for abbreviation long forms, which are sometimes truncated,
+            defaults to False
+        :type prefix: bool
+        :return: top_concept with format (form, score, rank), or None if
+            there is no exact match
+        :rtype: tuple
+        """
+
+        kind = 'exact'
+        index = self.form_to_id.get_position(entity_text)
+
+        if index < 0:
+            index = self.trie.lookup(entity_text)
+            kind = 'normalized'
+
+            if index is None:
+                index = self.trie.lookup_variants(entity_text)
+                kind = 'suffix'
+
+            if index is None and prefix:
+                index = self.trie.lookup_prefix(entity_text)
+                kind = 'prefix'
+
+            if index is None:
+                return None
+
+        score = 100
+
+        if kind != 'exact':
+            score = fuzz.ratio(
+                get_sorted_form(entity_text), self.sorted_forms[index])
+
+        if score_cutoff is not None and score <= score_cutoff:
+            return None
+
+        if count:
+            self.fast_path[kind] += 1
+
+        rank = self.name_rank[index]
+
+        if rank < 0:
+            rank = self.synonym_rank[index]
+
+        return (self.forms[index], score, int(rank))
+
+    def restrict(self, indices):
+        """Restrict the scans over the whole lexicon (extract without index
+        and batch_extract) to the forms with given indexes, e.g. the
+        sub-lexicon of a corpus (see sub_lexicon.get_sub_lexicon).
+
+        :param indices: indexes of the forms in ascending order
+        :type indices: Numpy array
+        """
+
+        self.active_indices = indices
+        self.active_forms = None
+
+    def load_ngram_index(self, index_filepath, shortlist_size=500):
+        """Load (or build) the character n-gram index over the surface forms
+        that shortlists the forms scored for each entity. The index is
+        rebuilt if it was built for another version of the lexicon.
+
+        :param index_filepath: path of the .npz file storing the index
+        :type index_filepath: str
+        """
+
+        self.ngram_index = load_ngram_index(
+            index_filepath, self.forms, self.version,
+            shortlist_size=shortlist_size)
+
+    def load_deletion_index(self, index_filepath, sources, max_distance=2):
+        """Load (or build) the symmetric deletion dictionary over the surface
+        forms that retrieves the forms within given edit distance of each
+        entity.
+
+        :param index_filepath: path of the .npz file storing the dictionary
+        :type index_filepath: str
+        :param sources: paths of the KB dict files the lexicon was built from
+        :type sources: list
+        """
+
+        self.deletion_index = load_deletion_index(
+            index_filepath, self.sorted_forms, sources,
+            max_distance=max_distance)
+
+    def _select(self, indices, scores, ranks, query, limit, score_cutoff):
+        """Select the best scored forms among the forms with a rank >= 0,
+        with ties broken by rank as in rapidfuzz.process.extract."""
+
+        form_ranks = ranks[indices]
+        keep = form_ranks >= 0
+
+        if score_cutoff:
+            keep &= scores >= score_cutoff
+
+        indices = indices[keep]
+        scores = scores[keep]
+        form_ranks = form_ranks[keep]
+        limit = min(limit, len(indices))
+
+        if limit == 0:
+            return []
+
+        # Keep every form tied with the last one of the top-limit forms
+        threshold = np.partition(scores, len(scores) - limit)[
+            len(scores) - limit]
+        top = np.flatnonzero(scores >= threshold)
+        top = top[np.lexsort((form_ranks[top], -scores[top]))][:limit]
+
+        # The score matrix has float32 precision, so the scores of the
+        # selected forms are recalculated
+        return [
+            (self.forms[indices[i]],
+            fuzz.ratio(query, self.sorted_forms[indices[i]]),
+            int(form_ranks[i])) for i in top]
+
+    def _get_choices(self, indices):
+        """Get the token-sorted forms with given indices, decoded from the
+        packed forms. The forms scanned by every entity (the active indices)
+        are only decoded by the first scan and kept for the next ones."""
+
+        if indices is not self.active_indices:
+            return [self.sorted_forms[i] for i in indices.tolist()]
+
+        if self.active_forms is None:
+
+            if indices is self.all_indices:
+                self.active_forms = list(self.sorted_forms)
+
+            else:
+                self.active_forms = [
+                    self.sorted_forms[i] for i in indices.tolist()]
+
+        return self.active_forms
+
+    def _extract_rows(
+            self, queries, indices, limit, score_cutoff, workers):
+        """Score the sorted queries against the forms with given indices and
+        select the best name and synonym matches for each query."""
+
+        choices = self._get_choices(indices)
+        scores = process.cdist(
+            queries, choices, scorer=fuzz.ratio, score_cutoff=score_cutoff,
+            workers=workers)
+
+        matches = []
+
+        for query, row in zip(queries, scores):
+            name_matches = self._select(
+                indices, row, self.name_rank, query, limit, score_cutoff)
+            synonym_matches = self._select(
+                indices, row, self.synonym_rank, query, limit, score_cutoff)
+            matches.append((name_matches, synonym_matches))
+
+        return matches
+
+    def extract(self, entity_text, limit=10, score_cutoff=None, indices=None):
+        """Retrieve the names and the synonyms most similar to given entity
+        text according to token_sort_ratio. Each surface form is scored only
+        once, comparing its precomputed token-sorted form with the
+        token-sorted entity text. If the lexicon has an n-gram index only the
+        shortlisted forms are scored, and if it has a deletion dictionary only
+        the forms within its edit distance of the entity are scored.
+
+        :param entity_text: the surface form of given entity
+        :type entity_text: str
+        :param limit: maximum number of name matches and of synonym matches,
+            defaults to 10
+        :type limit: int
+        :param score_cutoff: forms with a score below this value (0-100) are
+            rejected, defaults to None
+        :type score_cutoff: float
+        :param indices: indexes (in ascending order) of the only forms to
+            score, overriding the indexes of the lexicon, defaults to None
+        :type indices: Numpy array
+        :return: name_matches and synonym_matches, both with the format
+            of rapidfuzz.process.extract applied over the keys of name_to_id
+            and synonym_to_id, i.e. [(form, score, rank)]
+        :rtype: tuple (list, list)
+        """
+
+        if indices is None and self.ngram_index is not None:
+            indices = self.ngram_index.shortlist(entity_text)
+
+        elif indices is None and self.deletion_index is not None:
+            indices = self.deletion_index.shortlist(entity_text)
+
+        elif indices is None:
+            indices = self.active_indices
+
+        return self._extract_rows(
+            [get_sorted_form(entity_text)], indices, limit, score_cutoff, 1)[0]
+
+    def batch_extract(
+            self, entities_text, limit=10, score_cutoff=None, workers=1,
+            chunk_size=None):
+        """Retrieve the names and the synonyms most similar to each one of the
+        given entity texts. All the entity texts are scored against all the
+        forms with rapidfuzz.process.cdist, which releases the GIL and
+        distributes the rows of the score matrix across threads. The output
+        is the same as calling extract for each entity text without n-gram
+        index.
+
+        :param entities_text: surface forms of the entities
+        :type entities_text: list
+        :param workers: number of threads used to compute the score matrix,
+            -1 uses all available cores, defaults to 1
+        :type workers: int
+        :param chunk_size: number of entities scored in each call to cdist,
+            defaults to None (chunks with around 2^25 scores each)
+        :type chunk_size: int
+        :return: matches, with a tuple (name_matches, synonym_matches) for
+            each entity text
+        :rtype: list
+        """
+
+        queries = [get_sorted_form(text) for text in entities_text]
+
+        if chunk_size is None:
+            chunk_size = max(1, 2**25 // max(len(self.active_indices), 1))
+
+        matches = []
+
+        for start in range(0, len(queries), chunk_size):
+            matches.extend(self._extract_rows(
+                queries[start:start + chunk_size], self.active_indices, limit,
+                score_cutoff, workers))
+
+        return matches
+
+
+def get_lexicon_sources(kb_dicts_dir, dataset):
+    """Get the files the lexicon of the KB in given dir and of the given
+    dataset is built from, including the base dicts of overlays.
+
+    :param kb_dicts_dir: dir with the KB dicts, e.g. 'data/kbs/dicts/medic/'
+    :type kb_dicts_dir: str
+    :param dataset: the dataset whose synonym_to_id dict is loaded
+    :type dataset: str
+    :return: names_filepath, synonyms_filepath and sources
+    :rtype: tuple (str, str, list)
+    """
+
+    names_filepath = kb_dicts_dir + 'name_to_id.json'
+    synonyms_filepath = kb_dicts_dir + 'synonym_to_id_{}.json'.format(
+        dataset)
+    sources = get_dict_sources(names_filepath) + \
+        get_dict_sources(synonyms_filepath)
+
+    return names_filepath, synonyms_filepath, sources
+
+
+def build_lexicon(kb_dicts_dir, dataset):
+    """Build the lexicon of the KB in given dir, including the synonyms of the
+    dict augmented with the annotations of the given dataset (stored as an
+    overlay over the synonyms of the KB, see overlay.py), and output it into
+    the dir 'lexicon_<dataset>/'. It is a build-time artifact of the dataset
+    (see build.py), as it depends on the augmented synonyms.
+
+    :param kb_dicts_dir: dir with the KB dicts, e.g. 'data/kbs/dicts/medic/'
+    :type kb_dicts_dir: str
+    :param dataset: the dataset whose synonym_to_id dict is loaded
+    :type dataset: str
+    :return: lexicon
+    :rtype: Lexicon object
+    """
+
+    names_filepath, synonyms_filepath, sources = get_lexicon_sources(
+        kb_dicts_dir, dataset)
+    lexicon_dir = kb_dicts_dir + 'lexicon_{}/'.format(dataset)
+    print('Building the lexicon of {} in {}...'.format(dataset, lexicon_dir))
+
+    lexicon = Lexicon()
+    lexicon.build(load_dict(names_filepath), load_dict(synonyms_filepath))
+    lexicon.save(lexicon_dir)
+    lexicon.version = get_fingerprint(sources)
+
+    return lexicon
+
+
+def load_lexicon(
+        kb_dicts_dir, dataset, ngram_index=False, deletion_index=False):
+    """Memory-map the lexicon of the KB in given dir and of the given dataset,
+    stored in the dir 'lexicon_<dataset>/' (see build_lexicon). The lexicon
+    is built if it is not available or outdated.
+
+    :param kb_dicts_dir: dir with the KB dicts, e.g. 'data/kbs/dicts/medic/'
+    :type kb_dicts_dir: str
+    :param dataset: the dataset whose synonym_to_id dict is loaded
+    :type dataset: str
+    :param ngram_index: whether to load (or build, if it is not available)
+        the n-gram index over the lexicon, defaults to False
+    :type ngram_index: bool
+    :param deletion_index: whether to load (or build, if it is not available)
+        the symmetric deletion dictionary over the lexicon, defaults to False
+    :type deletion_index: bool
+    :return: lexicon
+    :rtype: Lexicon object
+    """
+
+    sources = get_lexicon_sources(kb_dicts_dir, dataset)[2]
+    lexicon_dir = kb_dicts_dir + 'lexicon_{}/'.format(dataset)
+    lexicon_files = [os.path.join(lexicon_dir, array_name + '.npy')
+        for array_name in Lexicon.array_names + FormTrie.array_names]
+
+    if all(os.path.exists(lexicon_file) for lexicon_file in lexicon_files) \
+            and all(os.path.getmtime(lexicon_file) >= os.path.getmtime(source)
+                for lexicon_file in lexicon_files for source in sources):
+        lexicon = Lexicon()
+        lexicon.load(lexicon_dir)
+        lexicon.version = get_fingerprint(sources)
+
+    else:
+        lexicon = build_lexicon(kb_dicts_dir, dataset)
+
+    if ngram_index:
+        lexicon.load_ngram_index(
+            kb_dicts_dir + 'lexicon_{}_ngrams.npz'.format(dataset))
+
+    if deletion_index:
+        lexicon.load_deletion_index(
+            kb_dicts_dir + 'lexicon_{}_deletions.npz'.format(dataset),
+            sources)
+
+    return lexicon
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-kb', type=str, required=True,
+        choices=['medic', 'medic_OMIM', 'ctd_chem', 'mesh_dis', 'mesh_chem'])
+    parser.add_argument('-dataset', type=str, required=True,
+        choices=['bc5cdr_dis', 'bc5cdr_chem', 'ncbi_disease', 'biored_dis',
+        'biored_chem'])
+    args = parser.parse_args()
+
+    lexicon = build_lexicon(
+        'data/kbs/dicts/{}/'.format(args.kb), args.dataset)
+    print('Lexicon with {} surface forms and {} keys'.format(
+        len(lexicon), len(lexicon.trie)))
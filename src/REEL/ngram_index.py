@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""This module builds a character n-gram inverted index over the surface forms
+(concept names and synonyms) of a KB. The index shortlists the surface
+forms sharing most n-grams with a given entity mention, so that the exact
+token_sort_ratio scoring is only applied to a few hundred strings instead of
+to every surface form of the KB."""
+
+import argparse
+import os
+import random
+import sys
+import numpy as np
+from rapidfuzz.utils import default_process
+sys.path.append('./')
+
+
+def get_sorted_form(text):
+    """Apply the same normalization that token_sort_ratio applies to a string
+    when called through rapidfuzz.process: lowercase, replace
+    non-alphanumeric characters by whitespace and sort the tokens.
+
+    :param text: the string to normalize
+    :type text: str
+    :return: sorted_form
+    :rtype: str
+
+    >>> get_sorted_form("Sodium-Chloride")
+    'chloride sodium'
+    """
+
+    return " ".join(sorted(default_process(text).split()))
+
+
+def get_ngrams(text, n=3):
+    """Get the set of character n-grams of the sorted form of given string,
+    padded with whitespace so that the first and last characters are also
+    represented.
+
+    :param text: the string to split into n-grams
+    :type text: str
+    :param n: size of the n-grams, defaults to 3
+    :type n: int
+    :return: ngrams
+    :rtype: set
+    """
+
+    sorted_form = get_sorted_form(text)
+
+    if sorted_form == '':
+        return set()
+
+    padded = ' ' + sorted_form + ' '
+
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+class NgramIndex:
+    """Represent a character n-gram inverted index over a list of strings
+    (the choices). The postings lists are stored in CSR format: the choices
+    containing the n-gram in row r are postings[offsets[r]:offsets[r + 1]]."""
+
+    def __init__(self, n=3, shortlist_size=300):
+
+        self.n = n
+        self.shortlist_size = shortlist_size
+        self.choices = None
+        self.grams = None
+        self.gram_to_row = None
+        self.offsets = None
+        self.postings = None
+        self.sizes = None
+        self.version = None
+
+    def build(self, choices, version):
+        """Build the inverted index for given choices.
+
+        :param choices: strings to index, e.g. the surface forms of a lexicon
+        :type choices: sequence
+        :param version: version of the choices, e.g. of the lexicon (see
+            lexicon.load_lexicon)
+        :type version: str
+        """
+
+        self.choices = choices
+        self.version = version
+        postings = {}
+        sizes = []
+
+        for i, choice in enumerate(self.choices):
+            choice_grams = get_ngrams(choice, n=self.n)
+            sizes.append(len(choice_grams))
+
+            for gram in choice_grams:
+
+                if gram in postings:
+                    postings[gram].append(i)
+
+                else:
+                    postings[gram] = [i]
+
+        self.grams = sorted(postings.keys())
+        self.gram_to_row = {gram: row for row, gram in enumerate(self.grams)}
+
+        lengths = [len(postings[gram]) for gram in self.grams]
+        self.offsets = np.zeros(len(self.grams) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+
+        self.postings = np.zeros(self.offsets[-1], dtype=np.int32)
+
+        for row, gram in enumerate(self.grams):
+            self.postings[self.offsets[row]:self.offsets[row + 1]] = \
+                postings[gram]
+
+        self.sizes = np.array(sizes, dtype=np.int32)
+
+    def save(self, filepath):
+        """Output the index arrays into a .npz file."""
+
+        np.savez(
+            filepath, grams=np.array(self.grams, dtype=str),
+            offsets=self.offsets, postings=self.postings, sizes=self.sizes,
+            n=np.array([self.n]), version=np.array([self.version]))
+
+    def load(self, filepath, choices, version):
+        """Load the index arrays from a .npz file previously generated for the
+        given choices.
+
+        :raises ValueError: if the stored index was built for another version
+            of the choices or with a different n-gram size
+        """
+
+        self.choices = choices
+        self.version = version
+
+        with np.load(filepath) as index_file:
+
+            if int(index_file['n'][0]) != self.n \
+                    or 'version' not in index_file.files \
+                    or index_file['version'].tolist() != [version]:
+                raise ValueError('Index does not match the given choices!')
+
+            self.grams = index_file['grams'].tolist()
+            self.offsets = index_file['offsets']
+            self.postings = index_file['postings']
+            self.sizes = index_file['sizes']
+
+        self.gram_to_row = {gram: row for row, gram in enumerate(self.grams)}
+
+    def shortlist(self, entity_text):
+        """Retrieve the indexes of the choices sharing most n-grams with given
+        entity text. Choices are ranked by the Dice coefficient between their
+        n-gram sets and the n-gram set of the entity.
+
+        :param entity_text: the surface form of given entity
+        :type entity_text: str
+        :return: candidates, the indexes of the shortlisted choices in
+            ascending order
+        :rtype: Numpy array
+        """
+
+        entity_grams = get_ngrams(entity_text, n=self.n)
+        rows = [self.gram_to_row[gram] for gram in entity_grams
+            if gram in self.gram_to_row]
+
+        if rows == []:
+            return np.zeros(0, dtype=np.int64)
+
+        hits = np.concatenate([
+            self.postings[self.offsets[row]:self.offsets[row + 1]]
+            for row in rows])
+        counts = np.bincount(hits, minlength=len(self.choices))
+        candidates = np.flatnonzero(counts)
+
+        if len(candidates) > self.shortlist_size:
+            dice = counts[candidates] / \
+                (self.sizes[candidates] + len(entity_grams))
+            top = np.argpartition(-dice, self.shortlist_size - 1)
+            candidates = np.sort(candidates[top[:self.shortlist_size]])
+
+        return candidates
+
+
+def load_ngram_index(
+        index_filepath, choices, version, n=3, shortlist_size=300):
+    """Load the n-gram index stored in given file, if it is available and was
+    built for the given version of the choices, or build it and output it to
+    that file otherwise.
+
+    :param index_filepath: path of the .npz file storing the index
+    :type index_filepath: str
+    :param choices: the strings to index
+    :type choices: sequence
+    :param version: version of the choices, e.g. the fingerprint of the
+        files the lexicon was loaded from (see lexicon.load_lexicon)
+    :type version: str
+    :return: ngram_index
+    :rtype: NgramIndex object
+    """
+
+    ngram_index = NgramIndex(n=n, shortlist_size=shortlist_size)
+
+    if os.path.exists(index_filepath):
+
+        try:
+            ngram_index.load(index_filepath, choices, version)
+
+            return ngram_index
+
+        except ValueError:
+            pass
+
+    ngram_index.build(choices, version)
+    ngram_index.save(index_filepath)
+
+    return ngram_index
+
+
+def evaluate_recall(lexicon, mentions, limit=10, min_score=80):
+    """Compare the matches retrieved from a lexicon with its n-gram index 
+    against the matches retrieved with an exhaustive scan over the lexicon.
+
+    :param lexicon: the lexicon, with a loaded n-gram index
+    :type lexicon: Lexicon object
+    :param mentions: entity mentions to retrieve matches for
+    :type mentions: list
+    :param limit: number of matches retrieved per mention, defaults to 10
+    :type limit: int
+    :param min_score: only the exhaustive matches with at least this score are
+        considered when calculating recall, since the others are excluded
+        from the candidates lists anyway, defaults to 80
+    :type min_score: float
+    :return: recall (fraction of exhaustive matches above min_score that were
+        also retrieved with the index), top_1_agreement (fraction of mentions
+        with the same best match) and list_agreement (fraction of mentions
+        with the exact same lists of matches)
+    :rtype: tuple (float, float, float)
+    """
+
+    ngram_index = lexicon.ngram_index
+    found = 0
+    total = 0
+    top_1_agreement = 0
+    list_agreement = 0
+
+    for mention in mentions:
+        lexicon.ngram_index = None
+        exhaustive = lexicon.extract(mention, limit=limit)
+        lexicon.ngram_index = ngram_index
+        indexed = lexicon.extract(mention, limit=limit)
+
+        exhaustive = exhaustive[0] + exhaustive[1]
+        indexed = indexed[0] + indexed[1]
+
+        expected = {match[0] for match in exhaustive if match[1] >= min_score}
+        retrieved = {match[0] for match in indexed}
+        found += len(expected & retrieved)
+        total += len(expected)
+
+        if exhaustive == [] or \
+                (indexed != [] and max(indexed, key=lambda m: m[1])[1] == 
+                max(exhaustive, key=lambda m: m[1])[1]):
+            top_1_agreement += 1
+
+        if indexed == exhaustive:
+            list_agreement += 1
+
+    recall = 1.0
+
+    if total > 0:
+        recall = found / total
+
+    num_mentions = max(len(mentions), 1)
+
+    return recall, top_1_agreement / num_mentions, list_agreement / num_mentions
+
+
+if __name__ == '__main__':
+    from src.REEL.lexicon import load_lexicon
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-kb', type=str, required=True)
+    parser.add_argument('-dataset', type=str, required=True)
+    parser.add_argument('--mentions', type=str, default=None,
+        help='File with one entity mention per line. If not given, a sample '
+        'of the KB surface forms is evaluated')
+    parser.add_argument('--sample', type=int, default=1000)
+    args = parser.parse_args()
+
+    lexicon = load_lexicon(
+        'data/kbs/dicts/{}/'.format(args.kb), args.dataset, ngram_index=True)
+
+    if args.mentions is not None:
+
+        with open(args.mentions, 'r') as mentions_file:
+            mentions = [line.strip('\n') for line in mentions_file
+                if line.strip('\n') != '']
+            mentions_file.close()
+
+    else:
+        random.seed(0)
+        mentions = random.sample(
+            lexicon.forms, min(args.sample, len(lexicon.forms)))
+
+    recall, top_1, same_list = evaluate_recall(lexicon, mentions)
+    print('recall={:.4f} top_1_agreement={:.4f} list_agreement={:.4f}'.format(
+        recall, top_1, same_list))
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""This module stores the KB dicts derived from other dicts (e.g. the
+synonyms augmented with the annotations of a dataset) as overlays: small
+files with only the entries that differ from a base dict and the positions
+of the new entries, stored as '<dict name>.overlay.json' next to where the
+full dict would be. The dicts of the KB are named after their JSON files
+(e.g. 'data/kbs/dicts/medic/synonym_to_id.json') but read from the compiled
+KB artifact. The overlays are resolved at lookup time in priority order (the
+last overlay first), and iterating the layered dict gives the keys in the
+same order as the full dict, so the ranks of the surface forms in the
+lexicon are the same. A KB extending another KB (MEDIC with the OMIM
+concepts) also stores its graph as an overlay: the nodes and edges added to
+(or removed from) the graph of the base KB, in 'graph.overlay.json'."""
+
+import json
+import os
+from collections.abc import Mapping
+import networkx as nx
+from src.REEL.kb_artifact import get_dict_arrays, load_compiled_kb
+
+# Dicts stored in the compiled KB artifact, see kb_artifact.CompiledKB
+compiled_getters = {
+    'name_to_id.json': 'get_name_to_id',
+    'synonym_to_id.json': 'get_synonym_to_id',
+    'id_to_name.json': 'get_id_to_name'}
+
+
+def get_overlay_filepath(dict_filepath):
+    """Get the path of the overlay file of given dict, e.g.
+    'data/kbs/dicts/medic/synonym_to_id_bc5cdr_dis.overlay.json'."""
+
+    return dict_filepath[:-len('.json')] + '.overlay.json'
+
+
+def build_overlay(base, merged):
+    """Get the entries of the merged dict that differ from the base dict.
+    The keys of the base dict that keep their relative order in the merged
+    dict only store their value if it changed, while the new keys and the
+    keys out of order store their position, i.e. the number of the base keys
+    (in order) that precede them.
+
+    :param base: e.g. synonym_to_id of the KB
+    :type base: dict
+    :param merged: e.g. synonym_to_id of the KB augmented with the
+        annotations of a dataset
+    :type merged: dict
+    :return: overlay with format {'values': {key: value}, 'entries':
+        [[position, key, value]], 'removed': [key]}
+    :rtype: dict
+    """
+
+    # The base dict is read sequentially, as it may be a view of the
+    # compiled KB
+    base_items = list(base.items())
+    removed = [key for key, value in base_items if key not in merged]
+    skipped = set(removed)
+    values = {}
+    entries = []
+    position = 0
+
+    for key in merged:
+
+        while position < len(base_items) and \
+                base_items[position][0] in skipped:
+            position += 1
+
+        if position < len(base_items) and base_items[position][0] == key:
+
+            if merged[key] != base_items[position][1]:
+                values[key] = merged[key]
+
+            position += 1
+
+        else:
+            # A new key or a base key moved to an earlier position
+            skipped.add(key)
+            entries.append([position, key, merged[key]])
+
+    return {'values': values, 'entries': entries, 'removed': removed}
+
+
+def apply_overlay_order(base_keys, overlay):
+    """Get the keys of the dict resulting from given overlay over a dict
+    with the given keys, in order."""
+
+    skipped = set(overlay['removed'])
+    skipped.update(entry[1] for entry in overlay['entries'])
+    entries = overlay['entries']
+    keys = []
+    i = 0
+
+    for position, key in enumerate(base_keys):
+
+        while i < len(entries) and entries[i][0] == position:
+            keys.append(entries[i][1])
+            i += 1
+
+        if key not in skipped:
+            keys.append(key)
+
+    keys.extend(entry[1] for entry in entries[i:])
+
+    return keys
+
+
+class LayeredDict(Mapping):
+    """Represent a base dict with overlays in increasing priority order,
+    read-only."""
+
+    def __init__(self, base, overlays):
+        """
+        :param base: the base dict
+        :type base: dict
+        :param overlays: the overlays over base (see build_overlay), each one
+            relative to the result of the previous overlays
+        :type overlays: list
+        """
+
+        self.base = base
+        self.overlays = overlays
+        self.layers = []
+
+        for overlay in overlays:
+            layer_values = dict(overlay['values'])
+            layer_values.update(
+                (entry[1], entry[2]) for entry in overlay['entries'])
+            self.layers.append((layer_values, set(overlay['removed'])))
+
+        self._keys = None
+
+    def __getitem__(self, key):
+
+        for layer_values, layer_removed in reversed(self.layers):
+
+            if key in layer_values:
+                return layer_values[key]
+
+            if key in layer_removed:
+                raise KeyError(key)
+
+        return self.base[key]
+
+    def __contains__(self, key):
+
+        for layer_values, layer_removed in reversed(self.layers):
+
+            if key in layer_values:
+                return True
+
+            if key in layer_removed:
+                return False
+
+        return key in self.base
+
+    def _get_keys(self):
+
+        if self._keys is None:
+            keys = list(self.base.keys())
+
+            for overlay in self.overlays:
+                keys = apply_overlay_order(keys, overlay)
+
+            self._keys = keys
+
+        return self._keys
+
+    def __iter__(self):
+
+        return iter(self._get_keys())
+
+    def __len__(self):
+
+        return len(self._get_keys())
+
+    def items(self):
+        """Iterate the (key, value) pairs in order. The keys without a value
+        in the overlays keep their relative order in the base dict, so their
+        values are read sequentially from the base dict instead of looking
+        up each key."""
+
+        base_items = iter(self.base.items())
+
+        for key in self._get_keys():
+
+            for layer_values, layer_removed in reversed(self.layers):
+
+                if key in layer_values:
+                    yield key, layer_values[key]
+                    break
+
+            else:
+                base_key, value = next(base_items)
+
+                while base_key != key:
+                    base_key, value = next(base_items)
+
+                yield key, value
+
+
+def write_overlay(dict_filepath, base_filepath, base, merged):
+    """Output the merged dict as an overlay over the given base dict, instead
+    of the full dict. A previous full dict in dict_filepath is removed.
+
+    :param dict_filepath: path of the full dict, e.g.
+        'data/kbs/dicts/medic/synonym_to_id_bc5cdr_dis.json'
+    :type dict_filepath: str
+    :param base_filepath: path of the base dict, e.g.
+        'data/kbs/dicts/medic/synonym_to_id.json'
+    :type base_filepath: str
+    :param base: the base dict
+    :type base: dict
+    :param merged: the merged dict
+    :type merged: dict
+    """
+
+    overlay = build_overlay(base, merged)
+    overlay['base'] = base_filepath
+
+    with open(get_overlay_filepath(dict_filepath), 'w') as out_file:
+        out_file.write(json.dumps(overlay, indent=4, ensure_ascii=True))
+        out_file.close()
+
+    if os.path.exists(dict_filepath):
+        os.remove(dict_filepath)
+
+
+def read_overlay(dict_filepath):
+
+    with open(get_overlay_filepath(dict_filepath), 'r') as overlay_file:
+        overlay = json.load(overlay_file)
+        overlay_file.close()
+
+    return overlay
+
+
+def build_graph_overlay(base_graph, kb_graph):
+    """Get the nodes and edges of the KB graph that differ from the base
+    graph, e.g. the OMIM concepts added to MEDIC.
+
+    :param base_graph: e.g. the graph of the compiled MEDIC KB
+    :type base_graph: NetworkxView or Networkx DiGraph object
+    :param kb_graph: e.g. the MEDIC graph including the OMIM concepts
+    :type kb_graph: Networkx DiGraph object
+    :return: overlay with format {'nodes': [kb_id], 'edges': [[source,
+        target]], 'removed_nodes': [kb_id], 'removed_edges': [[source,
+        target]]}
+    :rtype: dict
+    """
+
+    base_nodes = set(base_graph.nodes)
+    base_edges = set(base_graph.edges)
+
+    return {
+        'nodes': sorted(
+            node for node in kb_graph.nodes() if node not in base_nodes),
+        'edges': sorted(
+            list(edge) for edge in kb_graph.edges() if edge not in base_edges),
+        'removed_nodes': sorted(
+            node for node in base_nodes if not kb_graph.has_node(node)),
+        'removed_edges': sorted(
+            list(edge) for edge in base_edges if not kb_graph.has_edge(*edge))}
+
+
+def apply_graph_overlay(base_graph, overlay):
+    """Build the KB graph resulting from given overlay over the base graph.
+    The nodes and edges are added in ascending order, so they are iterated in
+    the same order as in a compiled KB graph.
+
+    :return: kb_graph
+    :rtype: Networkx DiGraph object
+    """
+
+    removed_nodes = set(overlay['removed_nodes'])
+    removed_edges = set(tuple(edge) for edge in overlay['removed_edges'])
+    nodes = [node for node in base_graph.nodes if node not in removed_nodes]
+    nodes.extend(overlay['nodes'])
+    edges = [edge for edge in base_graph.edges if edge not in removed_edges]
+    edges.extend(tuple(edge) for edge in overlay['edges'])
+
+    kb_graph = nx.DiGraph()
+    kb_graph.add_nodes_from(sorted(nodes))
+    kb_graph.add_edges_from(sorted(edges))
+
+    return kb_graph
+
+
+def get_graph_overlay_filepath(kb_dicts_dir):
+
+    return os.path.join(kb_dicts_dir, 'graph.overlay.json')
+
+
+def write_graph_overlay(kb_dicts_dir, base_dir, base_graph, kb_graph):
+    """Output the KB graph as an overlay over the graph of the KB in base_dir,
+    e.g. 'data/kbs/dicts/medic_OMIM/graph.overlay.json' over
+    'data/kbs/dicts/medic/'.
+
+    :param kb_dicts_dir: dir of the KB, e.g. 'data/kbs/dicts/medic_OMIM/'
+    :type kb_dicts_dir: str
+    :param base_dir: dir of the base KB, e.g. 'data/kbs/dicts/medic/'
+    :type base_dir: str
+    :param base_graph: the graph of the base KB
+    :type base_graph: NetworkxView or Networkx DiGraph object
+    :param kb_graph: the KB graph
+    :type kb_graph: Networkx DiGraph object
+    """
+
+    overlay = build_graph_overlay(base_graph, kb_graph)
+    overlay['base'] = base_dir
+
+    with open(get_graph_overlay_filepath(kb_dicts_dir), 'w') as out_file:
+        out_file.write(json.dumps(overlay, indent=4, ensure_ascii=True))
+        out_file.close()
+
+
+def read_graph_overlay(kb_dicts_dir):
+    """Read the graph overlay of the KB in given dir, or None if its graph is
+    not stored as an overlay."""
+
+    overlay_filepath = get_graph_overlay_filepath(kb_dicts_dir)
+
+    if not os.path.exists(overlay_filepath):
+        return None
+
+    with open(overlay_filepath, 'r') as overlay_file:
+        overlay = json.load(overlay_file)
+        overlay_file.close()
+
+    return overlay
+
+
+def load_dict(dict_filepath):
+    """Load a KB dict from the compiled KB artifact in the same dir, if it is
+    available, from its overlay file over a base dict or from the JSON file.
+
+    :param dict_filepath: path of the full dict, e.g.
+        'data/kbs/dicts/medic/synonym_to_id_bc5cdr_dis.json'
+    :type dict_filepath: str
+    :return: kb_dict
+    :rtype: dict or LayeredDict object
+    """
+
+    dirpath, filename = os.path.split(dict_filepath)
+
+    if filename in compiled_getters:
+        compiled_kb = load_compiled_kb(dirpath)
+
+        if compiled_kb is not None:
+            return getattr(compiled_kb, compiled_getters[filename])()
+
+    if os.path.exists(get_overlay_filepath(dict_filepath)):
+        overlay = read_overlay(dict_filepath)
+        base = load_dict(overlay['base'])
+
+        if isinstance(base, LayeredDict):
+            return LayeredDict(base.base, base.overlays + [overlay])
+
+        return LayeredDict(base, [overlay])
+
+    with open(dict_filepath, 'r') as dict_file:
+        kb_dict = json.load(dict_file)
+        dict_file.close()
+
+    return kb_dict
+
+
+def get_dict_sources(dict_filepath):
+    """Get the paths of the files the given dict is loaded from: its overlay
+    files and the arrays of the compiled KB (or the base JSON file), so that
+    the indexes built from the dict are rebuilt if any of them changes.
+
+    :return: sources
+    :rtype: list
+    """
+
+    sources = []
+
+    while True:
+        dirpath, filename = os.path.split(dict_filepath)
+
+        if filename in compiled_getters:
+            dict_arrays = get_dict_arrays(dirpath, filename[:-len('.json')])
+
+            if dict_arrays is not None:
+                return sources + dict_arrays
+
+        if not os.path.exists(get_overlay_filepath(dict_filepath)):
+            return sources + [dict_filepath]
+
+        sources.append(get_overlay_filepath(dict_filepath))
+        dict_filepath = read_overlay(dict_filepath)['base']
@@ -88,6 +88,17 @@ def process_results(run_id, entity_type, kb, ner_filepath, out_dir):
         data = results.readlines()
         results.close
 
+    # Documents resolved without the PPR step, or whose results were in the
+    # PPR results cache
+    for filename in ['resolved_scores', 'cached_scores']:
+        extra_filepath = 'data/REEL/'  + run_id + '/results/' + filename
+
+        if os.path.exists(extra_filepath):
+            
+            with open(extra_filepath, 'r') as extra_results:
+                data.extend(extra_results.readlines())
+                extra_results.close()
+
     linked_entities = {}
     doc_id = ''
     
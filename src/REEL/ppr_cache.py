@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""This module implements the persistent cache of PPR results. Each
+candidates file is reduced to a canonical form of its disambiguation graph
+(the candidates, links and information content of every entity, in file
+order, without the entity texts) and the hash of that form and of the PPR
+parameters is looked up in a sqlite3 file before running the PPR step. As the
+walks use a seeded random generator and the nodes are enumerated and their
+scores summed in file order, documents with the same hash get the same
+results. The cache is only used with a class compiled from the current source
+(see check_ppr_binary), as older builds depend on the entity texts."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from src.REEL.bypass import get_entity_fields
+
+PPR_CLASS_FILEPATH = 'src/REEL/ppr_for_ned_all.class'
+
+# Must be equal to ppr_for_ned_all.VERSION: older builds of the class number
+# the nodes by entity text and ignore the seed, so they do not contain it
+PPR_BINARY_VERSION = 'ppr_for_ned_all/3:seeded-sorted-windowed-ordered'
+
+# Settings of ppr_for_ned_all.java that change its results: bump whenever
+# they are changed, so that the cached results are not reused
+PPR_VERSION = PPR_BINARY_VERSION + ';walkers=10000;teleport=0.8;gap=0.1;ic'
+
+
+def check_ppr_binary(class_filepath=PPR_CLASS_FILEPATH):
+    """Check if the compiled PPR step was built from the current source,
+    i.e. if the constant pool of the class includes PPR_BINARY_VERSION.
+
+    :param class_filepath: path of the compiled class, defaults to
+        PPR_CLASS_FILEPATH
+    :type class_filepath: str
+    :return: True if the class exists and includes the version
+    :rtype: bool
+    """
+
+    if not os.path.exists(class_filepath):
+        return False
+
+    version = PPR_BINARY_VERSION.encode('utf-8')
+    # CONSTANT_Utf8 entry: tag, length and bytes
+    entry = b'\x01' + struct.pack('>H', len(version)) + version
+
+    with open(class_filepath, 'rb') as class_file:
+        found = entry in class_file.read()
+        class_file.close()
+
+    return found
+
+
+def get_graph_hash(candidates_filepath, ic, parameters):
+    """Calculate the canonical hash of the disambiguation graph of the given
+    candidates file.
+
+    :param candidates_filepath: path of the candidates file
+    :type candidates_filepath: str
+    :param ic: information content of the KB concepts, see
+        information_content.generate_ic_file
+    :type ic: dict
+    :param parameters: the PPR parameters of the run, e.g.
+        'window_size=1;seed=5'
+    :type parameters: str
+    :return: graph_hash and entity_keys, the keys ('<text>\\t<url>') of the
+        entities in file order, as written in the PPR results
+    :rtype: tuple (str, list)
+    """
+
+    canonical_lines = [PPR_VERSION, parameters]
+    entity_keys = []
+
+    with open(candidates_filepath, 'r') as candidates_file:
+
+        for line in candidates_file:
+            fields = get_entity_fields(line)
+
+            if line.startswith('ENTITY'):
+                entity_keys.append(fields['text'] + '\t' + fields['url'])
+                canonical_lines.append(
+                    'ENTITY\t' + fields.get('window', ''))
+
+            elif line.startswith('CANDIDATE'):
+                links = sorted(
+                    link for link in fields['links'].split(';') if link != '')
+                canonical_lines.append('CANDIDATE\t{}\t{}\t{}\t{}\t{}'.format(
+                    fields['id'], fields['inCount'], ';'.join(links),
+                    fields['url'], ic.get(fields['url'], '')))
+
+        candidates_file.close()
+
+    graph_hash = hashlib.sha1(
+        '\n'.join(canonical_lines).encode('utf-8')).hexdigest()
+
+    return graph_hash, entity_keys
+
+
+class PPRCache:
+    """Represent the PPR results cache: for each graph hash, the answer (KB
+    id) selected for each entity in file order, or None for the entities
+    without results (e.g. with gold identifier 'NIL')."""
+
+    def __init__(self, filepath):
+
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(filepath, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS ppr_results (graph_hash TEXT '
+            'PRIMARY KEY, answers TEXT)')
+        self.connection.commit()
+
+    def get(self, graph_hash):
+
+        row = self.connection.execute(
+            'SELECT answers FROM ppr_results WHERE graph_hash = ?',
+            (graph_hash,)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def insert(self, results):
+        """Insert the results with format {graph_hash: answers} in a single
+        transaction."""
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO ppr_results VALUES (?, ?)',
+                [(graph_hash, json.dumps(answers))
+                for graph_hash, answers in results.items()])
+
+    def close(self):
+
+        self.connection.close()
+
+
+def apply_ppr_cache(
+        candidates_dir, ic, parameters, ppr_cache, cached_filepath,
+        pending_filepath):
+    """Look up the graph of every candidates file in the PPR results cache.
+    The results of the cached graphs are written in the format of the
+    'candidate_scores' file and their candidates files are removed, so the
+    PPR step skips them. The remaining graphs are stored in a pending file,
+    to be inserted in the cache with their results by update_ppr_cache.
+
+    :param candidates_dir: dir with the candidates files of the run
+    :type candidates_dir: str
+    :param ic: information content of the KB concepts
+    :type ic: dict
+    :param parameters: the PPR parameters of the run
+    :type parameters: str
+    :param ppr_cache: the PPR results cache
+    :type ppr_cache: PPRCache object
+    :param cached_filepath: path of the output file with the cached results,
+        e.g. 'data/REEL/<run_id>/results/cached_scores'
+    :type cached_filepath: str
+    :param pending_filepath: path of the output JSON file with the graph
+        hash and entity keys of every uncached document
+    :type pending_filepath: str
+    :return: the number of documents with cached results
+    :rtype: int
+    """
+
+    pending = {}
+
+    with open(cached_filepath, 'w') as cached_file:
+
+        for document in sorted(os.listdir(candidates_dir)):
+            candidates_filepath = candidates_dir + document
+            graph_hash, entity_keys = get_graph_hash(
+                candidates_filepath, ic, parameters)
+            answers = ppr_cache.get(graph_hash)
+
+            # The cached results must include every entity with results
+            if answers is None or any(answer is None and
+                    not entity_key.endswith('\tNIL')
+                    for entity_key, answer in zip(entity_keys, answers)):
+                ppr_cache.misses += 1
+                pending[document] = {
+                    'graph_hash': graph_hash, 'entities': entity_keys}
+                continue
+
+            ppr_cache.hits += 1
+            cached_file.write('======= {} ========= \n'.format(document))
+
+            for entity_key, answer in zip(entity_keys, answers):
+
+                if not entity_key.endswith('\tNIL'):
+                    cached_file.write(
+                        '1\tENT={}\tANS={}\n'.format(entity_key, answer))
+
+            cached_file.write('\n')
+            os.remove(candidates_filepath)
+
+        cached_file.close()
+
+    with open(pending_filepath, 'w') as pending_file:
+        pending_file.write(json.dumps(pending))
+        pending_file.close()
+
+    return ppr_cache.hits
+
+
+def update_ppr_cache(run_id, cache_filepath):
+    """Insert the results of the PPR step for the graphs that were not
+    cached (see apply_ppr_cache) in the PPR results cache.
+
+    :param run_id: identification of current run
+    :type run_id: str
+    :param cache_filepath: path of the sqlite3 file of the cache
+    :type cache_filepath: str
+    """
+
+    pending_filepath = 'data/REEL/{}/ppr_pending.json'.format(run_id)
+
+    if not os.path.exists(pending_filepath):
+        return
+
+    with open(pending_filepath, 'r') as pending_file:
+        pending = json.load(pending_file)
+        pending_file.close()
+
+    # Answers of each document in the PPR output, with format
+    # {doc_id: {entity_key: answer}}
+    doc_answers = {}
+    doc_id = ''
+
+    with open('data/REEL/{}/results/candidate_scores'.format(run_id), 'r') \
+            as results:
+
+        for line in results:
+
+            if line == '\n':
+                continue
+
+            if line[0] == '=':
+                doc_id = line.strip('\n').split(' ')[1]
+                doc_answers[doc_id] = {}
+
+            else:
+                parts = line.strip('\n').split('\t')
+                entity_key = parts[1][len('ENT='):] + '\t' + parts[2]
+                doc_answers[doc_id][entity_key] = parts[3][len('ANS='):]
+
+        results.close()
+
+    results = {}
+
+    for document, graph in pending.items():
+
+        if document in doc_answers:
+            results[graph['graph_hash']] = [
+                doc_answers[document].get(entity_key)
+                for entity_key in graph['entities']]
+
+    ppr_cache = PPRCache(cache_filepath)
+    ppr_cache.insert(results)
+    ppr_cache.close()
+    os.remove(pending_filepath)
@@ -10,7 +10,9 @@ import java.io.FileReader;
 import java.io.FileWriter;
 import java.io.IOException;
 import java.util.ArrayList;
+import java.util.Collection;
 import java.util.Collections;
+import java.util.Comparator;
 import java.util.HashMap;
 import java.util.HashSet;
 import java.util.Map;
@@ -26,6 +28,10 @@ public class ppr_for_ned_all {
 	public static HashMap<String, String> entityAnswer = new HashMap<String, String>();		
 	public static HashMap<String, Integer> entityCount = new HashMap<String, Integer>();		
 	public static HashMap<String, String> entityText = new HashMap<String, String>();		
+	// Passages or sentences where each entity occurs (only in windowed candidates files).
+	public static HashMap<String, int[]> entityWindow = new HashMap<String, int[]>();
+	// Position of each entity in the candidates file.
+	public static HashMap<String, Integer> entityPosition = new HashMap<String, Integer>();
 	public static HashMap<String, Integer> urlTotalCount = new HashMap<String, Integer>();		
 	public static HashMap<String, Integer> urlTrueCount = new HashMap<String, Integer>();		
 	public static HashMap<String, Integer> entityCorrectCandidate = new HashMap<String, Integer>();
@@ -41,6 +47,13 @@ public class ppr_for_ned_all {
 	public static HashMap<Integer, ArrayList<Integer>> adjacency = new HashMap<Integer, ArrayList<Integer>>();
 	public static HashMap<Integer, HashMap<Integer, Integer>> unfinished_trips = new HashMap<Integer, HashMap<Integer,Integer>>();	
 	public static int walkers = 10000;
+	// Max number of passages or sentences between entities whose candidates are linked.
+	public static int windowSize = 1;
+	// Seed of the random walks, so that equal candidates files always get the same results.
+	public static long seed = 5;
+	// Version of the walks, looked up in the compiled class by ppr_cache.py: change it (and PPR_BINARY_VERSION)
+	// whenever the results change, so that the results cached by older builds are not reused.
+	public static final String VERSION = "ppr_for_ned_all/3:seeded-sorted-windowed-ordered";
 	public static double teleport = 0.8;
 	// We drop trips finished after first iteration.
 	// Number of finished trips after second iteration = (number of UNfinished trips after first iter) * epsilon
@@ -76,6 +89,10 @@ public class ppr_for_ned_all {
 
 		//String run_name = "all";
 		String run_id = args[0];
+		if (args.length > 1)
+			windowSize = Integer.parseInt(args[1]);
+		if (args.length > 2)
+			seed = Long.parseLong(args[2]);
 		//ssm = args[1]; 
 		//String model = "";
 		//String link_mode = args[2];
@@ -135,6 +152,8 @@ public class ppr_for_ned_all {
 			entityAnswer.clear();
 			entityCount.clear();
 			entityText.clear();
+			entityWindow.clear();
+			entityPosition.clear();
 			entityCorrectCandidate.clear();
 			numberEntity.clear();
 			candidateName.clear();
@@ -289,8 +308,9 @@ public class ppr_for_ned_all {
 		if (ssm.equals("secondconst")) {
 			for (int endpoint : endpointContributors.keySet() ) {
 				double score = 0;
-				// Accumulate contribution scores from optimal candidate for each entity. 
-				for (String ent : endpointContributors.get(endpoint).keySet() ) {
+				// Accumulate contribution scores from optimal candidate for each entity, in file order of the
+				// entities (the sum of the scores depends on the order, so it must not depend on the entity texts).
+				for (String ent : sortByPosition(endpointContributors.get(endpoint).keySet()) ) {
                     
                     // get ssm
 					score += endpointContributors.get(endpoint).get(ent) 
@@ -326,6 +346,17 @@ public class ppr_for_ned_all {
 		return coherenceScores;
 	}
 		
+	// Sort the given entities by position in the candidates file.
+	private static ArrayList<String> sortByPosition(Collection<String> entities) {
+		ArrayList<String> sortedEntities = new ArrayList<String>(entities);
+		Collections.sort(sortedEntities, new Comparator<String>() {
+			public int compare(String entity_1, String entity_2) {
+				return Integer.compare(entityPosition.get(entity_1), entityPosition.get(entity_2));
+			}
+		});
+		return sortedEntities;
+	}
+
 	private static HashMap<Integer, HashMap<Integer, Integer>> personalizedPageRank() {
 		// Initialize all unfinished trips.
 		for (int start : adjacency.keySet() ) {
@@ -333,7 +364,7 @@ public class ppr_for_ned_all {
 			unfinished_trips.get(start).put(start,  walkers);
 		}
 		// Run iterations of PPR.
-		Random randomGenerator = new Random(5);
+		Random randomGenerator = new Random(seed);
 		HashMap<Integer, HashMap<Integer, Integer>> finished_1 = one_iteration_ppr(randomGenerator);		
 		HashMap<Integer, HashMap<Integer, Integer>> finished_2 = one_iteration_ppr(randomGenerator);	
 		HashMap<Integer, HashMap<Integer, Integer>> finished_3 = one_iteration_ppr(randomGenerator);	
@@ -567,20 +598,32 @@ public class ppr_for_ned_all {
 	private static void constructGraph(HashMap<Integer, HashSet<Integer>> graph ) {
 	   
 	    checkEntityCandidates();
-		String separator = "_@_";
-		HashMap<String, Integer> nodeCandidate = new HashMap<String, Integer>();		//T1
+		final String separator = "_@_";
+		final HashMap<String, Integer> nodeCandidate = new HashMap<String, Integer>();		//T1
 		//T1 Construct nodes = entity + candidate. Build a map (node, original_candidate).
 		for (String entity : entityCandidates.keySet() ) 
 			for (int cand : entityCandidates.get(entity) ){
 				nodeCandidate.put(entity + separator + cand, cand);	
 		    }
+		// Enumerate the nodes by position of the entity in the candidates file and by candidate, so that
+		// the walks depend on the structure of the graph and on the seed alone (not on the entity texts).
+		ArrayList<String> sortedNodes = new ArrayList<String>(nodeCandidate.keySet());
+		Collections.sort(sortedNodes, new Comparator<String>() {
+			public int compare(String node_1, String node_2) {
+				int position_1 = entityPosition.get(node_1.substring(0, node_1.lastIndexOf(separator)));
+				int position_2 = entityPosition.get(node_2.substring(0, node_2.lastIndexOf(separator)));
+				if (position_1 != position_2)
+					return Integer.compare(position_1, position_2);
+				return Integer.compare(nodeCandidate.get(node_1), nodeCandidate.get(node_2));
+			}
+		});
 		// Synonym is the same candidate used for different entities. It has number, name, wiki-name, incount, type.
 		// Update synonymName with synonym enumeration and corresponding candidate names.
 		HashMap<String, Integer> nodeNumber = new HashMap<String, Integer>();
 		HashMap<Integer, String> tempCandidateName = new HashMap<Integer, String>();
 		//T2 Enumerate nodes (synonyms): (number, name).
 		int num = 2;
-		for (String node: nodeCandidate.keySet()) {
+		for (String node: sortedNodes) {
 			nodeNumber.put(node, num++);	
 			tempCandidateName.put(  num - 1, candidateName.get(nodeCandidate.get(node) ) );
 		}
@@ -669,7 +712,9 @@ public class ppr_for_ned_all {
                         if (candidateSynonyms.containsKey(neighbor)) {
                             for (int neighbor_synonym : candidateSynonyms.get(neighbor) ) {
                                 //Check that synonym and neighbor_synonym do NOT compete for the same entity
-                                if (  ! numberEntity.get(synonym).equals( numberEntity.get(neighbor_synonym) ) ) {
+                                //and that their entities are inside the same window
+                                if (  ! numberEntity.get(synonym).equals( numberEntity.get(neighbor_synonym) ) 
+                                		&& withinWindow( numberEntity.get(synonym), numberEntity.get(neighbor_synonym) ) ) {
                                         adjacency_set.get(synonym).add(neighbor_synonym);
                                         adjacency_set.get(neighbor_synonym).add(synonym);
                                 }
@@ -685,7 +730,8 @@ public class ppr_for_ned_all {
 		for (int cand : candidateSynonyms.keySet() ) {
 			for (int cand_syn_1 : candidateSynonyms.get(cand) ) {
 				for (int cand_syn_2 : candidateSynonyms.get(cand) ) {
-					if ( cand_syn_1 != cand_syn_2 ) {
+					if ( cand_syn_1 != cand_syn_2 
+							&& withinWindow( numberEntity.get(cand_syn_1), numberEntity.get(cand_syn_2) ) ) {
 						adjacency_set.get(cand_syn_1).add(cand_syn_2);
 						adjacency_set.get(cand_syn_2).add(cand_syn_1);
 					}
@@ -703,6 +749,21 @@ public class ppr_for_ned_all {
 		}		
 	}
 
+	// Check if some occurrence of entity_1 is at most windowSize passages or sentences away from
+	// some occurrence of entity_2. Entities without window are near every entity.
+	private static boolean withinWindow(String entity_1, String entity_2) {
+
+		if ( !entityWindow.containsKey(entity_1) || !entityWindow.containsKey(entity_2) )
+			return true;
+
+		for (int unit_1 : entityWindow.get(entity_1) )
+			for (int unit_2 : entityWindow.get(entity_2) )
+				if ( Math.abs(unit_1 - unit_2) <= windowSize )
+					return true;
+
+		return false;
+	}
+
 	// Parse the input file.
 	private static HashMap<Integer, HashSet<Integer>> readGraph(BufferedReader br) throws IOException {
 	   
@@ -796,6 +857,8 @@ public class ppr_for_ned_all {
 		//}	
 		String current_entity = values_entity.get("text") + "\t" + values_entity.get("url");
 		//System.out.print(current_entity);
+		if ( !entityPosition.containsKey(current_entity) )
+			entityPosition.put(current_entity, entityPosition.size());
 		if ( Ecandidates.size() > 0)
 		    entityCandidates.put(current_entity, Ecandidates);
 
@@ -803,6 +866,14 @@ public class ppr_for_ned_all {
 		entityAnswer.put(current_entity,  values_entity.get("url") );
 		
 		entityText.put(current_entity, values_entity.get("text").replaceAll("-",  " ") );
+
+		if ( values_entity.containsKey("window") && ! values_entity.get("window").equals("") ) {
+			String[] units = values_entity.get("window").split(";");
+			int[] window = new int[units.length];
+			for (int i = 0; i < units.length; i++)
+				window[i] = Integer.parseInt(units[i]);
+			entityWindow.put(current_entity, window);
+		}
 		//System.out.print(entityText);
 		// Count repeating entities.		
 		int countE = 1;
@@ -6,20 +6,98 @@ import os
 import sys
 from rapidfuzz import fuzz
 from src.REEL.annotations import parse_annotations
-from src.REEL.candidates import write_candidates_file, generate_candidates_list
+from src.REEL.bypass import split_resolved, write_resolved_file
+from src.REEL.cache import CandidatesCache, get_cache_version
+from src.REEL.candidates import write_candidates_files, \
+    generate_candidates_list, batch_map_to_kb, load_tfidf_index, \
+    tfidf_map_to_kb, MIN_MATCH_SCORES
 from src.REEL.information_content import generate_ic_file
+from src.REEL.kb_graph import get_graph_filepath, load_kb_graph
+from src.REEL.lexicon import load_lexicon
+from src.REEL.ppr_cache import apply_ppr_cache, PPRCache
+from src.REEL.reachability import load_reachability_index
+from src.REEL.sub_lexicon import get_sub_lexicon
+from src.REEL.tree_numbers import load_tree_number_index
 from src.NILINKER.predict_nilinker import load_model
-from src.REEL.relations import import_cdr_relations_pubtator, import_biored_relations
+from src.REEL.relations import import_cdr_relations_pubtator, import_biored_relations, \
+    load_relations_index, RelationsIndex
 from src.REEL.utils import entity_string, stringMatcher
 from tqdm import tqdm
 
 sys.path.append("./")
        
 
+def get_uncached_entities(
+        annotations, abbreviations, kb_cache, lexicon, score_cutoff=None):
+    """
+    Get the texts of the entities that will require a lexical similarity
+    search when building the candidates lists, i.e. the entities that will not
+    be found in the candidates cache and have no exact match in the lexicon,
+    following the order in which build_entity_candidate_dict processes them.
+
+    :param annotations: input entity mentions to link, with format 
+        {doc_id:[(annot1_id, annot1_text)]}
+    :type annotations: dict
+    :param abbreviations: abbreviations detected in the input documents, with
+        format {'doc_id': {'<abbreviation>': '<long_form>'}}
+    :type abbreviations: dict
+    :param kb_cache: cache with candidates of given knowledge base 
+    :type kb_cache: CandidatesCache object
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
+    :param score_cutoff: min lexical similarity (0-100) of the candidates,
+        defaults to None
+    :type score_cutoff: float
+    :return: uncached_entities, the unique entity texts (after abbreviation 
+        expansion) not present in the cache
+    :rtype: list
+    """
+
+    uncached_entities = []
+    available = set()
+
+    for document in annotations.keys():
+        check_entity = []
+        doc_abbrvs = {}
+
+        if document in abbreviations.keys():
+            doc_abbrvs = abbreviations[document]
+
+        for annotation in annotations[document]:
+            entity_text = annotation[1]
+            is_composite_or_individual = annotation[2]
+
+            if entity_text not in check_entity and entity_text != '' \
+                    and type(entity_text) == str and \
+                    is_composite_or_individual != "composite":
+                check_entity.append(entity_text)
+
+                is_long_form = entity_text in doc_abbrvs
+
+                if is_long_form:
+                    entity_text = doc_abbrvs[entity_text]
+
+                # The same rules of map_to_kb: an entity with an exact match
+                # (including suffix-stripped variants and the forms extending
+                # long forms) is mapped directly
+                if lexicon.find_exact(
+                        entity_text, score_cutoff=score_cutoff,
+                        prefix=is_long_form) is not None:
+                    continue
+
+                if entity_text not in available and \
+                        entity_text not in kb_cache:
+                    uncached_entities.append(entity_text)
+                    available.add(entity_text)
+
+    return uncached_entities
+
+
 def build_entity_candidate_dict(
         run_id, kb, entity_type, annotations, min_match_score, kb_graph, 
-        kb_cache, name_to_id, synonym_to_id, abbreviations,  
-        nil_model_name='none', nilinker=None, top_k=1, gold_standard=False):
+        kb_cache, lexicon, abbreviations, nil_model_name='none', 
+        nilinker=None, top_k=1, gold_standard=False, prefetched=None,
+        window=None):
 
     """
     Build a dict including the candidates for all entity mentions in all 
@@ -38,16 +116,13 @@ def build_entity_candidate_dict(
         candidate string, candidates below this threshold are excluded from 
         candidates list
     :type min_match_score: float
-    :param kb_graph: Networkx object representing the kb
-    :type kb_graph: Networkx object
+    :param kb_graph: Networkx object representing the kb (only the in- and 
+        outdegrees of the concepts are used)
+    :type kb_graph: Networkx object or NetworkxView object
     :param kb_cache: cache with candidates of given knowledge base 
-    :type kb_cache: dict
-    :param name_to_id: mappings between each kb concept name and 
-        the respective id
-    :type name_to_id: dict
-    :param synonym_to_id: mappings between each synonym for a given kb concept 
-        and the respective id
-    :type synonym_to_id: dict
+    :type kb_cache: CandidatesCache object
+    :param lexicon: names and synonyms of the kb
+    :type lexicon: Lexicon object
     :param abbreviations: abbreviations detected in the input documents, with
         format {'doc_id': {'<abbreviation>': '<long_form>'}}
     :type abbreviations: dict
@@ -63,6 +138,13 @@ def build_entity_candidate_dict(
         non-gold standard NER output (e.g. information about composite 
         mentions), defaults to False
     :type gold_standard: bool
+    :param prefetched: top concepts retrieved in batch for the entities not 
+        present in the cache, with format {entity_text: top_concepts}, 
+        defaults to None
+    :type prefetched: dict
+    :param window: unit of the windows of the disambiguation graphs, 
+        'passage' or 'sentence', defaults to None (no windows)
+    :type window: str
     
     :return: entities_candidates (dict) with format 
         {doc_id: {mention:[candidate1, ...]} }, changed_cache_final (bool) 
@@ -94,6 +176,17 @@ def build_entity_candidate_dict(
             doc_abbrvs = abbreviations[document]
 
         doc_annotations = annotations[document]
+        entity_windows = {}
+
+        if window is not None:
+            # The passages or sentences where each entity occurs
+            unit_index = 3 if window == 'passage' else 4
+
+            for annotation in doc_annotations:
+
+                if len(annotation) > unit_index:
+                    entity_windows.setdefault(annotation[1], set()).add(
+                        annotation[unit_index])
 
         for annotation in doc_annotations:
             entity_text = annotation[1]
@@ -111,9 +204,9 @@ def build_entity_candidate_dict(
                 candidates_list, \
                     changed_cache, \
                     kb_cache_up = generate_candidates_list(
-                                    entity_text, kb, kb_graph, name_to_id, 
-                                    synonym_to_id, doc_abbrvs, kb_cache,  
-                                    min_match_score)                 
+                                    entity_text, kb, kb_graph, lexicon, 
+                                    doc_abbrvs, kb_cache, min_match_score, 
+                                    prefetched=prefetched)                 
             
                 if changed_cache:
                     # There is at least 1 change in the cache file
@@ -158,9 +251,8 @@ def build_entity_candidate_dict(
                         candidates_list, \
                             changed_cache, \
                             kb_cache_up = generate_candidates_list(
-                                entity_text, kb, kb_graph, name_to_id, 
-                                synonym_to_id, kb_cache, doc_abbrvs, 
-                                min_match_score, 
+                                entity_text, kb, kb_graph, lexicon, 
+                                doc_abbrvs, kb_cache, min_match_score, 
                                 nil_candidates=top_candidates_up)
 
                         if len(candidates_list) == 0:
@@ -182,6 +274,13 @@ def build_entity_candidate_dict(
                     str(i), document, true_kb_id)
                 
                 add_entity = (entity_str, candidates_list)
+
+                if entity_text in entity_windows:
+                    entity_units = tuple(sorted(entity_windows[entity_text]))
+                    entity_str = entity_str[:-1] + '\twindow:{}\n'.format(
+                        ';'.join(str(unit) for unit in entity_units))
+                    add_entity = (entity_str, candidates_list, entity_units)
+
                 doc_entities.append(add_entity)
 
         if doc_entities != []:
@@ -243,38 +342,34 @@ def pre_process(run_id, entity_type, args, abbreviations):
     #                            Import KB info
     #-------------------------------------------------------------------------
 
-    # Load preprocessed KB dicts and networkx graph
-    name_to_id = {}
-    synonym_to_id = {}
+    # Load preprocessed KB dicts into a lexicon and networkx graph
     kb_graph = None
     kb_dicts_dir = 'data/kbs/dicts/{}/'.format(args.kb) 
     
-    with open(kb_dicts_dir + 'name_to_id.json', 'r') as dict_file:
-        name_to_id = json.loads(dict_file.read())
-        dict_file.close()
-
-    synonyms_filepath = kb_dicts_dir + 'synonym_to_id_{}.json'.format(
-        args.dataset)
+    # With retrieval 'ngram' the lexicon strings sharing most character 
+    # n-grams with each mention are shortlisted before scoring them, and with
+    # retrieval 'symspell' only the lexicon strings within a bounded edit 
+    # distance of each mention are scored
+    lexicon = load_lexicon(
+        kb_dicts_dir, args.dataset, ngram_index=args.retrieval == 'ngram',
+        deletion_index=args.retrieval == 'symspell')
+
+    # The graph arrays of the compiled KB are memory-mapped instead of parsing
+    # the GraphML file, if available, and the in- and outdegrees of the 
+    # candidates are read from them
+    kb_graph = load_kb_graph(kb_dicts_dir)
     
-    with open(synonyms_filepath, 'r') as dict_file2:
-        synonym_to_id = json.loads(dict_file2.read())
-        dict_file2.close()    
+    # Min lexical similarity between entity text and candidate text: 
+    # exclude candidates with a lexical similarity below min_match_score
+    min_match_score = MIN_MATCH_SCORES[args.dataset]
 
-    kb_graph = nx.read_graphml(kb_dicts_dir + 'graph.graphml')
-    
     #-------------------------------------------------------------------------
-    #                  Import cache file (if available)
+    #                      Open candidates cache
     #-------------------------------------------------------------------------
-    kb_cache_filename = 'data/REEL/cache/{}_.json'.format(
-        args.kb, args.dataset)
-    kb_cache = {}
-
-    if os.path.exists(kb_cache_filename):
-        cache_file = open(kb_cache_filename)
-        kb_cache = json.load(cache_file)
-        cache_file.close()
-
-    changed_cache_final = False
+    cache_version = get_cache_version(
+        lexicon.version, min_match_score, args.retrieval)
+    kb_cache = CandidatesCache(
+        'data/REEL/cache/candidates.sqlite', args.kb, cache_version)
 
     #-------------------------------------------------------------------------
     #                            Load NILINKER
@@ -287,7 +382,7 @@ def pre_process(run_id, entity_type, args, abbreviations):
     nilinker = None
     top_k = 1  # Top candidates NILINKER returns
 
-        print('Loading NILINKER...')
+    print('Loading NILINKER...')
 
     top_k_dict = {'bc5cdr_dis': 1, 'ncbi_disease': 1, 'biored_dis': 1,
         'biored_chem': 1, 'bc5cdr_chem': 1}
@@ -306,13 +401,50 @@ def pre_process(run_id, entity_type, args, abbreviations):
     #-------------------------------------------------------------------------
     #                   Build candidates lists for the entities
     #-------------------------------------------------------------------------
+    prefetched = None
 
-    # Min lexical similarity between entity text and candidate text: 
-    # exclude candidates with a lexical similarity below min_match_score
-    min_match_score_dict = {
-        'bc5cdr_dis': 0.80, 'bc5cdr_chem': 0.90, 'ncbi_disease': 0.85, 
-        'biored_dis': 0.90, 'biored_chem': 0.90}
-    min_match_score = min_match_score_dict[args.dataset]
+    # With windowed disambiguation graphs only the candidates of entities 
+    # close in the document are linked
+    window = None
+    window_size = None
+
+    if args.window != 'none':
+        window = args.window
+        window_size = args.window_size
+
+    if args.retrieval in ['batch', 'tfidf'] or args.sub_lexicon:
+        uncached_entities = get_uncached_entities(
+            annotations, abbreviations, kb_cache, lexicon,
+            score_cutoff=min_match_score * 100)
+    
+    if args.sub_lexicon and args.retrieval in ['exhaustive', 'batch']:
+        # Only search the KB strings that may reach min_match_score against
+        # some of the uncached entities
+        lexicon.restrict(get_sub_lexicon(
+            lexicon, uncached_entities, min_match_score * 100))
+        print('Sub-lexicon: {} of {} KB strings'.format(
+            len(lexicon.active_indices), len(lexicon)))
+
+    if args.retrieval in ['batch', 'tfidf']:
+        # Score all the uncached entities against the KB at once
+        print('Retrieving candidates for {} entities in batch...'.format(
+            len(uncached_entities)))
+    
+    if args.retrieval == 'batch':
+        prefetched = batch_map_to_kb(
+            uncached_entities, lexicon, score_cutoff=min_match_score * 100, 
+            workers=args.workers)
+    
+    elif args.retrieval == 'tfidf':
+        # The KB strings are shortlisted with the TF-IDF matrix of the 
+        # lexicon, stored next to the KB dicts
+        tfidf_index = load_tfidf_index(
+            kb_dicts_dir + 'lexicon_{}_tfidf.npz'.format(args.dataset), 
+            lexicon)
+        prefetched = tfidf_map_to_kb(
+            uncached_entities, lexicon, tfidf_index, 
+            score_cutoff=min_match_score * 100)
+        del tfidf_index
     
     # Build candidates lists for every mention
     entities_candidates, \
@@ -324,30 +456,47 @@ def pre_process(run_id, entity_type, args, abbreviations):
                                             min_match_score, 
                                             kb_graph, 
                                             kb_cache, 
-                                            name_to_id, 
-                                            synonym_to_id, 
+                                            lexicon, 
                                             abbreviations,
                                             nil_model_name=nil_model_name,
                                             nilinker=nilinker,
                                             top_k=top_k,
-                                            gold_standard=args.gold_standard)
+                                            gold_standard=args.gold_standard,
+                                            prefetched=prefetched,
+                                            window=window)
     
+    print('Exact-match fast path: {exact} exact, {normalized} normalized, '
+        '{suffix} suffix-stripped, {prefix} prefix-matched mentions'.format(
+        **lexicon.fast_path))
+
     del nilinker
-    del name_to_id
-    del synonym_to_id
+    del prefetched
+    del lexicon
 
-    # Save cache, if changed
-    if changed_cache_final:
-        print('Updating KB cache file...')
-        cache_out = json.dumps(kb_cache_up)
-    
-        with open(kb_cache_filename, 'w') as cache_out_file:
-            cache_out_file.write(cache_out)
-            cache_out_file.close()
+    # Insert the remaining new entries in the cache file (the misses)
+    kb_cache.close()
+    print('Candidates cache: {hits} hits, {misses} misses stored '
+        '(hit rate {hit_rate:.2%})'.format(**kb_cache.stats()))
 
     del kb_cache_up
     del kb_cache
 
+    #-------------------------------------------------------------------------
+    #              Fix the entities that are already resolved
+    #-------------------------------------------------------------------------
+    # The documents where every entity is resolved skip the candidates files
+    # and the PPR step
+    ambiguous_docs, resolved_docs, bypass_stats = split_resolved(
+        entities_candidates, margin=args.bypass_margin)
+    write_resolved_file(
+        resolved_docs, 'data/REEL/{}/results/resolved_scores'.format(run_id))
+
+    print('PPR bypass: {documents} of {total_documents} documents and '
+        '{entities} of {total_entities} entities resolved without '
+        'PPR'.format(**bypass_stats))
+
+    del resolved_docs
+
     #-------------------------------------------------------------------------
     #            Import relations to add to the disambiguation graphs
     #-------------------------------------------------------------------------
@@ -360,19 +509,37 @@ def pre_process(run_id, entity_type, args, abbreviations):
     if args.dataset in links_dict.keys():
         link_mode = links_dict[args.dataset]
 
-    extracted_relations = {}
-    
+    extracted_relations = RelationsIndex()
     
     if link_mode== 'corpus' or link_mode == 'kb_corpus': 
         # Integrate relations extracted from corpus into the graph
         print('Importing extracted relations...')
-
-        rel_filename = 'data/relations/{}.json'.format(args.dataset)
-        
-        with open(rel_filename, 'r') as rel_file:
-            extracted_relations = json.load(rel_file)
-            rel_file.close()
+        extracted_relations = load_relations_index(args.dataset)
     
+    reachability = None
+
+    if link_mode != 'corpus' and \
+            os.path.exists(kb_dicts_dir + 'id_to_tree_numbers.json'):
+        # In MeSH-based KBs the ancestors of a concept are found by comparing
+        # the prefixes of its tree numbers
+        reachability = load_tree_number_index(
+            kb_dicts_dir + 'id_to_tree_numbers.json')
+
+    elif link_mode != 'corpus':
+        # Precomputed ancestors of the KB concepts to find the KB links 
+        # between candidates without traversing the graph
+        reachability = load_reachability_index(
+            kb_dicts_dir + 'reachability.npz', kb_graph, 
+            get_graph_filepath(kb_dicts_dir))
+
+    #-------------------------------------------------------------------------
+    #                  Generate Information content file
+    #-------------------------------------------------------------------------
+
+    # Create information content file including every KB concept
+    # appearing in candidates files 
+    ic = generate_ic_file(run_id, entities_candidates, kb_graph)
+
     #-------------------------------------------------------------------------
     #               Output candidates files for each input document
     #-------------------------------------------------------------------------
@@ -388,28 +555,33 @@ def pre_process(run_id, entity_type, args, abbreviations):
         for file in cand_files:
             os.remove(candidates_dir + file)
 
-    pbar = tqdm(total=len(entities_candidates.keys()))
-
-    for document in entities_candidates:
-        candidates_filename = candidates_dir + document
-        write_candidates_file(
-            entities_candidates[document], candidates_filename, 
-            entity_type, kb_graph, link_mode, extracted_relations)
-        pbar.update(1)
+    # With several workers the documents are split across forked processes
+    # sharing the KB graph and the relations loaded above
+    write_candidates_files(
+        ambiguous_docs, candidates_dir, entity_type, kb_graph, link_mode, 
+        extracted_relations, reachability=reachability, 
+        window_size=window_size, workers=args.workers)
 
-    pbar.close()
-    
     #-------------------------------------------------------------------------
-    #                  Generate Information content file
+    #                  Look up the PPR results cache
     #-------------------------------------------------------------------------
-
-    # Create information content file including every KB concept
-    # appearing in candidates files 
-    generate_ic_file(run_id, entities_candidates, kb_graph)
+    # The documents whose disambiguation graph was already ranked skip the 
+    # PPR step
+    ppr_cache = PPRCache('data/REEL/cache/ppr.sqlite')
+    apply_ppr_cache(
+        candidates_dir, ic, 
+        'window_size={};seed={}'.format(window_size, args.ppr_seed), 
+        ppr_cache, 'data/REEL/{}/results/cached_scores'.format(run_id),
+        'data/REEL/{}/ppr_pending.json'.format(run_id))
+    ppr_cache.close()
+    
+    print('PPR results cache: {} hits, {} misses'.format(
+        ppr_cache.hits, ppr_cache.misses))
     
     print('Pre-processing finished!')
     
     # To free up memory usage
     del kb_graph
     del entities_candidates
+    del ambiguous_docs
     gc.collect()
\ No newline at end of file
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""This module fills the persistent candidates cache ahead of time with the
+candidates lists of the entities annotated in the train and dev sets of the
+datasets (harvested as in dataset_entities.py) and of any given list of
+mentions, so that the runs over new documents start with a hot cache."""
+
+import argparse
+import multiprocessing
+import os
+import sys
+sys.path.append('./')
+from src.REEL.cache import CandidatesCache, get_cache_version
+from src.REEL.candidates import batch_map_to_kb, load_tfidf_index, \
+    merge_matches, tfidf_map_to_kb, MIN_MATCH_SCORES
+from src.REEL.dataset_entities import get_dataset_entities
+from src.REEL.lexicon import load_lexicon
+
+# Datasets annotated with entities of the same type, whose mentions are
+# expected to appear in each other's documents
+dataset_groups = {
+    'disease': ['bc5cdr_dis', 'ncbi_disease', 'biored_dis'],
+    'chemical': ['bc5cdr_chem', 'biored_chem']}
+
+# The lexicon shared by the worker processes, set before forking them so
+# that they inherit it (copy-on-write) instead of receiving a copy of it
+worker_lexicon = None
+
+
+def extract_chunk(args):
+    """Retrieve the top concepts for a chunk of entity texts with the lexicon
+    of the worker process."""
+
+    entities_text, score_cutoff = args
+    top_concepts = []
+
+    for entity_text in entities_text:
+        name_matches, synonym_matches = worker_lexicon.extract(
+            entity_text, score_cutoff=score_cutoff)
+        top_concepts.append(merge_matches(name_matches, synonym_matches))
+
+    return top_concepts
+
+
+def get_prewarm_mentions(corpora_dir, dataset, mentions_filepath=None):
+    """Get the mentions whose candidates lists are cached: the entities
+    annotated in the train and dev sets of every dataset with the same entity
+    type as given dataset and the mentions in the given file.
+
+    :param corpora_dir: dir with the corpora, e.g. 'data/corpora/'
+    :type corpora_dir: str
+    :param dataset: the dataset the cache is prewarmed for
+    :type dataset: str
+    :param mentions_filepath: file with one mention per line, defaults to None
+    :type mentions_filepath: str
+    :return: mentions, the unique mentions in the order they were found
+    :rtype: list
+    """
+
+    entity_type = 'chemical' if 'chem' in dataset else 'disease'
+    mentions = []
+
+    for source in dataset_groups[entity_type]:
+        print('Harvesting {} mentions...'.format(source))
+        mentions.extend(get_dataset_entities(corpora_dir, source).keys())
+
+    if mentions_filepath is not None:
+
+        with open(mentions_filepath, 'r') as mentions_file:
+            mentions.extend([line.strip('\n') for line in mentions_file
+                if line.strip('\n') != ''])
+            mentions_file.close()
+
+    return list(dict.fromkeys(mentions))
+
+
+def prewarm_cache(
+        mentions, lexicon, kb_cache, retrieval, min_match_score, workers=1,
+        tfidf_filepath=None):
+    """Retrieve the candidates lists of the given mentions that are neither in
+    the candidates cache nor have an exact match in the lexicon, and insert
+    them in the cache.
+
+    :param mentions: surface forms of the entities
+    :type mentions: list
+    :param lexicon: names and synonyms of the KB, with the index required by
+        the retrieval method
+    :type lexicon: Lexicon object
+    :param kb_cache: candidates cache for the given kb
+    :type kb_cache: CandidatesCache object
+    :param retrieval: retrieval method, the same used in the runs that will
+        read the cache
+    :type retrieval: str
+    :param min_match_score: min lexical similarity of the candidates (0-1)
+    :type min_match_score: float
+    :param workers: number of threads (exhaustive and batch retrieval) or of
+        processes (ngram and symspell retrieval), -1 uses all available
+        cores, defaults to 1
+    :type workers: int
+    :param tfidf_filepath: path of the TF-IDF matrix of the lexicon, only
+        required by the tfidf retrieval, defaults to None
+    :type tfidf_filepath: str
+    :return: the number of cached mentions
+    :rtype: int
+    """
+
+    global worker_lexicon
+    score_cutoff = min_match_score * 100
+    uncached = [mention for mention in mentions
+        if lexicon.find_exact(mention, score_cutoff=score_cutoff) is None and
+        mention not in kb_cache]
+    print('Retrieving candidates for {} of {} mentions...'.format(
+        len(uncached), len(mentions)))
+
+    if retrieval in ['exhaustive', 'batch']:
+        prefetched = batch_map_to_kb(
+            uncached, lexicon, score_cutoff=score_cutoff, workers=workers)
+
+    elif retrieval == 'tfidf':
+        tfidf_index = load_tfidf_index(tfidf_filepath, lexicon)
+        prefetched = tfidf_map_to_kb(
+            uncached, lexicon, tfidf_index, score_cutoff=score_cutoff)
+
+    else:
+        # The shortlists of the n-gram index or of the deletion dictionary
+        # are retrieved for one mention at a time, so the mentions are split
+        # across processes sharing the lexicon
+        worker_lexicon = lexicon
+
+        if workers == -1:
+            workers = os.cpu_count()
+
+        chunk_size = max(1, len(uncached) // (workers * 4))
+        chunks = [uncached[start:start + chunk_size]
+            for start in range(0, len(uncached), chunk_size)]
+
+        if workers <= 1 or len(chunks) <= 1 or \
+                'fork' not in multiprocessing.get_all_start_methods():
+            top_concepts = [extract_chunk((chunk, score_cutoff))
+                for chunk in chunks]
+
+        else:
+
+            with multiprocessing.get_context('fork').Pool(
+                    processes=workers) as pool:
+                top_concepts = pool.map(
+                    extract_chunk, [(chunk, score_cutoff) for chunk in chunks])
+
+        worker_lexicon = None
+
+        prefetched = {}
+
+        for chunk, chunk_top_concepts in zip(chunks, top_concepts):
+            prefetched.update(zip(chunk, chunk_top_concepts))
+
+    for mention in uncached:
+        kb_cache[mention] = prefetched[mention]
+
+    kb_cache.commit()
+
+    return len(uncached)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-kb', type=str, required=True,
+        choices=['medic', 'medic_OMIM', 'ctd_chem', 'mesh_dis', 'mesh_chem'])
+    parser.add_argument('-dataset', type=str, required=True,
+        choices=['bc5cdr_dis', 'bc5cdr_chem', 'ncbi_disease', 'biored_dis',
+        'biored_chem'])
+    parser.add_argument('--mentions', type=str, default=None,
+        help='File with additional mentions to cache, one per line')
+    parser.add_argument('--retrieval', type=str, default='exhaustive',
+        choices=['exhaustive', 'ngram', 'symspell', 'batch', 'tfidf'])
+    parser.add_argument('--workers', type=int, default=1,
+        help='Number of threads or processes (-1 to use all cores)')
+    args = parser.parse_args()
+
+    kb_dicts_dir = 'data/kbs/dicts/{}/'.format(args.kb)
+    lexicon = load_lexicon(
+        kb_dicts_dir, args.dataset, ngram_index=args.retrieval == 'ngram',
+        deletion_index=args.retrieval == 'symspell')
+    min_match_score = MIN_MATCH_SCORES[args.dataset]
+
+    mentions = get_prewarm_mentions(
+        'data/corpora/', args.dataset, mentions_filepath=args.mentions)
+
+    os.makedirs('data/REEL/cache/', exist_ok=True)
+    kb_cache = CandidatesCache(
+        'data/REEL/cache/candidates.sqlite', args.kb,
+        get_cache_version(lexicon.version, min_match_score, args.retrieval))
+
+    num_cached = prewarm_cache(
+        mentions, lexicon, kb_cache, args.retrieval, min_match_score,
+        workers=args.workers,
+        tfidf_filepath=kb_dicts_dir + 'lexicon_{}_tfidf.npz'.format(
+            args.dataset))
+    kb_cache.close()
+
+    print('Cached the candidates of {} mentions'.format(num_cached))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""This module precomputes the reachability index of a KB graph: the nodes
+are relabelled with integers and the ancestors of every node are stored in
+CSR format, so checking if a concept is an ancestor or a descendant of
+another concept is a lookup instead of a traversal of the graph."""
+
+import os
+import networkx as nx
+import numpy as np
+
+
+class ReachabilityIndex:
+    """Represent the transitive closure of a KB graph. The ancestors of the
+    node with integer id i are ancestors[offsets[i]:offsets[i + 1]], in
+    ascending order."""
+
+    def __init__(self):
+
+        self.nodes = None
+        self.node_to_id = None
+        self.offsets = None
+        self.ancestors = None
+
+    def build(self, kb_graph):
+        """Build the index for given graph, visiting the nodes in topological
+        order so that the ancestors of each node are the union of its
+        parents and of their ancestors.
+
+        :param kb_graph: represents the target knowledge base
+        :type kb_graph: Networkx DiGraph object
+        """
+
+        self.nodes = list(kb_graph.nodes())
+        self.node_to_id = {node: i for i, node in enumerate(self.nodes)}
+        node_ancestors = [None] * len(self.nodes)
+
+        try:
+
+            for node in nx.topological_sort(kb_graph):
+                parents = [self.node_to_id[parent]
+                    for parent in kb_graph.predecessors(node)]
+                node_ancestors[self.node_to_id[node]] = np.unique(
+                    np.concatenate(
+                        [np.array(parents, dtype=np.int32)] +
+                        [node_ancestors[parent] for parent in parents]))
+
+        except nx.NetworkXUnfeasible:
+            # The graph has cycles
+            for node in self.nodes:
+                node_ancestors[self.node_to_id[node]] = np.unique(np.array(
+                    [self.node_to_id[ancestor]
+                    for ancestor in nx.ancestors(kb_graph, node)],
+                    dtype=np.int32))
+
+        self.offsets = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(
+            [len(ancestors) for ancestors in node_ancestors],
+            out=self.offsets[1:])
+        self.ancestors = np.zeros(self.offsets[-1], dtype=np.int32)
+
+        for i, ancestors in enumerate(node_ancestors):
+            self.ancestors[self.offsets[i]:self.offsets[i + 1]] = ancestors
+
+    def save(self, filepath):
+        """Output the index arrays into a .npz file."""
+
+        np.savez(
+            filepath, nodes=np.array(self.nodes, dtype=str),
+            offsets=self.offsets, ancestors=self.ancestors)
+
+    def load(self, filepath):
+        """Load the index arrays from a .npz file."""
+
+        with np.load(filepath) as index_file:
+            self.nodes = index_file['nodes'].tolist()
+            self.offsets = index_file['offsets']
+            self.ancestors = index_file['ancestors']
+
+        self.node_to_id = {node: i for i, node in enumerate(self.nodes)}
+
+    def is_ancestor(self, i, j):
+        """Check if the node with integer id j is an ancestor of the node
+        with integer id i."""
+
+        ancestors = self.ancestors[self.offsets[i]:self.offsets[i + 1]]
+        position = np.searchsorted(ancestors, j)
+
+        return position < len(ancestors) and ancestors[position] == j
+
+    def get_related_matrix(self, urls):
+        """Check which pairs of the given KB concepts are the same concept or
+        have one concept as ancestor of the other.
+
+        :param urls: distinct knowledge base identifiers
+        :type urls: list
+        :return: related, where related[a, b] is True if urls[a] and urls[b]
+            are related
+        :rtype: Numpy array
+        """
+
+        related = np.eye(len(urls), dtype=bool)
+        node_ids = np.array(
+            [self.node_to_id.get(url, -1) for url in urls], dtype=np.int64)
+
+        for a in np.flatnonzero(node_ids >= 0):
+            i = node_ids[a]
+            ancestors = self.ancestors[self.offsets[i]:self.offsets[i + 1]]
+            related[a] |= np.isin(node_ids, ancestors) & (node_ids >= 0)
+
+        return related | related.T
+
+    def is_related(self, c1, c2):
+        """Check if one of the given KB concepts is an ancestor of the other.
+
+        :param c1: knowledge base identifier of concept 1
+        :type c1: str
+        :param c2: knowledge base identifier of concept 2
+        :type c2: str
+        :return: related, False if any of the concepts is not in the graph
+        :rtype: bool
+        """
+
+        if c1 not in self.node_to_id or c2 not in self.node_to_id:
+            return False
+
+        i = self.node_to_id[c1]
+        j = self.node_to_id[c2]
+
+        return bool(self.is_ancestor(i, j) or self.is_ancestor(j, i))
+
+
+def load_reachability_index(index_filepath, kb_graph, artifact_filepath):
+    """Load the reachability index stored in given file, if it is available
+    and up to date with the KB graph, or build it from the graph and
+    output it to that file otherwise.
+
+    :param index_filepath: path of the .npz file storing the index, e.g.
+        'data/kbs/dicts/medic/reachability.npz'
+    :type index_filepath: str
+    :param kb_graph: represents the target knowledge base
+    :type kb_graph: Networkx DiGraph object
+    :param artifact_filepath: path of the file the graph was loaded from
+        (see kb_graph.get_graph_filepath), e.g.
+        'data/kbs/dicts/medic/compiled/children.npy'
+    :type artifact_filepath: str
+    :return: reachability
+    :rtype: ReachabilityIndex object
+    """
+
+    reachability = ReachabilityIndex()
+
+    if os.path.exists(index_filepath) and \
+            os.path.getmtime(index_filepath) >= \
+            os.path.getmtime(artifact_filepath):
+        reachability.load(index_filepath)
+
+        return reachability
+
+    reachability.build(kb_graph)
+    reachability.save(index_filepath)
+
+    return reachability
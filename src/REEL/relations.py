@@ -4,7 +4,135 @@ import os
 import sys
 import xml.etree.ElementTree as ET
 import json
+import numpy as np
 sys.path.append("./")
+from src.REEL.overlay import load_dict
+
+
+#-----------------------------------------------------------------------------
+#               Integer-coded representation of the relations
+#-----------------------------------------------------------------------------
+
+class RelationsIndex:
+    """Represent the relations extracted from a corpus, with format
+    {entity_id1: [entity_id2, entity_id3]}, as an integer-coded adjacency in
+    CSR format: the entities related to the entity with integer id i are
+    neighbors[offsets[i]:offsets[i + 1]], in ascending order."""
+
+    def __init__(self):
+
+        self.entities = []
+        self.entity_to_id = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.neighbors = np.zeros(0, dtype=np.int32)
+
+    def build(self, extracted_relations):
+        """Build the adjacency of the given relations.
+
+        :param extracted_relations: relations with format 
+            {entity_id1: [entity_id2, entity_id3]}
+        :type extracted_relations: dict
+        """
+
+        entities = set(extracted_relations.keys())
+
+        for related_entities in extracted_relations.values():
+            entities.update(related_entities)
+
+        self.entities = sorted(entities)
+        self.entity_to_id = {
+            entity: i for i, entity in enumerate(self.entities)}
+        
+        entity_neighbors = [np.zeros(0, dtype=np.int32)] * len(self.entities)
+
+        for entity, related_entities in extracted_relations.items():
+            entity_neighbors[self.entity_to_id[entity]] = np.unique(np.array(
+                [self.entity_to_id[entity_2] for entity_2 in related_entities],
+                dtype=np.int32))
+        
+        self.offsets = np.zeros(len(self.entities) + 1, dtype=np.int64)
+        np.cumsum(
+            [len(neighbors) for neighbors in entity_neighbors], 
+            out=self.offsets[1:])
+        self.neighbors = np.zeros(self.offsets[-1], dtype=np.int32)
+
+        for i, neighbors in enumerate(entity_neighbors):
+            self.neighbors[self.offsets[i]:self.offsets[i + 1]] = neighbors
+
+    def save(self, filepath):
+        """Output the adjacency arrays into a .npz file."""
+
+        np.savez(
+            filepath, entities=np.array(self.entities, dtype=str),
+            offsets=self.offsets, neighbors=self.neighbors)
+
+    def load(self, filepath):
+        """Load the adjacency arrays from a .npz file."""
+
+        with np.load(filepath) as relations_file:
+            self.entities = relations_file['entities'].tolist()
+            self.offsets = relations_file['offsets']
+            self.neighbors = relations_file['neighbors']
+        
+        self.entity_to_id = {
+            entity: i for i, entity in enumerate(self.entities)}
+
+    def get_neighbors(self, i):
+        """Get the integer ids of the entities related to the entity with 
+        integer id i."""
+
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    def is_related(self, c1, c2):
+        """Check if there is an extracted relation from c1 to c2.
+
+        :param c1: identifier of entity 1
+        :type c1: str
+        :param c2: identifier of entity 2
+        :type c2: str
+        :rtype: bool
+        """
+
+        if c1 not in self.entity_to_id or c2 not in self.entity_to_id:
+            return False
+        
+        neighbors = self.get_neighbors(self.entity_to_id[c1])
+        j = self.entity_to_id[c2]
+        position = np.searchsorted(neighbors, j)
+
+        return bool(position < len(neighbors) and neighbors[position] == j)
+
+
+def load_relations_index(dataset):
+    """Load the integer-coded relations extracted for given dataset from
+    'data/relations/<dataset>.npz', if it is up to date with 
+    'data/relations/<dataset>.json', or compile them from the .json file and
+    output them to the .npz file otherwise.
+
+    :param dataset: the target dataset
+    :type dataset: str
+    :return: relations_index
+    :rtype: RelationsIndex object
+    """
+
+    json_filepath = 'data/relations/{}.json'.format(dataset)
+    npz_filepath = 'data/relations/{}.npz'.format(dataset)
+    relations_index = RelationsIndex()
+
+    if os.path.exists(npz_filepath) and \
+            os.path.getmtime(npz_filepath) >= os.path.getmtime(json_filepath):
+        relations_index.load(npz_filepath)
+
+        return relations_index
+
+    with open(json_filepath, 'r') as rel_file:
+        extracted_relations = json.load(rel_file)
+        rel_file.close()
+
+    relations_index.build(extracted_relations)
+    relations_index.save(npz_filepath)
+
+    return relations_index
 
 
 #-----------------------------------------------------------------------------
@@ -212,9 +340,7 @@ if __name__ == '__main__':
     kb_dicts_dir = 'data/kbs/dicts/{}/'.format(kb) 
     id2name_filepath = kb_dicts_dir + 'id_to_name.json'
     
-    with open(id2name_filepath, 'r') as dict_file3:
-        id_to_name = json.loads(dict_file3.read())
-        dict_file3.close()   
+    id_to_name = load_dict(id2name_filepath)
     
     relations_out = {}
 
@@ -231,4 +357,9 @@ if __name__ == '__main__':
     
     with open(filename, 'w') as out_file:
         out_file.write(out_dict)
-        out_file.close()
\ No newline at end of file
+        out_file.close()
+
+    # Integer-coded relations used to find the links between candidates
+    relations_index = RelationsIndex()
+    relations_index.build(relations_out)
+    relations_index.save('data/relations/{}.npz'.format(dataset))
\ No newline at end of file
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""This module selects the run-specific sub-lexicon: the surface forms of a
+KB that may reach the score cutoff against at least one of the entity
+mentions of the input corpus. The forms outside the sub-lexicon can never be
+candidates of those mentions, so they are excluded from the fuzzy scans
+without changing the retrieved candidates."""
+
+import numpy as np
+from src.REEL.ngram_index import get_sorted_form
+
+# Base of the polynomial hash of the n-gram blocks
+hash_base = 257
+hash_mask = 2**64 - 1
+
+
+def get_blocks(sorted_form, score_cutoff):
+    """Split the token-sorted form of an entity into the n-gram blocks that
+    any form reaching the score cutoff must contain.
+
+    Two strings with lengths l1 and l2 have a ratio = 100 * (1 - d/(l1+l2)),
+    where d is their indel distance, and d >= |l1 - l2|. A form reaching the
+    score cutoff c (0-1) is thus at most d_max = 2 * (1 - c) * l1 / c edits
+    away from the entity. Each edit breaks at most one of d_max + 1
+    non-overlapping blocks of the entity, so at least one block is a
+    substring of the form (pigeonhole principle).
+
+    :param sorted_form: the token-sorted form of the entity
+    :type sorted_form: str
+    :param score_cutoff: min score (0-100) of the forms
+    :type score_cutoff: float
+    :return: blocks, or None if the entity is too short to be split (every
+        form may reach the score cutoff)
+    :rtype: list
+    """
+
+    if score_cutoff is None or score_cutoff <= 0 or sorted_form == '':
+        return None
+
+    cutoff = score_cutoff / 100
+    max_distance = int(2 * (1 - cutoff) * len(sorted_form) / cutoff + 1e-9)
+    num_blocks = max_distance + 1
+
+    if num_blocks > len(sorted_form):
+        return None
+
+    bounds = [len(sorted_form) * i // num_blocks
+        for i in range(num_blocks + 1)]
+
+    return [sorted_form[bounds[i]:bounds[i + 1]] for i in range(num_blocks)]
+
+
+def get_length_range(length, score_cutoff):
+    """Get the range of lengths of the forms that may reach the score cutoff
+    against an entity with given length: since |l1 - l2| <= d, the ratio is
+    only above the cutoff c (0-1) if 
+    l1 * c / (2 - c) <= l2 <= l1 * (2 - c) / c.
+
+    :return: min_length and max_length
+    :rtype: tuple (int, int)
+    """
+
+    cutoff = score_cutoff / 100
+    min_length = int(np.ceil(length * cutoff / (2 - cutoff) - 1e-9))
+    max_length = int(np.floor(length * (2 - cutoff) / cutoff + 1e-9))
+
+    return min_length, max_length
+
+
+def hash_block(block):
+    """Polynomial hash (mod 2^64) of a byte string, equal to the window
+    hashes calculated by hash_windows."""
+
+    block_hash = 0
+
+    for byte in block:
+        block_hash = (block_hash * hash_base + byte) & hash_mask
+
+    return block_hash
+
+
+def hash_windows(buffer, length):
+    """Polynomial hashes (mod 2^64) of every window of given length in a byte
+    buffer."""
+
+    num_windows = len(buffer) - length + 1
+    window_hashes = np.zeros(num_windows, dtype=np.uint64)
+
+    for j in range(length):
+        window_hashes *= np.uint64(hash_base)
+        window_hashes += buffer[j:j + num_windows]
+
+    return window_hashes
+
+
+def get_sub_lexicon(lexicon, entities_text, score_cutoff):
+    """Get the indexes of the lexicon forms that contain at least one n-gram
+    block (see get_blocks) of some of the given entities and whose length is
+    within the length range (see get_length_range) of that entity. Each block
+    length is searched with a single pass of rolling hashes over all the 
+    token-sorted forms. Hash collisions may only add forms to the 
+    sub-lexicon.
+
+    :param lexicon: names and synonyms of the KB
+    :type lexicon: Lexicon object
+    :param entities_text: surface forms of the entities that will be
+        searched in the lexicon
+    :type entities_text: list
+    :param score_cutoff: min score (0-100) of the candidates
+    :type score_cutoff: float
+    :return: indices, the indexes of the sub-lexicon forms in ascending order
+    :rtype: Numpy array
+    """
+
+    # The widest length range of the entities with each block, grouped by
+    # block length and block hash
+    blocks = {}
+
+    for entity_text in entities_text:
+        sorted_form = get_sorted_form(entity_text)
+        entity_blocks = get_blocks(sorted_form, score_cutoff)
+
+        if entity_blocks is None:
+            return lexicon.all_indices
+
+        min_length, max_length = get_length_range(
+            len(sorted_form), score_cutoff)
+
+        for block in entity_blocks:
+            block = block.encode('utf-8')
+            length_blocks = blocks.setdefault(len(block), {})
+            block_hash = hash_block(block)
+            block_range = (min_length, max_length)
+
+            if block_hash in length_blocks:
+                block_range = (
+                    min(min_length, length_blocks[block_hash][0]),
+                    max(max_length, length_blocks[block_hash][1]))
+
+            length_blocks[block_hash] = block_range
+
+    if blocks == {}:
+        return np.zeros(0, dtype=np.int64)
+
+    # All the forms in a single buffer, separated by line breaks
+    encoded_forms = [form.encode('utf-8') for form in lexicon.sorted_forms]
+    starts = np.zeros(len(encoded_forms), dtype=np.int64)
+    np.cumsum(
+        [len(form) + 1 for form in encoded_forms[:-1]], out=starts[1:])
+    buffer = np.frombuffer(b'\n'.join(encoded_forms), dtype=np.uint8)
+
+    form_lengths = np.array(
+        [len(form) for form in lexicon.sorted_forms], dtype=np.int64)
+    selected = np.zeros(len(encoded_forms), dtype=bool)
+
+    for length in sorted(blocks.keys()):
+
+        if length > len(buffer):
+            continue
+
+        block_hashes = np.array(
+            sorted(blocks[length].keys()), dtype=np.uint64)
+        length_ranges = np.array(
+            [blocks[length][block_hash] for block_hash in 
+            sorted(blocks[length].keys())], dtype=np.int64)
+
+        # Windows whose hash is the hash of some block
+        window_hashes = hash_windows(buffer, length)
+        matches = np.searchsorted(block_hashes, window_hashes)
+        matches[matches == len(block_hashes)] = 0
+        positions = np.flatnonzero(block_hashes[matches] == window_hashes)
+        matches = matches[positions]
+
+        forms = np.searchsorted(starts, positions, side='right') - 1
+        within_range = \
+            (form_lengths[forms] >= length_ranges[matches, 0]) & \
+            (form_lengths[forms] <= length_ranges[matches, 1])
+        selected[forms[within_range]] = True
+
+    return np.flatnonzero(selected)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""This module checks the hierarchical relations between the concepts of
+MeSH-based KBs (mesh_dis, mesh_chem) with their tree numbers: a concept is an
+ancestor of another if one of its tree numbers is a prefix (up to a '.') of a
+tree number of the other, e.g. 'C04.557' is an ancestor of 'C04.557.337', so
+the relations are found without traversing the graph."""
+
+import json
+import numpy as np
+
+
+def get_tree_prefixes(tree_number):
+    """Get the tree numbers of the ancestors of given tree number, including
+    the tree category (the root of the tree).
+
+    :param tree_number: e.g. 'C04.557.337'
+    :type tree_number: str
+    :return: prefixes
+    :rtype: list
+
+    >>> get_tree_prefixes('C04.557.337')
+    ['C', 'C04', 'C04.557']
+    """
+
+    segments = tree_number.split('.')
+    prefixes = ['.'.join(segments[:i]) for i in range(1, len(segments))]
+
+    if len(tree_number) > 1:
+        prefixes.insert(0, tree_number[0])
+
+    return prefixes
+
+
+class TreeNumberIndex:
+    """Represent the tree numbers of the concepts of a MeSH-based KB. It has
+    the same interface of ReachabilityIndex used by the link builder."""
+
+    def __init__(self, id_to_tree_numbers):
+        """
+        :param id_to_tree_numbers: tree numbers of each KB concept, with
+            format {kb_id: [tree_number]}
+        :type id_to_tree_numbers: dict
+        """
+
+        self.id_to_tree_numbers = id_to_tree_numbers
+
+    def is_ancestor(self, c1, c2):
+        """Check if the KB concept c2 is an ancestor of the KB concept c1."""
+
+        ancestor_numbers = set(self.id_to_tree_numbers.get(c2, []))
+
+        return any(prefix in ancestor_numbers
+            for tree_number in self.id_to_tree_numbers.get(c1, [])
+            for prefix in get_tree_prefixes(tree_number))
+
+    def is_related(self, c1, c2):
+        """Check if one of the given KB concepts is an ancestor of the other.
+
+        :param c1: knowledge base identifier of concept 1
+        :type c1: str
+        :param c2: knowledge base identifier of concept 2
+        :type c2: str
+        :return: related, False if any of the concepts has no tree numbers
+        :rtype: bool
+        """
+
+        return self.is_ancestor(c1, c2) or self.is_ancestor(c2, c1)
+
+    def get_related_matrix(self, urls):
+        """Check which pairs of the given KB concepts are the same concept or
+        have one concept as ancestor of the other. The owners of each tree
+        number are indexed, so every concept is checked against the others
+        by looking up the prefixes of its own tree numbers.
+
+        :param urls: distinct knowledge base identifiers
+        :type urls: list
+        :return: related, where related[a, b] is True if urls[a] and urls[b]
+            are related
+        :rtype: Numpy array
+        """
+
+        related = np.eye(len(urls), dtype=bool)
+        owners = {}
+
+        for a, url in enumerate(urls):
+
+            for tree_number in self.id_to_tree_numbers.get(url, []):
+                owners.setdefault(tree_number, []).append(a)
+
+        for b, url in enumerate(urls):
+
+            for tree_number in self.id_to_tree_numbers.get(url, []):
+
+                for prefix in get_tree_prefixes(tree_number):
+
+                    for a in owners.get(prefix, []):
+                        related[a, b] = True
+                        related[b, a] = True
+
+        return related
+
+
+def load_tree_number_index(filepath):
+    """Load the tree numbers of a MeSH-based KB stored by generate_dicts.py,
+    e.g. 'data/kbs/dicts/mesh_dis/id_to_tree_numbers.json'.
+
+    :return: tree_number_index
+    :rtype: TreeNumberIndex object
+    """
+
+    with open(filepath, 'r') as tree_numbers_file:
+        id_to_tree_numbers = json.load(tree_numbers_file)
+        tree_numbers_file.close()
+
+    return TreeNumberIndex(id_to_tree_numbers)
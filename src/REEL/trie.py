@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""This module implements a compact, memory-mappable trie mapping the
+normalized surface forms (concept names and synonyms) of a KB to the
+respective surface form in the lexicon (see lexicon.Lexicon). It resolves
+exact, prefix and suffix-stripped lookups without fuzzy matching."""
+
+import os
+import re
+import numpy as np
+
+
+#-----------------------------------------------------------------------------
+#                       Normalization of surface forms
+#-----------------------------------------------------------------------------
+GREEK_LETTERS = str.maketrans({
+    'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta', 'ε': 'epsilon',
+    'ζ': 'zeta', 'η': 'eta', 'θ': 'theta', 'ι': 'iota', 'κ': 'kappa',
+    'λ': 'lambda', 'μ': 'mu', 'ν': 'nu', 'ξ': 'xi', 'ο': 'omicron',
+    'π': 'pi', 'ρ': 'rho', 'σ': 'sigma', 'τ': 'tau', 'υ': 'upsilon',
+    'φ': 'phi', 'χ': 'chi', 'ψ': 'psi', 'ω': 'omega'})
+
+# Inflectional suffixes removed (and replaced) in the suffix-stripped lookups,
+# in the order they are tried
+suffix_rules = [('ies', 'y'), ('s', '')]
+
+
+def normalize_form(text):
+    """Get the key of given string in the lexicon: casefold, spell out Greek
+    letters and replace each run of punctuation and whitespace by a single
+    space.
+
+    :param text: the string to normalize
+    :type text: str
+    :return: normalized_form
+    :rtype: str
+
+    >>> normalize_form("TNF-α  Receptor")
+    'tnf alpha receptor'
+    """
+
+    text = text.casefold().translate(GREEK_LETTERS)
+
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+
+def get_suffix_variants(key, uppercase=False):
+    """Get the variants of given normalized form without its inflectional
+    suffix. Suffixes are only removed from keys longer than 3 characters, so
+    that plural abbreviations (e.g. 'ms') are not mapped to unrelated
+    one-letter forms. A final 's' is not removed from keys ending in 'ss'
+    (e.g. 'illness') or from all-uppercase strings, which are usually
+    abbreviations (e.g. 'AIDS').
+
+    :param key: normalized form
+    :type key: str
+    :param uppercase: whether the string of given key is all uppercase,
+        defaults to False
+    :type uppercase: bool
+    :return: variants
+    :rtype: list
+
+    >>> get_suffix_variants('therapies')
+    ['therapy', 'therapie']
+    >>> get_suffix_variants('illness')
+    []
+    >>> get_suffix_variants('aids', uppercase=True)
+    []
+    """
+
+    if len(key) <= 3:
+        return []
+
+    return [key[:-len(suffix)] + replacement
+        for suffix, replacement in suffix_rules if key.endswith(suffix) and
+        not (suffix == 's' and (key.endswith('ss') or uppercase))]
+
+
+def pack_strings(strings):
+    """Encode a list of strings into a single UTF-8 byte buffer and the
+    offsets of each string in the buffer."""
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    return buffer, offsets
+
+
+class FormTrie:
+    """Represent the normalized surface forms of a lexicon as a flattened
+    trie: the keys are stored in lexicographic (byte) order in a single UTF-8
+    buffer, so each key is found by binary search. Each key points to the
+    index of one surface form in the lexicon: when several forms share a key,
+    the first one in the lexicon (names before synonyms, earlier entries of
+    the dicts before later ones) takes precedence. The arrays are stored as
+    .npy files and memory-mapped when loaded."""
+
+    array_names = ['keys', 'key_offsets', 'key_forms']
+
+    def __init__(self):
+
+        self.keys = None
+        self.key_offsets = None
+        self.key_forms = None
+
+    def __len__(self):
+
+        return len(self.key_offsets) - 1
+
+    def build(self, forms):
+        """Build the trie for the given surface forms.
+
+        :param forms: the surface forms of a lexicon, in its order
+        :type forms: iterable
+        """
+
+        entries = {}
+
+        for i, form in enumerate(forms):
+            key = normalize_form(form).encode('utf-8')
+
+            if key not in entries:
+                entries[key] = i
+
+        keys = sorted(entries.keys())
+        self.keys, self.key_offsets = pack_strings(
+            [key.decode('utf-8') for key in keys])
+        self.key_forms = np.array(
+            [entries[key] for key in keys], dtype=np.int64)
+
+    def save(self, dirpath):
+        """Output the trie arrays into .npy files in given dir."""
+
+        if not os.path.exists(dirpath):
+            os.mkdir(dirpath)
+
+        for array_name in self.array_names:
+            np.save(
+                os.path.join(dirpath, array_name + '.npy'),
+                getattr(self, array_name))
+
+    def load(self, dirpath):
+        """Memory-map the trie arrays stored in given dir."""
+
+        for array_name in self.array_names:
+            setattr(self, array_name, np.load(
+                os.path.join(dirpath, array_name + '.npy'), mmap_mode='r'))
+
+    def _key(self, i):
+
+        return self.keys[self.key_offsets[i]:self.key_offsets[i + 1]].tobytes()
+
+    def _bisect(self, key):
+        """Position of the first key that is not lower than given key."""
+
+        low = 0
+        high = len(self)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._key(middle) < key:
+                low = middle + 1
+
+            else:
+                high = middle
+
+        return low
+
+    def get(self, key):
+        """Look up an already normalized key.
+
+        :return: index of the surface form in the lexicon, or None if the key
+            is not in the trie
+        :rtype: int
+        """
+
+        key = key.encode('utf-8')
+        i = self._bisect(key)
+
+        if i < len(self) and self._key(i) == key:
+            return int(self.key_forms[i])
+
+        return None
+
+    def lookup(self, text):
+        """Exact lookup of the normalized form of given string.
+
+        :param text: e.g. an entity mention or an abbreviation long form
+        :type text: str
+        :return: index of the surface form in the lexicon, or None if there
+            is no match
+        :rtype: int
+        """
+
+        return self.get(normalize_form(text))
+
+    def get_prefix_range(self, key):
+        """Range of the keys that extend an already normalized key by one or
+        more whole words, i.e. that start with the key followed by a space.
+        As the keys are sorted, these keys are contiguous, and no key
+        includes the byte 0xff, which is not valid in UTF-8.
+
+        :return: start and end positions of the keys in the trie
+        :rtype: tuple (int, int)
+        """
+
+        prefix = key.encode('utf-8') + b' '
+
+        return self._bisect(prefix), self._bisect(prefix + b'\xff')
+
+    def lookup_prefix(self, text):
+        """Prefix lookup of the normalized form of given string: the match
+        is only accepted if a single key extends it by whole words (e.g. the
+        truncated long form 'duchenne muscular' -> 'duchenne muscular
+        dystrophy'), otherwise it is ambiguous.
+
+        :param text: e.g. an abbreviation long form
+        :type text: str
+        :return: index of the surface form in the lexicon, or None if there
+            is no match or more than one
+        :rtype: int
+        """
+
+        key = normalize_form(text)
+
+        if key == '':
+            return None
+
+        start, end = self.get_prefix_range(key)
+
+        if end - start == 1:
+            return int(self.key_forms[start])
+
+        return None
+
+    def lookup_variants(self, text):
+        """Lookup of the normalized form of given string without its
+        inflectional suffix (e.g. 'therapies' -> 'therapy').
+
+        :param text: e.g. an entity mention
+        :type text: str
+        :return: index of the surface form in the lexicon, or None if there
+            is no match
+        :rtype: int
+        """
+
+        for variant in get_suffix_variants(
+                normalize_form(text), uppercase=text.isupper()):
+            index = self.get(variant)
+
+            if index is not None:
+                return index
+
+        return None
@@ -1,4 +1,5 @@
 import bconv
+import hashlib
 import logging
 import os
 import json
@@ -14,6 +15,30 @@ candidate_string += "url:{4}\tname:{5}\tnormalName:{6}\tnormalWikiTitle:{7}\t\
     predictedType:{8}\n"
 
 
+def get_fingerprint(filepaths):
+    """Calculate a fingerprint of the content of the given files, which 
+    changes whenever any of the files changes.
+
+    :param filepaths: paths of the files
+    :type filepaths: list
+    :return: fingerprint, the hexadecimal SHA-1 digest of the files content
+    :rtype: str
+    """
+
+    digest = hashlib.sha1()
+
+    for filepath in filepaths:
+
+        with open(filepath, 'rb') as in_file:
+            
+            for block in iter(lambda: in_file.read(2**20), b''):
+                digest.update(block)
+            
+            in_file.close()
+    
+    return digest.hexdigest()
+
+
 def stringMatcher(entity_text, name_to_id, top_k):
     """
     Find top KB candidate for given entity according to lexical similarity 